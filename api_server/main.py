@@ -5,17 +5,18 @@
 
 import os
 import asyncio
+import hashlib
 import uuid
 import time
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from datetime import datetime
+from dataclasses import asdict, replace
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Query, Depends, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
-import io
 import uvicorn
 from dotenv import load_dotenv
 import sys
@@ -64,6 +65,12 @@ progress_storage: Dict[str, Dict[str, Any]] = {}
 # 知识库实例缓存
 rag_instances_cache: Dict[str, SupabaseRAG] = {}
 
+# 上传文件格式校验规则（导入时构建一次，避免每个请求重复创建）
+CHUNK_UPLOAD_EXTENSIONS = frozenset({'.txt', '.pdf', '.docx', '.doc', '.md'})
+FILE_UPLOAD_EXTENSIONS = frozenset({'.txt', '.pdf', '.docx', '.doc', '.md', '.xlsx', '.pptx', '.png', '.jpg', '.jpeg'})
+CHUNK_UPLOAD_EXTENSIONS_TEXT = ', '.join(sorted(CHUNK_UPLOAD_EXTENSIONS))
+FILE_UPLOAD_EXTENSIONS_TEXT = ', '.join(sorted(FILE_UPLOAD_EXTENSIONS))
+
 
 # Pydantic模型定义
 
@@ -122,6 +129,12 @@ class QueryRequest(BaseModel):
     )
     top_k: Optional[int] = Field(default=5, description="返回结果数量")
     threshold: Optional[float] = Field(default=0.7, description="相似度阈值")
+    preview_chars: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description="来源内容预览的最大字符数，不指定时返回默认的200字符预览"
+    )
+    include_metadata: bool = Field(default=True, description="来源是否包含分块元数据")
 
 
 class QueryResponse(BaseModel):
@@ -133,6 +146,17 @@ class QueryResponse(BaseModel):
     knowledge_base: str
 
 
+class BatchQueryRequest(BaseModel):
+    """批量查询请求模型"""
+    queries: List[QueryRequest] = Field(..., description="查询列表，逐条按单次查询处理")
+
+
+class BatchQueryResponse(BaseModel):
+    """批量查询响应模型"""
+    results: List[Dict[str, Any]]
+    processing_time: float
+
+
 class ChunkSearchRequest(BaseModel):
     """分块搜索请求"""
     query: str
@@ -194,8 +218,16 @@ def get_rag_config() -> RAGConfig:
         chunk_size=int(os.getenv("CHUNK_SIZE", "1000")),
         chunk_overlap=int(os.getenv("CHUNK_OVERLAP", "200")),
         top_k=int(os.getenv("TOP_K", "5")),
+        embedding_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "0")) or None,
+        embedding_concurrency=int(os.getenv("EMBEDDING_CONCURRENCY", "5")),
+        embedding_max_tokens=int(os.getenv("EMBEDDING_MAX_TOKENS", "0")) or None,
+        embedding_dimension=int(os.getenv("EMBEDDING_DIMENSION", "1536")),
+        index_type=os.getenv("VECTOR_INDEX_TYPE", "hnsw"),
+        distance_strategy=os.getenv("VECTOR_DISTANCE_STRATEGY", "cosine"),
         temperature=float(os.getenv("TEMPERATURE", "0.7")),
         max_tokens=int(os.getenv("MAX_TOKENS", "2048")),
+        semantic_cache_threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+        semantic_cache_size=int(os.getenv("SEMANTIC_CACHE_SIZE", "256")),
         http_proxy=os.getenv("HTTP_PROXY"),
         https_proxy=os.getenv("HTTPS_PROXY"),
         no_proxy=os.getenv("NO_PROXY")
@@ -281,9 +313,27 @@ def update_task_progress(task_id: str, status: str, progress: float, message: st
         }
 
 
+# 上传文件读取时每次读取的块大小
+UPLOAD_READ_CHUNK_SIZE = 1024 * 1024
+
+
+async def read_upload_with_hash(file: UploadFile) -> Tuple[bytes, str]:
+    """分块读取上传文件，读取的同时计算SHA-256，避免之后再完整扫描一遍内容"""
+    hasher = hashlib.sha256()
+    parts = []
+    while True:
+        chunk = await file.read(UPLOAD_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        hasher.update(chunk)
+        parts.append(chunk)
+    return b"".join(parts), hasher.hexdigest()
+
+
 # 异步任务处理函数
 
-async def process_file_for_chunks(task_id: str, file_content: bytes, filename: str, knowledge_base: str):
+async def process_file_for_chunks(task_id: str, file_content: bytes, filename: str, knowledge_base: str,
+                                  file_hash: Optional[str] = None):
     """异步处理文件分块（只分块处理，不保存原始文件）"""
     try:
         update_task_progress(task_id, "processing", 0.1, "开始处理文件...")
@@ -292,11 +342,11 @@ async def process_file_for_chunks(task_id: str, file_content: bytes, filename: s
 
         update_task_progress(task_id, "processing", 0.3, "解析文件内容并分块...")
 
-        # 只分块，不保存原始文件
-        success = rag.add_chunks_only(file_content, filename)
+        # 只分块，不保存原始文件（阻塞调用放到线程中执行，避免占用事件循环）
+        success = await asyncio.to_thread(rag.add_chunks_only, file_content, filename, file_hash)
         
         if success:
-            chunk_count = rag.get_chunk_count()
+            chunk_count = await asyncio.to_thread(rag.get_chunk_count)
             update_task_progress(
                 task_id, "completed", 1.0, "文件分块处理完成",
                 result={
@@ -314,7 +364,8 @@ async def process_file_for_chunks(task_id: str, file_content: bytes, filename: s
         update_task_progress(task_id, "failed", 1.0, "文件分块处理失败", error=str(e))
 
 
-async def process_file_upload(task_id: str, file_content: bytes, filename: str, knowledge_base: str):
+async def process_file_upload(task_id: str, file_content: bytes, filename: str, knowledge_base: str,
+                              file_hash: Optional[str] = None):
     """异步处理文件上传（只保存原始文件）"""
     try:
         update_task_progress(task_id, "processing", 0.1, "开始上传文件...")
@@ -323,8 +374,8 @@ async def process_file_upload(task_id: str, file_content: bytes, filename: str,
         
         update_task_progress(task_id, "processing", 0.5, "保存原始文件...")
         
-        # 只保存原始文件，不分块
-        success = rag.store_raw_file_only(file_content, filename)
+        # 只保存原始文件，不分块（阻塞调用放到线程中执行）
+        success = await asyncio.to_thread(rag.store_raw_file_only, file_content, filename, file_hash)
         
         if success:
             update_task_progress(
@@ -527,12 +578,15 @@ async def delete_knowledge_base(kb_name: str):
         if not kb_response.data:
             raise HTTPException(status_code=404, detail="知识库不存在")
         
-        # 删除该知识库下的所有内容
-        result = rag.clear_knowledge_base(kb_name)
+        # 通过该知识库自己的实例清空内容，使其查询缓存和元数据缓存一并失效
+        result = get_rag_instance(kb_name).clear_knowledge_base(kb_name)
         
         if result:
-            # 删除知识库记录
+            # 删除知识库记录，并丢弃缓存的实例，同名知识库重建后不会沿用旧实例的缓存
             rag.supabase.table("knowledge_bases").delete().eq("name", kb_name).execute()
+            instance = rag_instances_cache.pop(kb_name, None)
+            if instance is not None and instance is not rag and instance._db_engine is not None:
+                instance._db_engine.dispose()
             return {"message": f"知识库 '{kb_name}' 及其所有内容已删除"}
         else:
             raise HTTPException(status_code=500, detail="删除知识库失败")
@@ -546,11 +600,15 @@ async def delete_knowledge_base(kb_name: str):
 # 文件管理API（按知识库层级）
 
 @app.get("/api/v1/knowledge-bases/{kb_name}/files", response_model=List[FileInfo])
-async def list_files_in_knowledge_base(kb_name: str):
+async def list_files_in_knowledge_base(
+    kb_name: str,
+    page: int = Query(0, ge=0, description="页码（从0开始）"),
+    page_size: int = Query(0, ge=0, le=500, description="每页文件数，0表示返回全部")
+):
     """获取指定知识库的文件列表"""
     try:
         rag = get_rag_instance(kb_name)  # 使用指定的知识库
-        files = rag.get_files_by_knowledge_base(kb_name)
+        files = rag.get_files_by_knowledge_base(kb_name, page=page, page_size=page_size)
         return files
     except Exception as e:
         logger.error(f"获取知识库文件列表失败: {str(e)}")
@@ -561,7 +619,7 @@ async def list_files_in_knowledge_base(kb_name: str):
 async def get_file_info_in_knowledge_base(kb_name: str, file_id: str):
     """获取指定知识库中的单个文件信息"""
     try:
-        rag = get_rag_instance()
+        rag = get_rag_instance(kb_name)  # 与删除共用同一实例的元数据缓存
         file_info = rag.get_single_file_info_by_kb(file_id, kb_name)
         if not file_info:
             raise HTTPException(status_code=404, detail="文件不存在")
@@ -609,17 +667,16 @@ async def upload_file_for_chunks(
     """上传文件进行分块处理（用于RAG查询，不保存原始文件）"""
     try:
         # 检查文件类型
-        allowed_extensions = {'.txt', '.pdf', '.docx', '.doc', '.md'}
         file_extension = Path(file.filename).suffix.lower()
         
-        if file_extension not in allowed_extensions:
+        if file_extension not in CHUNK_UPLOAD_EXTENSIONS:
             raise HTTPException(
                 status_code=400,
-                detail=f"不支持的文件格式: {file_extension}。支持的格式: {', '.join(allowed_extensions)}"
+                detail=f"不支持的文件格式: {file_extension}。支持的格式: {CHUNK_UPLOAD_EXTENSIONS_TEXT}"
             )
         
-        # 读取文件内容
-        file_content = await file.read()
+        # 读取文件内容（边读边计算哈希，供重复文件快速判断）
+        file_content, file_hash = await read_upload_with_hash(file)
         
         if len(file_content) == 0:
             raise HTTPException(status_code=400, detail="文件内容为空")
@@ -636,7 +693,8 @@ async def upload_file_for_chunks(
             task_id, 
             file_content, 
             file.filename, 
-            kb_name
+            kb_name,
+            file_hash
         )
         
         logger.info(f"文档上传任务已创建: {file.filename}, task_id: {task_id}")
@@ -690,17 +748,16 @@ async def upload_file(
     """上传原始文件（只保存，不分块处理）"""
     try:
         # 检查文件类型
-        allowed_extensions = {'.txt', '.pdf', '.docx', '.doc', '.md', '.xlsx', '.pptx', '.png', '.jpg', '.jpeg'}
         file_extension = Path(file.filename).suffix.lower()
         
-        if file_extension not in allowed_extensions:
+        if file_extension not in FILE_UPLOAD_EXTENSIONS:
             raise HTTPException(
                 status_code=400,
-                detail=f"不支持的文件格式: {file_extension}。支持的格式: {', '.join(allowed_extensions)}"
+                detail=f"不支持的文件格式: {file_extension}。支持的格式: {FILE_UPLOAD_EXTENSIONS_TEXT}"
             )
         
-        # 读取文件内容
-        file_content = await file.read()
+        # 读取文件内容（同时计算文件哈希，供去重使用）
+        file_content, file_hash = await read_upload_with_hash(file)
         
         if len(file_content) == 0:
             raise HTTPException(status_code=400, detail="文件内容为空")
@@ -717,7 +774,8 @@ async def upload_file(
             task_id, 
             file_content, 
             file.filename, 
-            kb_name
+            kb_name,
+            file_hash
         )
         
         logger.info(f"文件上传任务已创建: {file.filename}, task_id: {task_id}")
@@ -752,14 +810,13 @@ async def download_file(file_id: str, knowledge_base: str = Query("default", des
         # URL编码文件名以支持中文
         encoded_filename = quote(filename, safe='')
         
-        # 返回文件下载响应
+        # 返回文件下载响应（内容已是完整的bytes，直接作为响应体，无需再包装成流逐块发送）
         # 使用RFC 2231标准格式支持中文文件名
-        return StreamingResponse(
-            io.BytesIO(file_content),
+        return Response(
+            content=file_content,
             media_type=content_type,
             headers={
-                "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}",
-                "Content-Length": str(len(file_content))
+                "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"
             }
         )
     
@@ -829,7 +886,7 @@ async def clear_knowledge_base_content(kb_name: str):
 @app.post("/api/v1/chunks/search", response_model=ChunkSearchResponse)
 async def search_chunks(request: ChunkSearchRequest):
     """搜索文档分块"""
-    start_time = time.time()
+    start_time = time.perf_counter()
 
     try:
         rag = get_rag_instance(request.knowledge_base)
@@ -840,12 +897,12 @@ async def search_chunks(request: ChunkSearchRequest):
                 chunks=[],
                 total=0,
                 query=request.query,
-                processing_time=time.time() - start_time
+                processing_time=time.perf_counter() - start_time
             )
         
         # 执行相似性搜索
-        docs = rag.vector_store.similarity_search(
-            request.query,
+        docs = rag.search_by_vector(
+            rag.embedding_model.embed_query(request.query),
             k=request.limit
         )
         
@@ -859,7 +916,7 @@ async def search_chunks(request: ChunkSearchRequest):
             )
             chunks.append(chunk)
         
-        processing_time = time.time() - start_time
+        processing_time = time.perf_counter() - start_time
         
         return ChunkSearchResponse(
             chunks=chunks,
@@ -876,13 +933,13 @@ async def search_chunks(request: ChunkSearchRequest):
 @app.get("/api/v1/chunks/{chunk_metadata_id}/details", response_model=ChunkSearchResponse)
 async def get_chunk_details(chunk_metadata_id: str, knowledge_base: str = Query("default", description="知识库名称")):
     """获取指定分块元数据的所有分块详情"""
-    start_time = time.time()
+    start_time = time.perf_counter()
 
     try:
         rag = get_rag_instance(knowledge_base)
         chunks = rag.get_chunks_by_metadata_id(chunk_metadata_id)
         
-        processing_time = time.time() - start_time
+        processing_time = time.perf_counter() - start_time
         
         return ChunkSearchResponse(
             chunks=chunks,
@@ -899,13 +956,13 @@ async def get_chunk_details(chunk_metadata_id: str, knowledge_base: str = Query(
 @app.get("/api/v1/files/{file_id}/chunks", response_model=ChunkSearchResponse)
 async def get_file_chunks(file_id: str, knowledge_base: str = Query("default", description="知识库名称")):
     """获取指定文件的所有分块"""
-    start_time = time.time()
+    start_time = time.perf_counter()
 
     try:
         rag = get_rag_instance(knowledge_base)
         chunks = rag.get_file_chunks(file_id)
         
-        processing_time = time.time() - start_time
+        processing_time = time.perf_counter() - start_time
         
         return ChunkSearchResponse(
             chunks=chunks,
@@ -921,6 +978,34 @@ async def get_file_chunks(file_id: str, knowledge_base: str = Query("default", d
 
 # 问答API
 
+def _project_sources(sources: List[Dict[str, Any]], request: QueryRequest) -> List[Dict[str, Any]]:
+    """按请求裁剪来源：缩短内容预览、去掉元数据，只返回客户端需要的字段"""
+    limit = request.preview_chars
+    if limit is None and request.include_metadata:
+        return sources
+    
+    projected = []
+    for source in sources:
+        source = dict(source)
+        if limit is not None and len(source.get("content", "")) > limit:
+            source["content"] = source["content"][:limit] + "..."
+        if not request.include_metadata:
+            source.pop("metadata", None)
+        projected.append(source)
+    return projected
+
+
+def _search_knowledge_base(rag: SupabaseRAG, kb_name: str, query_vector: List[float], k: int) -> list:
+    """在单个知识库中按向量检索，并在结果上标注知识库来源（知识库为空时返回空列表）"""
+    if rag.get_chunk_count() == 0 or not rag.vector_store:
+        return []
+    
+    docs = rag.search_by_vector(query_vector, k=k)
+    for doc in docs:
+        doc.metadata["knowledge_base"] = kb_name
+    return docs
+
+
 @app.post("/api/v1/query", response_model=QueryResponse)
 async def query_knowledge_base(request: QueryRequest):
     """
@@ -959,7 +1044,7 @@ async def query_knowledge_base(request: QueryRequest):
       - 不指定：默认使用 "default" 知识库
     """
     try:
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         # 判断是单知识库查询还是跨知识库查询
         if request.knowledge_base and request.knowledge_base != "all":
@@ -971,17 +1056,17 @@ async def query_knowledge_base(request: QueryRequest):
                     answer=f"知识库 '{request.knowledge_base}' 为空，请先上传文档。",
                     sources=[],
                     query=request.question,
-                    processing_time=time.time() - start_time,
+                    processing_time=time.perf_counter() - start_time,
                     knowledge_base=request.knowledge_base
                 )
             
-            # 在指定知识库中查询
-            response = rag.query(request.question)
+            # 在指定知识库中查询（检索和生成在线程池中执行，不阻塞事件循环，批量查询的各条可并发）
+            response = await asyncio.to_thread(rag.query, request.question)
             logger.info(f"在知识库 '{request.knowledge_base}' 中查询完成: {request.question[:50]}...")
             
             return QueryResponse(
                 answer=response.answer,
-                sources=response.sources,
+                sources=_project_sources(response.sources, request),
                 query=request.question,
                 processing_time=response.processing_time,
                 knowledge_base=request.knowledge_base
@@ -1000,34 +1085,43 @@ async def query_knowledge_base(request: QueryRequest):
                     answer="系统中没有任何知识库，请先创建知识库并上传文档。",
                     sources=[],
                     query=request.question,
-                    processing_time=time.time() - start_time,
+                    processing_time=time.perf_counter() - start_time,
                     knowledge_base="all"
                 )
             
-            # 在所有知识库中搜索相关文档
-            all_sources = []
+            # 问题只向量化一次，各知识库复用同一个查询向量检索
+            query_vector = await asyncio.to_thread(rag_default.embedding_model.embed_query, request.question)
+            
+            # 实例按顺序获取（未缓存时需创建，避免并发重复创建），检索在线程池中并发执行，
+            # 总耗时取决于最慢的知识库而不是各知识库耗时之和
+            kb_instances = []
             for kb_name in knowledge_bases:
                 try:
-                    rag = get_rag_instance(kb_name)
-                    if rag.get_chunk_count() > 0 and rag.vector_store:
-                        # 使用相似度搜索获取相关文档
-                        docs = rag.vector_store.similarity_search(
-                            request.question,
-                            k=request.top_k or 3
-                        )
-                        for doc in docs:
-                            # 添加知识库来源信息
-                            doc.metadata["knowledge_base"] = kb_name
-                            all_sources.append(doc)
+                    kb_instances.append((kb_name, get_rag_instance(kb_name)))
                 except Exception as e:
                     logger.warning(f"从知识库 '{kb_name}' 检索失败: {str(e)}")
             
+            results = await asyncio.gather(
+                *(
+                    asyncio.to_thread(_search_knowledge_base, rag, kb_name, query_vector, request.top_k or 3)
+                    for kb_name, rag in kb_instances
+                ),
+                return_exceptions=True
+            )
+            
+            all_sources = []
+            for (kb_name, _), docs in zip(kb_instances, results):
+                if isinstance(docs, Exception):
+                    logger.warning(f"从知识库 '{kb_name}' 检索失败: {str(docs)}")
+                else:
+                    all_sources.extend(docs)
+            
             if not all_sources:
                 return QueryResponse(
                     answer="所有知识库都为空，请先上传文档。",
                     sources=[],
                     query=request.question,
-                    processing_time=time.time() - start_time,
+                    processing_time=time.perf_counter() - start_time,
                     knowledge_base="all"
                 )
             
@@ -1051,24 +1145,24 @@ async def query_knowledge_base(request: QueryRequest):
 
 请提供详细的答案，并在答案中标注信息来自哪个知识库："""
             
-            answer = rag.chat_model.invoke(prompt).content
+            answer = (await asyncio.to_thread(rag.chat_model.invoke, prompt)).content
             
-            # 处理源文档信息
-            sources = []
-            for doc in all_sources[:5]:  # 返回前5个源文档
-                source_info = {
-                    "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
+            # 处理源文档信息（返回前5个源文档，内容只保留前200字符作为预览）
+            sources = [
+                {
+                    "content": doc.page_content[:200] + ("..." if len(doc.page_content) > 200 else ""),
                     "metadata": doc.metadata,
                     "knowledge_base": doc.metadata.get("knowledge_base", "unknown")
                 }
-                sources.append(source_info)
+                for doc in all_sources[:5]
+            ]
             
-            processing_time = time.time() - start_time
+            processing_time = time.perf_counter() - start_time
             logger.info(f"跨知识库查询完成，搜索了 {len(knowledge_bases)} 个知识库: {request.question[:50]}...")
             
             return QueryResponse(
                 answer=answer,
-                sources=sources,
+                sources=_project_sources(sources, request),
                 query=request.question,
                 processing_time=processing_time,
                 knowledge_base="all"
@@ -1079,6 +1173,60 @@ async def query_knowledge_base(request: QueryRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# 单次批量查询允许的最大问题数
+BATCH_QUERY_MAX = 32
+
+
+@app.post("/api/v1/query/batch", response_model=BatchQueryResponse)
+async def query_knowledge_base_batch(request: BatchQueryRequest):
+    """
+    批量查询：多个问题合并为一次HTTP请求，省去逐条请求的往返开销
+    
+    每条查询的语义与 `/api/v1/query` 相同，各条并发执行、结果按请求顺序返回；
+    单条失败时该位置返回 `{"query": ..., "error": ...}`，不影响其他查询。
+    """
+    if len(request.queries) > BATCH_QUERY_MAX:
+        raise HTTPException(status_code=400, detail=f"单次批量查询最多 {BATCH_QUERY_MAX} 条")
+    
+    start_time = time.perf_counter()
+    responses = await asyncio.gather(
+        *(query_knowledge_base(query) for query in request.queries),
+        return_exceptions=True
+    )
+    
+    results = []
+    for query, response in zip(request.queries, responses):
+        if isinstance(response, HTTPException):
+            results.append({"query": query.question, "error": response.detail})
+        elif isinstance(response, BaseException):
+            raise response
+        else:
+            results.append(response.model_dump())
+    
+    return BatchQueryResponse(results=results, processing_time=time.perf_counter() - start_time)
+
+
+@app.post("/api/v1/query/stream")
+async def query_knowledge_base_stream(request: QueryRequest):
+    """
+    流式查询单个知识库，以纯文本分段返回回答（不支持 "all" 跨知识库查询）
+    """
+    if request.knowledge_base == "all":
+        raise HTTPException(status_code=400, detail="流式查询不支持跨知识库查询，请指定知识库名称")
+    
+    try:
+        rag = get_rag_instance(request.knowledge_base or "default")
+    except Exception as e:
+        logger.error(f"流式问答失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    # 同步生成器由StreamingResponse在线程池中迭代，不阻塞事件循环
+    return StreamingResponse(
+        rag.stream_query(request.question),
+        media_type="text/plain; charset=utf-8"
+    )
+
+
 # 任务管理API
 
 @app.get("/api/v1/tasks/{task_id}", response_model=TaskStatus)
@@ -1211,14 +1359,10 @@ async def update_config(request: ConfigRequest):
         # 获取当前配置
         current_config = get_rag_config()
         
-        # 更新配置
-        config_dict = current_config.__dict__.copy()
-        
-        for field, value in request.dict(exclude_unset=True).items():
-            if value is not None:
-                config_dict[field] = value
-        
-        new_config = RAGConfig(**config_dict)
+        # 在当前配置基础上合并更新项，保留环境变量中的其余配置
+        updates = request.dict(exclude_unset=True, exclude_none=True)
+        new_config = replace(current_config, **updates)
+        config_dict = asdict(new_config)
         
         # 创建新的RAG实例
         supabase_config = get_supabase_config()
@@ -1262,10 +1406,9 @@ async def refresh_knowledge_base_stats():
 async def debug_embeddings():
     """调试：查看embedding表的cmetadata内容"""
     try:
-        from sqlalchemy import create_engine, text
+        from sqlalchemy import text
         
-        supabase_config = get_supabase_config()
-        engine = create_engine(supabase_config.postgres_url)
+        engine = get_rag_instance()._db_engine  # 复用向量存储的连接池
         
         with engine.connect() as conn:
             # 查看几条embedding记录的cmetadata
@@ -1284,7 +1427,6 @@ async def debug_embeddings():
                     "collection_name": row[2]
                 })
         
-        engine.dispose()
         return {"embeddings": embeddings}
         
     except Exception as e:
@@ -1296,10 +1438,9 @@ async def debug_embeddings():
 async def debug_collections():
     """调试：查看所有collection和向量数据"""
     try:
-        from sqlalchemy import create_engine, text
+        from sqlalchemy import text
         
-        supabase_config = get_supabase_config()
-        engine = create_engine(supabase_config.postgres_url)
+        engine = get_rag_instance()._db_engine  # 复用向量存储的连接池
         
         result = {}
         
@@ -1345,7 +1486,6 @@ async def debug_collections():
             
             result["metadata"] = [{"id": str(row[0]), "file_id": str(row[1]) if row[1] else None, "filename": row[2], "collection_name": row[3], "chunk_count": row[4], "created_at": str(row[5])} for row in metadata]
         
-        engine.dispose()
         return result
         
     except Exception as e:
@@ -1357,12 +1497,11 @@ async def debug_collections():
 async def migrate_old_vectors():
     """迁移旧的documents collection向量到对应的知识库collection"""
     try:
-        from sqlalchemy import create_engine, text
+        from sqlalchemy import text
         import uuid
         
-        supabase_config = get_supabase_config()
         rag = get_rag_instance()
-        engine = create_engine(supabase_config.postgres_url)
+        engine = rag._db_engine  # 复用向量存储的连接池
         
         with engine.connect() as conn:
             # 1. 检查documents collection中的向量
@@ -1430,7 +1569,6 @@ async def migrate_old_vectors():
             
             conn.commit()
         
-        engine.dispose()
         
         # 刷新知识库统计
         rag._update_knowledge_base_stats()
@@ -1535,13 +1673,12 @@ async def clear_rag_cache():
 async def fix_orphan_chunks():
     """修复孤儿分块：为已存在的分块创建缺失的document_metadata记录"""
     try:
-        from sqlalchemy import create_engine, text
+        from sqlalchemy import text
         import uuid
         
         # 初始化配置
-        supabase_config = get_supabase_config()
         rag = get_rag_instance()
-        engine = create_engine(supabase_config.postgres_url)
+        engine = rag._db_engine  # 复用向量存储的连接池
         
         fixed_count = 0
         
@@ -1596,7 +1733,6 @@ async def fix_orphan_chunks():
                     fixed_count += 1
                     logger.info(f"为文件 {filename} 创建了document_metadata记录，分块数: {chunk_count}")
         
-        engine.dispose()
         
         # 刷新知识库统计
         rag._update_knowledge_base_stats()
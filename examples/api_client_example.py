@@ -5,10 +5,49 @@
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import copy
 import json
 import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
+
+try:
+    import orjson
+except ImportError:  # 可选依赖：uv add orjson
+    orjson = None
+
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def _dumps(data: Any) -> bytes:
+    """序列化请求体为UTF-8字节（中文不转义为\\uXXXX，体积约为默认序列化的一半）"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+def _loads(content: bytes) -> Any:
+    """解析响应体"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """为未显式指定timeout的请求设置默认超时的连接适配器"""
+    
+    def __init__(self, *args, timeout: float = 10, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+    
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
 
 
 class KnowledgeAPIClient:
@@ -22,16 +61,107 @@ class KnowledgeAPIClient:
     """
     """知识管理API客户端"""
     
-    def __init__(self, base_url: str = "http://localhost:8001"):
+    # 查询结果缓存的最大条目数，0表示禁用
+    QUERY_CACHE_SIZE = 256
+    
+    # 查询结果的缓存时间（秒），过期后重新请求以反映知识库内容的变化
+    QUERY_CACHE_TTL = 300
+    
+    # 允许重试POST的只读接口（查询、分块搜索）
+    RETRYABLE_POST_PATHS = ("/api/v1/query", "/api/v1/chunks/search")
+    
+    # 知识库列表的缓存时间（秒）
+    KB_CACHE_TTL = 60
+    
+    def __init__(self, base_url: str = "http://localhost:8001", timeout: float = 60):
         """
         初始化API客户端
         
         Args:
             base_url: API服务器地址
+            timeout: 默认请求超时（秒），查询需等待检索和LLM生成，不宜过短
         """
         self.base_url = base_url.rstrip('/')
         print(self.base_url)
         self.session = requests.Session()
+        # 连接池复用TCP连接，避免每次请求重新握手；服务端临时错误自动重试
+        adapter = self._build_adapter(timeout, Retry.DEFAULT_ALLOWED_METHODS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # 查询和分块搜索是只读的POST，只对这两类接口（按URL前缀挂载）重试POST；
+        # 上传、创建知识库等写操作重试可能产生重复任务
+        query_adapter = self._build_adapter(timeout, Retry.DEFAULT_ALLOWED_METHODS | {"POST"})
+        for path in self.RETRYABLE_POST_PATHS:
+            self.session.mount(f"{self.base_url}{path}", query_adapter)
+        # (接口, 参数) -> (过期时间, 响应)，重复的查询直接返回本地结果，不再触发服务端检索和LLM生成
+        self._query_cache: "OrderedDict[tuple, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # (过期时间, 知识库列表)，知识库很少变化，短时间内重复获取直接复用
+        self._kb_cache: Optional[Tuple[float, List[Dict[str, Any]]]] = None
+    
+    @staticmethod
+    def _build_adapter(timeout: float, allowed_methods) -> HTTPAdapter:
+        """创建带默认超时和重试策略的连接适配器"""
+        return TimeoutHTTPAdapter(
+            timeout=timeout,
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=Retry(
+                total=3,
+                # 读超时不重试：请求可能已在服务端执行（查询超时后重发会再触发一次LLM生成）
+                read=0,
+                backoff_factor=0.1,
+                # 退避时间叠加随机抖动，避免多个客户端同时重试
+                backoff_jitter=0.1,
+                # 服务端对业务错误（如知识库为空）也返回500，只重试网关/限流类的临时错误
+                status_forcelist=[429, 502, 503, 504],
+                respect_retry_after_header=True,
+                allowed_methods=allowed_methods
+            )
+        )
+    
+    def _cached_post(self, endpoint: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        带LRU缓存的POST查询
+        
+        缓存条目在QUERY_CACHE_TTL秒后过期；返回的是缓存结果的副本，调用方修改不会影响缓存
+        
+        Args:
+            endpoint: 接口路径
+            data: 请求体
+            
+        Returns:
+            响应结果
+        """
+        key = (endpoint, tuple(sorted(data.items())))
+        cached = self._query_cache.get(key)
+        if cached is not None:
+            if cached[0] > time.monotonic():
+                self._query_cache.move_to_end(key)
+                return copy.deepcopy(cached[1])
+            del self._query_cache[key]
+        
+        response = self.session.post(f"{self.base_url}{endpoint}", data=_dumps(data), headers=_JSON_HEADERS)
+        response.raise_for_status()
+        result = _loads(response.content)
+        
+        if self.QUERY_CACHE_SIZE > 0:
+            self._query_cache[key] = (time.monotonic() + self.QUERY_CACHE_TTL, copy.deepcopy(result))
+            while len(self._query_cache) > self.QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return result
+    
+    def invalidate_kb_cache(self):
+        """使缓存的知识库列表失效"""
+        self._kb_cache = None
+    
+    def clear_cache(self):
+        """清空查询缓存和知识库列表缓存（知识库内容变更后调用）"""
+        self._query_cache.clear()
+        self.invalidate_kb_cache()
+    
+    def close(self):
+        """关闭会话，释放连接池"""
+        self.session.close()
         
     def health_check(self) -> Dict[str, Any]:
         """健康检查"""
@@ -63,6 +193,7 @@ class KnowledgeAPIClient:
                 files=files
             )
             response.raise_for_status()
+            self.clear_cache()
             return response.json()
     
     def upload_file(self, file_path: str, knowledge_base: str = "default") -> Dict[str, Any]:
@@ -89,6 +220,7 @@ class KnowledgeAPIClient:
                 files=files
             )
             response.raise_for_status()
+            self.clear_cache()
             return response.json()
     
     def get_task_status(self, task_id: str) -> Dict[str, Any]:
@@ -114,9 +246,14 @@ class KnowledgeAPIClient:
         Returns:
             知识库列表
         """
+        if self._kb_cache is not None and self._kb_cache[0] > time.monotonic():
+            return copy.deepcopy(self._kb_cache[1])
+        
         response = self.session.get(f"{self.base_url}/api/v1/knowledge-bases")
         response.raise_for_status()
-        return response.json()
+        knowledge_bases = response.json()
+        self._kb_cache = (time.monotonic() + self.KB_CACHE_TTL, copy.deepcopy(knowledge_bases))
+        return knowledge_bases
     
     def get_knowledge_base_info(self, kb_name: str) -> Dict[str, Any]:
         """
@@ -146,6 +283,7 @@ class KnowledgeAPIClient:
         data = {"name": name, "description": description}
         response = self.session.post(f"{self.base_url}/api/v1/knowledge-bases", data=data)
         response.raise_for_status()
+        self.clear_cache()
         return response.json()
     
     def delete_knowledge_base(self, kb_name: str) -> Dict[str, Any]:
@@ -160,6 +298,7 @@ class KnowledgeAPIClient:
         """
         response = self.session.delete(f"{self.base_url}/api/v1/knowledge-bases/{kb_name}")
         response.raise_for_status()
+        self.clear_cache()
         return response.json()
     
     def clear_knowledge_base(self, kb_name: str) -> Dict[str, Any]:
@@ -174,6 +313,7 @@ class KnowledgeAPIClient:
         """
         response = self.session.delete(f"{self.base_url}/api/v1/knowledge-bases/{kb_name}/clear")
         response.raise_for_status()
+        self.clear_cache()
         return response.json()
     
     # 文件管理方法（按知识库）
@@ -232,6 +372,7 @@ class KnowledgeAPIClient:
             )
         
         response.raise_for_status()
+        self.clear_cache()
         return response.json()
     
     def upload_file_in_kb(self, kb_name: str, file_path: str) -> Dict[str, Any]:
@@ -257,6 +398,7 @@ class KnowledgeAPIClient:
             )
         
         response.raise_for_status()
+        self.clear_cache()
         return response.json()
     
     def list_tasks(self, limit: int = 10) -> List[Dict[str, Any]]:
@@ -300,14 +442,16 @@ class KnowledgeAPIClient:
         Returns:
             最终任务状态
         """
-        start_time = time.time()
+        deadline = time.monotonic() + timeout
         
-        while time.time() - start_time < timeout:
+        while time.monotonic() < deadline:
             status = self.get_task_status(task_id)
             
             print(f"任务状态: {status['status']}, 进度: {status['progress']:.1%}, 消息: {status['message']}")
             
             if status['status'] in ['completed', 'failed']:
+                # 后台任务写入的分块在完成时才可见，此前缓存的查询结果可能已过时
+                self.clear_cache()
                 return status
             
             time.sleep(2)
@@ -315,7 +459,8 @@ class KnowledgeAPIClient:
         raise TimeoutError(f"任务 {task_id} 在 {timeout} 秒内未完成")
     
     def query_knowledge_base(self, question: str, knowledge_base: str = "default", 
-                           top_k: int = 5) -> Dict[str, Any]:
+                           top_k: int = 5, preview_chars: Optional[int] = None,
+                           include_metadata: bool = True) -> Dict[str, Any]:
         """
         查询知识库（单个知识库）
         
@@ -323,6 +468,8 @@ class KnowledgeAPIClient:
             question: 问题
             knowledge_base: 知识库名称，默认为"default"
             top_k: 返回结果数量
+            preview_chars: 来源内容预览的最大字符数，只需预览时可减少响应体积
+            include_metadata: 来源是否包含分块元数据
             
         Returns:
             查询结果
@@ -330,15 +477,12 @@ class KnowledgeAPIClient:
         data = {
             "question": question,
             "knowledge_base": knowledge_base,
-            "top_k": top_k
+            "top_k": top_k,
+            "preview_chars": preview_chars,
+            "include_metadata": include_metadata
         }
         
-        response = self.session.post(
-            f"{self.base_url}/api/v1/query",
-            json=data
-        )
-        response.raise_for_status()
-        return response.json()
+        return self._cached_post("/api/v1/query", data)
     
     def query_all_knowledge_bases(self, question: str, top_k: int = 5) -> Dict[str, Any]:
         """
@@ -357,12 +501,25 @@ class KnowledgeAPIClient:
             "top_k": top_k
         }
         
+        return self._cached_post("/api/v1/query", data)
+    
+    def query_batch(self, queries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        批量查询，多个问题合并为一次请求
+        
+        Args:
+            queries: 查询列表，每项包含question，可选knowledge_base、top_k
+            
+        Returns:
+            与queries一一对应的结果列表，失败项包含error字段
+        """
         response = self.session.post(
-            f"{self.base_url}/api/v1/query",
-            json=data
+            f"{self.base_url}/api/v1/query/batch",
+            data=_dumps({"queries": queries}),
+            headers=_JSON_HEADERS
         )
         response.raise_for_status()
-        return response.json()
+        return _loads(response.content)["results"]
     
     def search_chunks(self, query: str, knowledge_base: str = "default", 
                      limit: int = 10, threshold: float = 0.7) -> Dict[str, Any]:
@@ -385,12 +542,7 @@ class KnowledgeAPIClient:
             "threshold": threshold
         }
         
-        response = self.session.post(
-            f"{self.base_url}/api/v1/chunks/search",
-            json=data
-        )
-        response.raise_for_status()
-        return response.json()
+        return self._cached_post("/api/v1/chunks/search", data)
     
     def list_chunks(self, knowledge_base: str = "default") -> List[Dict[str, Any]]:
         """
@@ -458,6 +610,7 @@ class KnowledgeAPIClient:
         """
         response = self.session.delete(f"{self.base_url}/api/v1/chunks/{chunk_metadata_id}")
         response.raise_for_status()
+        self.clear_cache()
         return response.json()
     
     def delete_file(self, file_id: str) -> Dict[str, Any]:
@@ -472,6 +625,7 @@ class KnowledgeAPIClient:
         """
         response = self.session.delete(f"{self.base_url}/api/v1/files/{file_id}")
         response.raise_for_status()
+        self.clear_cache()
         return response.json()
     
     def list_files(self, knowledge_base: str = "default") -> List[Dict[str, Any]]:
@@ -552,6 +706,7 @@ class KnowledgeAPIClient:
             params=params
         )
         response.raise_for_status()
+        self.clear_cache()
         return response.json()
     
     
@@ -581,9 +736,14 @@ class KnowledgeAPIClient:
             json=config_updates
         )
         response.raise_for_status()
+        self.clear_cache()
         return response.json()
 
 
+# 上传演示依次尝试的测试文件
+EXAMPLE_UPLOAD_FILES = ("README.md", "test.txt", "demo.pdf", "document.pdf")
+
+
 def main():
     """三层架构演示用法"""
     # 创建API客户端
@@ -610,10 +770,9 @@ def main():
         print("  - upload_file(): 只保存原始文件用于下载，不分块处理")
         
         # 尝试上传一个测试文件（如果存在的话）
-        test_files = ["README.md", "test.txt", "demo.pdf", "document.pdf"]
         uploaded_file = None
         
-        for test_file in test_files:
+        for test_file in EXAMPLE_UPLOAD_FILES:
             try:
                 from pathlib import Path
                 if Path(test_file).exists():
@@ -645,7 +804,8 @@ def main():
         # 4. 查询知识库
         print("\n4. 查询知识库...")
         try:
-            query_result = client.query_knowledge_base("什么是机器学习？")
+            # 只展示回答和来源数量，不需要来源的元数据
+            query_result = client.query_knowledge_base("什么是机器学习？", include_metadata=False)
             print(f"查询结果: {query_result['answer'][:100]}...")
             print(f"来源数量: {len(query_result['sources'])}")
         except requests.exceptions.HTTPError as e:
@@ -772,6 +932,8 @@ def main():
         print(f"API请求失败: {e}")
     except Exception as e:
         print(f"发生错误: {e}")
+    finally:
+        client.close()
 
 
 if __name__ == "__main__":
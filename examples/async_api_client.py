@@ -9,12 +9,15 @@ import aiohttp
 import json
 import time
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Sequence
 
 
 class AsyncKnowledgeAPIClient:
     """异步知识管理API客户端"""
     
+    # 同时进行的查询请求数上限，避免并发查询压垮服务端的检索和LLM推理
+    MAX_CONCURRENT_QUERIES = 8
+    
     def __init__(self, base_url: str = "http://localhost:8002"):
         """
         初始化异步API客户端
@@ -24,10 +27,13 @@ class AsyncKnowledgeAPIClient:
         """
         self.base_url = base_url.rstrip('/')
         self.session: Optional[aiohttp.ClientSession] = None
+        self._query_semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_QUERIES)
     
     async def __aenter__(self):
         """异步上下文管理器入口"""
-        self.session = aiohttp.ClientSession()
+        # 限制并发连接数并保持长连接，批量请求复用已建立的TCP连接
+        connector = aiohttp.TCPConnector(limit=50, keepalive_timeout=30)
+        self.session = aiohttp.ClientSession(connector=connector)
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
@@ -95,9 +101,9 @@ class AsyncKnowledgeAPIClient:
         Returns:
             最终任务状态
         """
-        start_time = time.time()
+        deadline = time.monotonic() + timeout
         
-        while time.time() - start_time < timeout:
+        while time.monotonic() < deadline:
             status = await self.get_task_status(task_id)
             
             print(f"任务状态: {status['status']}, 进度: {status['progress']:.1%}, 消息: {status['message']}")
@@ -128,7 +134,7 @@ class AsyncKnowledgeAPIClient:
             "top_k": top_k
         }
         
-        async with self.session.post(
+        async with self._query_semaphore, self.session.post(
             f"{self.base_url}/api/v1/query",
             json=data
         ) as response:
@@ -156,7 +162,7 @@ class AsyncKnowledgeAPIClient:
             "threshold": threshold
         }
         
-        async with self.session.post(
+        async with self._query_semaphore, self.session.post(
             f"{self.base_url}/api/v1/chunks/search",
             json=data
         ) as response:
@@ -182,7 +188,7 @@ class AsyncKnowledgeAPIClient:
             response.raise_for_status()
             return await response.json()
     
-    async def batch_query(self, questions: List[str], knowledge_base: str = "default") -> List[Dict[str, Any]]:
+    async def batch_query(self, questions: Sequence[str], knowledge_base: str = "default") -> List[Dict[str, Any]]:
         """
         批量查询（并发执行）
         
@@ -215,6 +221,15 @@ class AsyncKnowledgeAPIClient:
         return processed_results
 
 
+# 示例问题与搜索词
+EXAMPLE_QUESTIONS = (
+    "什么是机器学习？",
+    "深度学习的原理是什么？",
+    "人工智能的应用领域有哪些？",
+)
+EXAMPLE_SEARCH_QUERIES = ("机器学习", "深度学习", "神经网络")
+
+
 async def main():
     """异步示例用法"""
     async with AsyncKnowledgeAPIClient("http://localhost:8002") as client:
@@ -224,44 +239,36 @@ async def main():
             health = await client.health_check()
             print(f"服务状态: {health}")
             
-            # 2. 批量查询示例
-            print("\n2. 批量查询...")
-            questions = [
-                "什么是机器学习？",
-                "深度学习的原理是什么？",
-                "人工智能的应用领域有哪些？"
-            ]
-            
-            start_time = time.time()
-            results = await client.batch_query(questions)
-            end_time = time.time()
+            # 2-3. 批量查询与分块搜索互不依赖，同时发出，总耗时取决于较慢的一组
+            print("\n2. 批量查询 / 3. 并发搜索分块...")
+            start_time = time.perf_counter()
+            async with asyncio.TaskGroup() as tg:
+                batch_task = tg.create_task(client.batch_query(EXAMPLE_QUESTIONS))
+                search_task = tg.create_task(asyncio.gather(
+                    *(client.search_chunks(query) for query in EXAMPLE_SEARCH_QUERIES),
+                    return_exceptions=True
+                ))
+            results, search_results = batch_task.result(), search_task.result()
+            end_time = time.perf_counter()
             
-            print(f"批量查询完成，耗时: {end_time - start_time:.2f}秒")
+            print(f"批量查询与分块搜索完成，耗时: {end_time - start_time:.2f}秒")
             
+            # 结果先拼接成一段文本再一次性输出，避免逐行写终端
+            lines = []
             for i, result in enumerate(results):
                 if "error" in result:
-                    print(f"问题 {i+1}: {result['question']} - 错误: {result['error']}")
+                    lines.append(f"问题 {i+1}: {result['question']} - 错误: {result['error']}")
                 else:
-                    print(f"问题 {i+1}: {result['question']}")
-                    print(f"回答: {result['answer'][:100]}...")
-                    print()
+                    lines.append(f"问题 {i+1}: {result['query']}")
+                    lines.append(f"回答: {result['answer'][:100]}...\n")
             
-            # 3. 并发搜索分块
-            print("\n3. 并发搜索分块...")
-            search_queries = ["机器学习", "深度学习", "神经网络"]
-            
-            search_tasks = [
-                client.search_chunks(query)
-                for query in search_queries
-            ]
-            
-            search_results = await asyncio.gather(*search_tasks, return_exceptions=True)
-            
-            for i, result in enumerate(search_results):
+            for query, result in zip(EXAMPLE_SEARCH_QUERIES, search_results):
                 if isinstance(result, Exception):
-                    print(f"搜索 '{search_queries[i]}' 失败: {result}")
+                    lines.append(f"搜索 '{query}' 失败: {result}")
                 else:
-                    print(f"搜索 '{search_queries[i]}': 找到 {result['total']} 个分块")
+                    lines.append(f"搜索 '{query}': 找到 {result['total']} 个分块")
+            
+            print("\n".join(lines))
             
         except aiohttp.ClientError as e:
             print(f"HTTP请求失败: {e}")
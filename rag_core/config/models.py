@@ -19,16 +19,26 @@ class RAGConfig:
     chunk_size: int = 1000
     chunk_overlap: int = 200
     top_k: int = 5
+    embedding_batch_size: Optional[int] = None  # 单次嵌入请求的文本数，None表示按服务商取默认值
+    embedding_concurrency: int = 5  # 同时进行的嵌入请求数上限（受服务商限流约束）
+    embedding_max_tokens: Optional[int] = None  # 单条嵌入文本的token上限，超出截断；None表示按服务商取默认值
     
     # 向量库配置
     vector_store_type: str = "faiss"  # faiss, chroma, etc.
     vector_store_path: str = "./vector_store"
+    embedding_dimension: Optional[int] = 1536  # 向量维度，需与嵌入模型一致（建索引要求列声明维度）
+    index_type: str = "hnsw"  # 向量索引类型: hnsw, ivfflat, none
+    distance_strategy: str = "cosine"  # 检索距离: cosine, inner（写入时归一化向量，按内积检索）
     
     # 系统配置
     temperature: float = 0.7
     max_tokens: int = 2048
     timeout: int = 30
     
+    # 语义缓存配置
+    semantic_cache_threshold: float = 0.95  # 命中所需的最小余弦相似度
+    semantic_cache_size: int = 256  # 最大缓存条目数，0表示禁用
+    
     # 代理配置
     http_proxy: Optional[str] = None
     https_proxy: Optional[str] = None
@@ -54,15 +64,19 @@ class Document:
     def __post_init__(self):
         """文档内容预处理"""
         # 确保内容是字符串且非空
-        if not isinstance(self.content, str):
-            self.content = str(self.content)
-        
-        # 清理内容
-        self.content = self.content.strip()
-        
-        if not self.content:
+        content = self.content
+        if type(content) is not str:
+            content = str(content)
+
+        # 清理内容（首尾无空白时跳过strip，避免复制整段文本）
+        if content and (content[0].isspace() or content[-1].isspace()):
+            content = content.strip()
+
+        if not content:
             raise ValueError("文档内容不能为空")
 
+        self.content = content
+
 
 @dataclass
 class RAGResponse:
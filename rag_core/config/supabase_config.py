@@ -25,6 +25,14 @@ class SupabaseConfig(BaseModel):
     # Storage配置
     bucket_name: str = "documents"
     
+    # Storage S3协议访问密钥（配置后大文件使用分片并发上传）
+    s3_access_key_id: Optional[str] = None
+    s3_secret_access_key: Optional[str] = None
+    s3_region: str = "us-east-1"
+    
+    # 大文件按内容定义分块跨文件去重（需安装fastcdc并创建document_file_chunks表）
+    storage_chunk_dedup: bool = False
+    
     @classmethod
     def from_env(cls, env_dict: dict) -> "SupabaseConfig":
         """从环境变量创建配置"""
@@ -39,9 +47,34 @@ class SupabaseConfig(BaseModel):
             password=env_dict.get("SUPABASE_DB_PASSWORD"),
             table_name=env_dict.get("SUPABASE_TABLE_NAME", "documents"),
             collection_name=env_dict.get("SUPABASE_COLLECTION_NAME", "default"),
-            bucket_name=env_dict.get("SUPABASE_BUCKET_NAME", "documents")
+            bucket_name=env_dict.get("SUPABASE_BUCKET_NAME", "documents"),
+            s3_access_key_id=env_dict.get("SUPABASE_S3_ACCESS_KEY_ID"),
+            s3_secret_access_key=env_dict.get("SUPABASE_S3_SECRET_ACCESS_KEY"),
+            s3_region=env_dict.get("SUPABASE_S3_REGION", "us-east-1"),
+            storage_chunk_dedup=env_dict.get("SUPABASE_STORAGE_CHUNK_DEDUP", "false").lower() == "true"
         )
     
+    @property
+    def s3_endpoint(self) -> str:
+        """获取Storage的S3协议端点"""
+        return f"{self.url.rstrip('/')}/storage/v1/s3"
+    
+    @property
+    def storage_resumable_endpoint(self) -> str:
+        """
+        获取Storage的TUS断点续传端点
+        
+        托管项目使用存储专用域名（<project>.storage.supabase.co），绕过API网关的额外代理；
+        自建部署直接使用项目地址
+        """
+        from urllib.parse import urlparse
+        
+        parsed = urlparse(self.url)
+        host = parsed.netloc
+        if host.endswith(".supabase.co") and not host.endswith(".storage.supabase.co"):
+            host = host[:-len(".supabase.co")] + ".storage.supabase.co"
+        return f"{parsed.scheme}://{host}/storage/v1/upload/resumable"
+    
     @property
     def postgres_url(self) -> str:
         """获取PostgreSQL连接URL"""
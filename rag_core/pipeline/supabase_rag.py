@@ -1,17 +1,29 @@
 """基于Supabase的RAG流水线实现"""
 
+import binascii
+import hashlib
+import json
+import math
 import os
 import time
 import uuid
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import replace
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 
+import numpy as np
+import tiktoken
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_postgres import PGVector, PGEngine
 from langchain.schema import Document as LangchainDocument
 from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
+from langchain.chains.question_answering import load_qa_chain
+from langchain.prompts import ChatPromptTemplate
+from sqlalchemy import text
 from supabase import create_client, Client
 
 from ..config.models import RAGConfig, RAGResponse, Document, ProcessingProgress
@@ -19,12 +31,146 @@ from ..config.supabase_config import SupabaseConfig
 from ..utils.file_processor import FileProcessor
 from ..utils.text_splitter import SmartTextSplitter
 from ..utils.hybrid_storage import HybridFileStorage
+from ..utils.semantic_cache import SemanticCache
+from ..utils.ttl_cache import TTLCache
 from ..utils.logger import rag_logger
 
 
+# 问答提示模板（模块加载时解析一次，各实例共用）
+# 固定指令单独放在system消息中、位于最前，检索内容和问题放在其后的user消息里，
+# 使每次请求的提示前缀完全相同，可命中服务端的前缀缓存
+QA_SYSTEM_PROMPT = "使用用户提供的上下文信息回答用户的问题。如果上下文中没有相关信息，请直接说明无法找到相关信息。"
+
+QA_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", QA_SYSTEM_PROMPT),
+    ("human", "上下文信息:\n{context}\n\n问题: {question}")
+])
+
+# 热路径SQL（模块加载时构造一次）：各调用共用同一语句对象，SQLAlchemy直接命中引擎的编译缓存，
+# 无需每次重新构造和编译；服务端prepared statement因连接池限制已关闭，见_init_vector_store
+# 外层按距离重新排序：迭代扫描（relaxed_order）返回的候选顺序可能略有偏差
+_SQL_SEARCH_BY_VECTOR = {
+    operator: text(f"""
+        WITH candidates AS MATERIALIZED (
+            SELECT e.document, e.cmetadata, e.embedding {operator} CAST(:embedding AS vector) AS distance
+            FROM langchain_pg_embedding e
+            WHERE e.collection_id = :collection_uuid
+            ORDER BY distance
+            LIMIT :k
+        )
+        SELECT document, cmetadata FROM candidates ORDER BY distance
+    """)
+    for operator in ("<=>", "<#>")
+}
+
+_SQL_COUNT_CHUNKS = text("""
+    SELECT COUNT(*) FROM langchain_pg_embedding
+    WHERE collection_id = :collection_uuid
+""")
+
+_SQL_FILE_CHUNKS = text("""
+    SELECT jsonb_agg(jsonb_build_object(
+        'id', coalesce(cmetadata->>'chunk_id', replace(gen_random_uuid()::text, '-', '')),
+        'content', document,
+        'metadata', cmetadata
+    ))
+    FROM langchain_pg_embedding
+    WHERE collection_id = :collection_uuid
+    AND cmetadata->>'filename' = :filename
+""")
+
+_SQL_DELETE_FILE_VECTORS = text("""
+    DELETE FROM langchain_pg_embedding
+    WHERE collection_id = :collection_uuid
+    AND cmetadata->>'filename' = :filename
+""")
+
+_SQL_DELETE_COLLECTION_VECTORS = text("""
+    DELETE FROM langchain_pg_embedding
+    WHERE collection_id = :collection_uuid
+""")
+
+# 各服务商嵌入模型的特殊参数
+# 阿里云DashScope和本地服务不接受token数组输入，需要关闭上下文长度检查
+_PROVIDER_EMBEDDING_KWARGS = {
+    "dashscope": {"check_embedding_ctx_length": False},
+    "local": {"check_embedding_ctx_length": False},
+    "openai": {},
+}
+
+# 各服务商嵌入模型单条文本的默认token上限（None表示不截断）
+# 关闭上下文长度检查后超长文本会直接导致整批请求失败，需在发送前截断；
+# OpenAI接口由OpenAIEmbeddings自行按token切分，无需截断
+_PROVIDER_EMBEDDING_MAX_TOKENS = {
+    "dashscope": 2048,
+    "local": None,
+    "openai": None,
+}
+
+# 各服务商单次嵌入请求的默认文本数（DashScope接口单次最多10条）
+_PROVIDER_EMBEDDING_BATCH_SIZE = {
+    "dashscope": 10,
+    "local": 64,
+    "openai": 256,
+}
+
+
+@lru_cache(maxsize=32)
+def _detect_provider(base_url: str) -> str:
+    """根据API地址识别模型服务商"""
+    url = base_url.lower()
+    if "dashscope" in url:
+        return "dashscope"
+    if "localhost" in url or "127.0.0.1" in url:
+        return "local"
+    return "openai"
+
+
+@lru_cache(maxsize=32)
+def _get_encoding(model: str) -> tiktoken.Encoding:
+    """获取模型对应的tiktoken编码（非OpenAI模型使用cl100k_base近似计数）"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def _parse_version(version: Optional[str]) -> Tuple[int, ...]:
+    """将扩展版本号（如"0.8.0"）解析为可比较的元组，无法解析时返回空元组"""
+    try:
+        return tuple(int(part) for part in (version or "").split("."))
+    except ValueError:
+        return ()
+
+
 class SupabaseRAG:
     """基于Supabase的RAG实现类"""
     
+    # HNSW索引构建参数（pgvector默认值）
+    HNSW_M = 16
+    HNSW_EF_CONSTRUCTION = 64
+    
+    # HNSW查询时的候选列表大小：按top_k的倍数设置，不低于pgvector默认值40
+    HNSW_EF_SEARCH_FACTOR = 4
+    HNSW_EF_SEARCH_MIN = 40
+    
+    # 不支持迭代扫描的pgvector（< 0.8）上，分块数不超过此值的知识库改用精确扫描：
+    # 全局HNSW索引先取ef_search个候选再按collection_id过滤，小知识库会被大知识库的候选挤掉
+    HNSW_EXACT_SCAN_MAX_CHUNKS = 20000
+    
+    # IVFFlat查询时探测的聚类数（默认1召回率偏低）
+    IVFFLAT_PROBES = 10
+    
+    # 向量检索语句的超时时间（毫秒），避免异常查询长期占用连接池
+    DB_STATEMENT_TIMEOUT_MS = 30000
+    
+    # 文件列表只查询需要返回的列（document_files中可能存有原始文件内容等大字段）
+    FILE_LIST_COLUMNS = "id,filename,original_filename,content_type,file_size,file_hash,collection_name,created_at,updated_at"
+    
+    # 文件列表缓存的条目数和存活时间（秒）
+    META_CACHE_SIZE = 256
+    META_CACHE_TTL = 15
+    
     def __init__(self, config: RAGConfig, supabase_config: SupabaseConfig):
         """
         初始化RAG系统
@@ -49,6 +195,19 @@ class SupabaseRAG:
         self.chat_model = self._init_chat_model()
         self.embedding_model = self._init_embedding_model()
         
+        # 问答链只依赖提示模板和聊天模型，构建一次，检索器变化时复用
+        self.qa_prompt = QA_PROMPT
+        self.qa_chain = self._init_qa_chain()
+        
+        # 语义查询缓存（相似问题直接复用已有回答）
+        self.semantic_cache = SemanticCache(
+            threshold=config.semantic_cache_threshold,
+            max_size=config.semantic_cache_size
+        )
+        
+        # 文件列表等元数据查询的短期缓存（前端轮询时大部分请求无需访问数据库）
+        self._meta_cache = TTLCache(maxsize=self.META_CACHE_SIZE, ttl=self.META_CACHE_TTL)
+        
         # 初始化Supabase客户端
         self.supabase: Client = create_client(
             supabase_config.url,
@@ -58,7 +217,18 @@ class SupabaseRAG:
         # 初始化文件存储管理器
         self.file_storage = HybridFileStorage(
             supabase_client=self.supabase,
-            bucket_name=supabase_config.bucket_name
+            bucket_name=supabase_config.bucket_name,
+            s3_config={
+                "endpoint_url": supabase_config.s3_endpoint,
+                "aws_access_key_id": supabase_config.s3_access_key_id,
+                "aws_secret_access_key": supabase_config.s3_secret_access_key,
+                "region_name": supabase_config.s3_region,
+            } if supabase_config.s3_access_key_id and supabase_config.s3_secret_access_key else None,
+            resumable_config={
+                "endpoint": supabase_config.storage_resumable_endpoint,
+                "api_key": supabase_config.service_role_key or supabase_config.key,
+            },
+            chunk_dedup=supabase_config.storage_chunk_dedup
         )
         
         # 初始化PostgreSQL引擎
@@ -70,6 +240,7 @@ class SupabaseRAG:
         self.vector_store = None
         self.retrieval_chain = None
         self._db_engine = None  # 保存数据库引擎引用
+        self._hnsw_iterative_scan = False  # pgvector是否支持HNSW迭代扫描（>= 0.8）
         
         # 初始化向量存储
         self._init_vector_store()
@@ -113,30 +284,65 @@ class SupabaseRAG:
     def _init_embedding_model(self) -> OpenAIEmbeddings:
         """初始化嵌入模型"""
         try:
-            # 确定是否需要禁用上下文长度检查
-            check_embedding_ctx_length = True
-            
-            # 阿里云DashScope或本地服务特殊处理
-            if ("dashscope" in self.config.base_url.lower() or 
-                "localhost" in self.config.base_url.lower() or
-                "127.0.0.1" in self.config.base_url):
-                check_embedding_ctx_length = False
+            provider = _detect_provider(self.config.base_url)
             
             return OpenAIEmbeddings(
                 model=self.config.embedding_model,
                 openai_api_key=self.config.api_key,
                 openai_api_base=self.config.base_url,
                 timeout=self.config.timeout,
-                check_embedding_ctx_length=check_embedding_ctx_length  # 直接作为参数
+                chunk_size=self._embedding_batch_size(),
+                **_PROVIDER_EMBEDDING_KWARGS[provider]
             )
         except Exception as e:
             self.logger.error(f"嵌入模型初始化失败: {str(e)}")
             raise
     
+    def _embedding_batch_size(self) -> int:
+        """单次嵌入请求的文本数（未配置时按服务商取默认值）"""
+        if self.config.embedding_batch_size:
+            return self.config.embedding_batch_size
+        return _PROVIDER_EMBEDDING_BATCH_SIZE[_detect_provider(self.config.base_url)]
+    
+    def _embedding_max_tokens(self) -> Optional[int]:
+        """单条嵌入文本的token上限（未配置时按服务商取默认值）"""
+        if self.config.embedding_max_tokens:
+            return self.config.embedding_max_tokens
+        return _PROVIDER_EMBEDDING_MAX_TOKENS[_detect_provider(self.config.base_url)]
+    
+    def _truncate_for_embedding(self, texts: List[str]) -> List[str]:
+        """
+        将超出token上限的文本截断，避免单条超长文本导致整批嵌入请求失败
+        
+        Args:
+            texts: 待向量化的文本
+            
+        Returns:
+            List[str]: 截断后的文本（未超限的文本原样返回）
+        """
+        max_tokens = self._embedding_max_tokens()
+        if not max_tokens:
+            return texts
+        
+        try:
+            encoding = _get_encoding(self.config.embedding_model)
+            # encode_batch在tiktoken内部多线程批量编码
+            token_lists = encoding.encode_batch(texts, disallowed_special=())
+        except Exception as e:
+            self.logger.warning(f"文本token计数失败，跳过截断: {str(e)}")
+            return texts
+        
+        truncated = []
+        for chunk_text, tokens in zip(texts, token_lists):
+            if len(tokens) > max_tokens:
+                chunk_text = encoding.decode(tokens[:max_tokens])
+            truncated.append(chunk_text)
+        return truncated
+    
     def _init_vector_store(self):
         """初始化向量存储"""
         try:
-            # 清理旧的engine连接，避免prepared statement冲突
+            # 清理旧的engine连接
             if hasattr(self, '_db_engine') and self._db_engine is not None:
                 try:
                     self._db_engine.dispose()
@@ -151,13 +357,27 @@ class SupabaseRAG:
             from sqlalchemy import create_engine
             self._db_engine = create_engine(
                 connection_string,
+                # 语句超时不通过启动参数options设置：事务模式的连接池（Supabase 6543端口）
+                # 不接受启动参数，且超时不应作用于COPY等批量写入，只在检索事务内SET LOCAL
+                connect_args={
+                    # 关闭psycopg3的自动prepared statement：经连接池（pgbouncer/Supavisor）
+                    # 复用的后端连接上会出现DuplicatePreparedStatement冲突
+                    "prepare_threshold": None
+                },
                 pool_pre_ping=True,  # 连接前检查
-                pool_recycle=3600,   # 1小时后回收连接
-                pool_size=15,         # 连接池大小
-                max_overflow=10,     # 最大溢出连接数
+                pool_recycle=1800,   # 30分钟后回收连接
+                pool_size=20,         # 连接池大小
+                max_overflow=20,     # 最大溢出连接数
                 echo=False           # 关闭SQL日志，避免过多输出
             )
             
+            # 文件存储复用同一连接池直接读取数据库中的文件内容
+            self.file_storage.db_engine = self._db_engine
+            
+            if (self.config.index_type or "").lower() == "ivfflat":
+                from sqlalchemy import event
+                event.listen(self._db_engine, "connect", self._set_index_search_params)
+            
             # 使用业务层知识库名称作为collection，实现真正的多知识库隔离
             collection_name = self.supabase_config.collection_name or "default"
             
@@ -165,11 +385,21 @@ class SupabaseRAG:
                 embeddings=self.embedding_model,
                 collection_name=collection_name,  # 使用业务层知识库名称
                 connection=self._db_engine,  # 使用配置好的引擎
+                embedding_length=self.config.embedding_dimension,  # 新建表时声明向量维度，才能建立ANN索引
                 use_jsonb=True,
                 pre_delete_collection=False,  # 不要删除已存在的表
-                distance_strategy="cosine"  # 使用余弦相似度
+                distance_strategy=self.config.distance_strategy  # 默认余弦相似度；inner为内积（写入时归一化）
             )
             
+            # 缓存集合UUID（PGVector初始化时已确保集合存在），检索、计数和写入时
+            # 直接按collection_id过滤，不必每次按名称查询langchain_pg_collection
+            self._collection_uuids = {}
+            self._collection_uuid = self._get_collection_uuid(collection_name)
+            
+            # 确保向量列上有ANN索引，避免检索时全表扫描
+            self._ensure_vector_index()
+            self._ensure_metadata_index()
+            
             # 初始化检索链
             self._init_retrieval_chain()
             
@@ -179,39 +409,147 @@ class SupabaseRAG:
             self.logger.error(f"向量存储初始化失败: {str(e)}")
             raise
     
+    def _get_collection_uuid(self, collection_name: str):
+        """
+        按名称获取集合UUID（集合存在期间名称到UUID的映射不变，查到后缓存）
+        
+        Args:
+            collection_name: 集合（知识库）名称
+            
+        Returns:
+            集合UUID，集合不存在时返回None
+        """
+        if collection_name not in self._collection_uuids:
+            with self._db_engine.connect() as conn:
+                collection_uuid = conn.execute(
+                    text("SELECT uuid FROM langchain_pg_collection WHERE name = :name"),
+                    {"name": collection_name}
+                ).scalar()
+            if collection_uuid is None:
+                return None
+            self._collection_uuids[collection_name] = collection_uuid
+        return self._collection_uuids[collection_name]
+    
+    def _ensure_vector_index(self):
+        """确保langchain_pg_embedding表上存在向量索引（IF NOT EXISTS，已存在时开销很小）"""
+        index_type = (self.config.index_type or "none").lower()
+        if index_type == "none":
+            return
+        
+        if index_type not in ("hnsw", "ivfflat"):
+            self.logger.warning(f"不支持的向量索引类型: {index_type}，跳过索引创建")
+            return
+        
+        # 索引的运算符类必须与检索使用的距离一致，否则查询不会走索引
+        if self.config.distance_strategy == "inner":
+            ops, suffix = "vector_ip_ops", "_ip"
+        else:
+            ops, suffix = "vector_cosine_ops", ""
+        
+        try:
+            with self._db_engine.begin() as conn:
+                version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+                self._hnsw_iterative_scan = _parse_version(version) >= (0, 8)
+                
+                # 在已有数据上建索引可能超过连接默认的语句超时
+                conn.execute(text("SET LOCAL statement_timeout = 0"))
+                if index_type == "hnsw":
+                    conn.execute(text(f"""
+                        CREATE INDEX IF NOT EXISTS idx_langchain_pg_embedding_hnsw{suffix}
+                        ON langchain_pg_embedding USING hnsw (embedding {ops})
+                        WITH (m = {self.HNSW_M}, ef_construction = {self.HNSW_EF_CONSTRUCTION})
+                    """))
+                else:
+                    # ivfflat的聚类中心由建索引时的数据训练得到，空表上建索引没有意义
+                    row_count = conn.execute(text("SELECT COUNT(*) FROM langchain_pg_embedding")).scalar() or 0
+                    if row_count == 0:
+                        self.logger.info("向量表为空，暂不创建IVFFlat索引")
+                        return
+                    
+                    # pgvector建议：100万行以内 lists = rows / 1000，超过后 lists = sqrt(rows)
+                    if row_count <= 1_000_000:
+                        lists = max(row_count // 1000, 1)
+                    else:
+                        lists = int(math.sqrt(row_count))
+                    
+                    conn.execute(text(f"""
+                        CREATE INDEX IF NOT EXISTS idx_langchain_pg_embedding_ivfflat{suffix}
+                        ON langchain_pg_embedding USING ivfflat (embedding {ops})
+                        WITH (lists = {lists})
+                    """))
+            self.logger.info(f"{index_type.upper()}向量索引已就绪")
+        except Exception as e:
+            # 旧表的embedding列未声明维度时无法建索引，需先执行init_supabase.sql中的迁移语句
+            self.logger.warning(f"创建{index_type.upper()}向量索引失败，检索将使用全表扫描: {str(e)}")
+    
+    def _ensure_metadata_index(self):
+        """确保按集合和文件名查找分块时有表达式索引可用（分块列表、按文件删除都按此过滤）"""
+        try:
+            # CONCURRENTLY建索引不阻塞写入，但不能在事务中执行，需使用自动提交连接
+            with self._db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("SET statement_timeout = 0"))
+                try:
+                    # 之前CONCURRENTLY构建中断会留下INVALID索引，IF NOT EXISTS会一直跳过它，
+                    # 需先删除再重建（正在其他连接中构建的索引不动）
+                    invalid = conn.execute(text("""
+                        SELECT 1 FROM pg_index i
+                        JOIN pg_class c ON c.oid = i.indexrelid
+                        WHERE c.relname = 'idx_langchain_pg_embedding_filename'
+                          AND NOT i.indisvalid
+                          AND NOT EXISTS (
+                              SELECT 1 FROM pg_stat_progress_create_index p
+                              WHERE p.index_relid = i.indexrelid
+                          )
+                    """)).first()
+                    if invalid:
+                        self.logger.warning("文件名索引处于INVALID状态，删除后重建")
+                        conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS idx_langchain_pg_embedding_filename"))
+                    conn.execute(text("""
+                        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_langchain_pg_embedding_filename
+                        ON langchain_pg_embedding (collection_id, (cmetadata->>'filename'))
+                    """))
+                finally:
+                    # 恢复连接的默认超时，避免影响连接池中后续复用该连接的查询
+                    conn.execute(text("RESET statement_timeout"))
+        except Exception as e:
+            self.logger.warning(f"创建文件名索引失败: {str(e)}")
+    
+    def _set_index_search_params(self, dbapi_connection, connection_record):
+        """新建数据库连接时设置向量索引的查询参数"""
+        existing_autocommit = dbapi_connection.autocommit
+        dbapi_connection.autocommit = True
+        try:
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"SET ivfflat.probes = {self.IVFFLAT_PROBES}")
+            cursor.close()
+        except Exception as e:
+            self.logger.warning(f"设置向量索引查询参数失败: {str(e)}")
+        finally:
+            dbapi_connection.autocommit = existing_autocommit
+    
+    def _init_qa_chain(self):
+        """初始化问答链（stuff方式将检索到的分块填入提示模板）"""
+        try:
+            return load_qa_chain(self.chat_model, chain_type="stuff", prompt=self.qa_prompt)
+        except Exception as e:
+            self.logger.error(f"问答链初始化失败: {str(e)}")
+            raise
+    
     def _init_retrieval_chain(self):
         """初始化检索链"""
         if not self.vector_store:
             return
         
         try:
-            # 自定义提示模板
-            prompt_template = """
-使用以下上下文信息回答用户的问题。如果上下文中没有相关信息，请直接说明无法找到相关信息。
-
-上下文信息:
-{context}
-
-问题: {question}
-
-回答:"""
-            
-            prompt = PromptTemplate(
-                template=prompt_template,
-                input_variables=["context", "question"]
-            )
-            
             # 创建检索器
             retriever = self.vector_store.as_retriever(
                 search_kwargs={"k": self.config.top_k}
             )
             
-            # 创建检索问答链
-            self.retrieval_chain = RetrievalQA.from_chain_type(
-                llm=self.chat_model,
-                chain_type="stuff",
+            # 创建检索问答链（复用已构建的问答链，只重新绑定检索器）
+            self.retrieval_chain = RetrievalQA(
+                combine_documents_chain=self.qa_chain,
                 retriever=retriever,
-                chain_type_kwargs={"prompt": prompt},
                 return_source_documents=True
             )
             
@@ -235,95 +573,226 @@ class SupabaseRAG:
             if not file_documents:
                 return False
             
-            # 分割文档
             self.logger.info(f"开始处理 {len(file_documents)} 个文档")
-            split_documents = self.text_splitter.split_documents(file_documents)
-            
-            # 转换为langchain格式并添加唯一ID
-            langchain_docs = []
-            for doc in split_documents:
-                # 为每个文档块生成唯一ID
-                doc_id = str(uuid.uuid4())
-                metadata = doc.metadata.copy()
-                metadata["doc_id"] = doc_id
-                metadata["chunk_id"] = doc_id
-                metadata["collection_name"] = self.supabase_config.collection_name
-                
-                langchain_doc = LangchainDocument(
-                    page_content=doc.content,
-                    metadata=metadata
-                )
-                langchain_docs.append(langchain_doc)
-            
-            # 分批添加到向量存储（避免批处理大小限制）
-            batch_size = 5  # 减少批次大小以减少prepared statement冲突
-            ids = []
-            
-            for i in range(0, len(langchain_docs), batch_size):
-                batch = langchain_docs[i:i + batch_size]
-                self.logger.info(f"处理批次 {i//batch_size + 1}/{(len(langchain_docs) + batch_size - 1)//batch_size}，文档数: {len(batch)}")
-                batch_ids = self.vector_store.add_documents(batch)
-                if batch_ids:
-                    ids.extend(batch_ids)
-            
-            # 存储文件元数据到Supabase表（不包含原始文件）
-            self._store_file_metadata(file_documents, split_documents)
-            
-            self.logger.info(f"文档添加完成，总计 {len(langchain_docs)} 个文档块")
+            chunk_count = self._prepare_and_index(file_documents)
+            
+            self.logger.info(f"文档添加完成，总计 {chunk_count} 个文档块")
             return True
             
         except Exception as e:
             self.logger.error(f"添加文档失败: {str(e)}")
             return False
     
-    def _store_file_metadata(self, original_docs: List[Document], split_docs: List[Document], 
-                                file_content: bytes = None, filename: str = None):
-        """存储文件元数据和原始文件到Supabase表"""
-        import hashlib
-        import base64
+    def _prepare_and_index(self, documents: List[Document], filename: Optional[str] = None,
+                           file_id_future: Optional[Future] = None, chunks_only: bool = False) -> int:
+        """
+        分块、向量化写入向量存储并保存元数据（各入库入口共用）
+        
+        Args:
+            documents: 解析得到的原始文档
+            filename: 上传的文件名（可选）
+            file_id_future: 原始文件的后台上传任务，写入元数据前才等待其file_id
+            chunks_only: 只保存分块元数据，按文件名关联已存在的原始文件
+            
+        Returns:
+            int: 写入的分块数量
+        """
+        # 分割文档
+        split_documents = self.text_splitter.split_documents(documents)
+        
+        # 转换为langchain格式并添加唯一ID
+        langchain_docs = self._to_langchain_docs(split_documents)
+        
+        # 并发向量化后写入向量存储
+        self._index_documents(langchain_docs)
+        
+        # 存储元数据到Supabase表
+        if chunks_only:
+            self._store_chunk_metadata_only(documents, split_documents, filename)
+        else:
+            file_id = file_id_future.result() if file_id_future else None
+            self._store_file_metadata(documents, split_documents, file_id=file_id, filename=filename)
+        
+        # 知识库内容已变化，缓存的回答不再可靠
+        self._invalidate_caches()
+        
+        # 更新知识库统计
+        self._update_knowledge_base_stats(self.supabase_config.collection_name or "default")
+        
+        return len(langchain_docs)
+    
+    def _to_langchain_docs(self, split_documents: List[Document]) -> List[LangchainDocument]:
+        """将分块转换为langchain文档，为每个分块生成唯一ID（doc_id与chunk_id相同）"""
+        collection_name = self.supabase_config.collection_name
+        langchain_docs = []
+        for doc in split_documents:
+            doc_id = uuid.uuid4().hex
+            langchain_docs.append(LangchainDocument(
+                page_content=doc.content,
+                metadata={
+                    **doc.metadata,
+                    "doc_id": doc_id,
+                    "chunk_id": doc_id,
+                    "collection_name": collection_name
+                }
+            ))
+        return langchain_docs
+    
+    def _index_documents(self, langchain_docs: List[LangchainDocument], batch_size: int = 5) -> List[str]:
+        """
+        向量化文档块并写入向量存储
         
+        内容完全相同的分块（页眉页脚、重复段落等）只请求一次嵌入；
+        嵌入按embedding_batch_size成批请求，各批次并发发出，而不是逐批等待；
+        写入优先使用COPY，失败时按小批次INSERT
+        
+        Args:
+            langchain_docs: 待写入的文档块
+            batch_size: 每批写入的文档数
+            
+        Returns:
+            List[str]: 写入的向量记录ID
+        """
+        if not langchain_docs:
+            return []
+        
+        # 去重后再向量化（dict保持首次出现的顺序）
+        unique_texts = list(dict.fromkeys(doc.page_content for doc in langchain_docs))
+        if len(unique_texts) < len(langchain_docs):
+            self.logger.info(f"跳过 {len(langchain_docs) - len(unique_texts)} 个重复分块的向量化")
+        
+        embed_size = self._embedding_batch_size()
+        text_batches = [unique_texts[i:i + embed_size] for i in range(0, len(unique_texts), embed_size)]
+        
+        # 只截断发给嵌入服务的文本，写入向量存储的仍是完整分块内容
+        embed_texts = self._truncate_for_embedding(unique_texts)
+        embed_batches = [embed_texts[i:i + embed_size] for i in range(0, len(embed_texts), embed_size)]
+        
+        # 并发请求嵌入（executor.map保持批次顺序；线程池与调用方是否处于事件循环中无关）
+        max_workers = max(1, min(self.config.embedding_concurrency, len(embed_batches)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            batch_embeddings = list(executor.map(self.embedding_model.embed_documents, embed_batches))
+        
+        # 内积检索要求文档向量已归一化，此时内积与余弦相似度等价且计算更少
+        if self.config.distance_strategy == "inner":
+            batch_embeddings = [self._normalize_embeddings(embeddings) for embeddings in batch_embeddings]
+        
+        embedding_by_text = {}
+        for texts, embeddings in zip(text_batches, batch_embeddings):
+            embedding_by_text.update(zip(texts, embeddings))
+        
+        # 优先用COPY一次性写入全部分块；失败时（如连接池不支持COPY）回退到分批INSERT
+        try:
+            ids = self._copy_embeddings(langchain_docs, embedding_by_text)
+            self.logger.info(f"已通过COPY写入 {len(ids)} 个文档块")
+            return ids
+        except Exception as e:
+            self.logger.warning(f"COPY写入向量失败，回退到分批写入: {str(e)}")
+        
+        # 每个分块仍单独写入一行，保证按文件删除时重复内容不会互相影响
+        batches = [langchain_docs[i:i + batch_size] for i in range(0, len(langchain_docs), batch_size)]
+        ids = []
+        for index, batch in enumerate(batches, 1):
+            self.logger.info(f"处理批次 {index}/{len(batches)}，文档数: {len(batch)}")
+            texts = [doc.page_content for doc in batch]
+            batch_ids = self.vector_store.add_embeddings(
+                texts=texts,
+                embeddings=[embedding_by_text[text] for text in texts],
+                metadatas=[doc.metadata for doc in batch]
+            )
+            if batch_ids:
+                ids.extend(batch_ids)
+        
+        return ids
+    
+    def _copy_embeddings(self, langchain_docs: List[LangchainDocument],
+                         embedding_by_text: Dict[str, List[float]]) -> List[str]:
+        """
+        用COPY在一个事务内批量写入分块向量
+        
+        COPY不逐行解析和规划INSERT语句，也不会产生prepared statement；
+        向量和JSON元数据以文本格式传输，由数据库端转换类型
+        
+        Args:
+            langchain_docs: 待写入的文档块
+            embedding_by_text: 分块内容到向量的映射
+            
+        Returns:
+            List[str]: 写入的向量记录ID
+        """
+        ids = [uuid.uuid4().hex for _ in langchain_docs]
+        
+        raw_connection = self._db_engine.raw_connection()
+        try:
+            with raw_connection.driver_connection.cursor() as cursor:
+                with cursor.copy(
+                    "COPY langchain_pg_embedding (id, collection_id, embedding, document, cmetadata) FROM STDIN"
+                ) as copy:
+                    for doc_id, doc in zip(ids, langchain_docs):
+                        embedding = embedding_by_text[doc.page_content]
+                        copy.write_row((
+                            doc_id,
+                            self._collection_uuid,
+                            "[" + ",".join(map(str, embedding)) + "]",
+                            doc.page_content,
+                            json.dumps(doc.metadata, ensure_ascii=False, default=str)
+                        ))
+            raw_connection.commit()
+        except Exception:
+            raw_connection.rollback()
+            raise
+        finally:
+            raw_connection.close()
+        
+        return ids
+    
+    @staticmethod
+    def _normalize_embeddings(embeddings: List[List[float]]) -> List[List[float]]:
+        """对一批向量做L2归一化"""
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (matrix / norms).tolist()
+    
+    def _store_raw_file(self, file_content: bytes, filename: str, file_hash: Optional[str] = None) -> Optional[str]:
+        """存储原始文件到Storage bucket（按哈希去重），返回文件记录ID，失败时返回None"""
+        try:
+            file_record = self.file_storage.store_file_sync(
+                file_content=file_content,
+                filename=filename,
+                collection_name=self.supabase_config.collection_name,
+                file_hash=file_hash
+            )
+            file_id = file_record["id"]
+            self.logger.info(f"原始文件已保存到Storage: {file_id}")
+            return file_id
+        except Exception as e:
+            self.logger.warning(f"存储原始文件失败: {str(e)}")
+            return None
+    
+    def _discard_raw_file(self, file_id: str):
+        """删除入库失败时新建的原始文件记录和Storage对象（失败时只记录警告）"""
         try:
+            self.file_storage.delete_file_sync(file_id)
+            self.logger.info(f"已删除入库失败的原始文件: {file_id}")
+        except Exception as e:
+            self.logger.warning(f"删除入库失败的原始文件失败: {file_id}, {str(e)}")
+    
+    def _store_file_metadata(self, original_docs: List[Document], split_docs: List[Document], 
+                                file_id: Optional[str] = None, filename: str = None):
+        """存储文件元数据（原始文件已存入Storage时通过file_id关联，所有文档共用同一个文件记录）"""
+        try:
+            # 一次遍历统计每个来源的分块数量
+            source_chunk_counts = Counter(split_doc.metadata.get("source") for split_doc in split_docs)
+            
             # 为每个原始文档创建记录
+            doc_records = []
             for orig_doc in original_docs:
-                # 计算该文档的分块数量
-                chunk_count = sum(1 for split_doc in split_docs 
-                                if split_doc.metadata.get("source") == orig_doc.metadata.get("source"))
-                
-                file_id = None
-                
-                # 如果有原始文件内容，先存储到文件表
-                if file_content and filename:
-                    # 计算文件哈希
-                    file_hash = hashlib.sha256(file_content).hexdigest()
-                    
-                    # 检查文件是否已存在
-                    existing_file = self.supabase.rpc("check_file_exists", {"file_hash_input": file_hash}).execute()
-                    
-                    if existing_file.data:
-                        # 文件已存在，使用现有文件ID
-                        file_id = existing_file.data[0]["file_id"]
-                        self.logger.info(f"文件已存在，使用现有文件: {file_id}")
-                    else:
-                        # 创建新文件记录
-                        file_record = {
-                            "id": str(uuid.uuid4()),
-                            "filename": filename,
-                            "original_filename": filename,
-                            "content_type": orig_doc.metadata.get("content_type", "application/octet-stream"),
-                            "file_size": len(file_content),
-                            "file_hash": file_hash,
-                            "file_content": base64.b64encode(file_content).decode('utf-8'),  # 编码为base64字符串
-                            "collection_name": self.supabase_config.collection_name,
-                            "metadata": {"upload_source": "api"}
-                        }
-                        
-                        file_result = self.supabase.table("document_files").insert(file_record).execute()
-                        file_id = file_result.data[0]["id"]
-                        self.logger.info(f"新文件已存储: {file_id}")
+                chunk_count = source_chunk_counts.get(orig_doc.metadata.get("source"), 0)
                 
                 # 创建文档元数据记录
-                doc_record = {
-                    "id": str(uuid.uuid4()),
+                doc_records.append({
+                    "id": uuid.uuid4().hex,
                     "file_id": file_id,
                     "filename": orig_doc.metadata.get("source", filename or "unknown"),
                     "content_type": orig_doc.metadata.get("content_type", "text"),
@@ -332,10 +801,11 @@ class SupabaseRAG:
                     "processed_content": orig_doc.content,
                     "collection_name": self.supabase_config.collection_name,
                     "metadata": orig_doc.metadata
-                }
-                
-                # 插入到Supabase
-                self.supabase.table("document_metadata").insert(doc_record).execute()
+                })
+            
+            # 一次请求批量插入到Supabase
+            if doc_records:
+                self.supabase.table("document_metadata").insert(doc_records).execute()
                 
         except Exception as e:
             self.logger.warning(f"存储文档元数据失败: {str(e)}")
@@ -357,78 +827,95 @@ class SupabaseRAG:
             self.logger.error(f"从文件添加文档失败: {str(e)}")
             return False
     
-    def add_file_and_chunks(self, file_content: bytes, filename: str) -> bool:
+    def add_file_chunks_from_files(self, file_paths: List[str], max_workers: int = 4) -> Dict[str, bool]:
+        """
+        批量从文件路径添加文件分块
+        
+        文件解析在线程池中并发进行，每个文件解析完成后立即分块入库，
+        使后续文件的解析与前面文件的向量化重叠
+        
+        Args:
+            file_paths: 文件路径列表
+            max_workers: 并发解析的文件数
+            
+        Returns:
+            Dict[str, bool]: 每个文件是否成功
+        """
+        results = {}
+        if not file_paths:
+            return results
+        
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(file_paths))) as executor:
+            futures = {
+                executor.submit(self.file_processor.process_file, file_path): file_path
+                for file_path in file_paths
+            }
+            
+            for future in as_completed(futures):
+                file_path = futures[future]
+                try:
+                    results[file_path] = self.add_file_chunks(future.result())
+                except Exception as e:
+                    self.logger.error(f"从文件添加文档失败: {file_path}, {str(e)}")
+                    results[file_path] = False
+        
+        return results
+    
+    def add_file_and_chunks(self, file_content: bytes, filename: str, file_hash: Optional[str] = None) -> bool:
         """
         从上传的文件添加原始文件和分块
         
         Args:
             file_content: 文件二进制内容
             filename: 文件名
+            file_hash: 上传时已计算的SHA-256（可选，避免重复计算）
             
         Returns:
             bool: 是否成功
         """
         try:
-            # 处理文件内容
+            # 相同内容的文件已分块过时直接复用，跳过解析、分块和向量化
+            file_hash = file_hash or hashlib.sha256(file_content).hexdigest()
+            if self._link_existing_file(file_hash, filename):
+                return True
+            
+            # 先解析，解析不出内容时不上传原始文件
             documents = self.file_processor.process_uploaded_file(file_content, filename)
             
             if not documents:
                 return False
             
-            # 分割文档
-            self.logger.info(f"开始处理上传文件: {filename}")
-            split_documents = self.text_splitter.split_documents(documents)
-            
-            # 转换为langchain格式并添加唯一ID
-            langchain_docs = []
-            for doc in split_documents:
-                # 为每个文档块生成唯一ID
-                doc_id = str(uuid.uuid4())
-                metadata = doc.metadata.copy()
-                metadata["doc_id"] = doc_id
-                metadata["chunk_id"] = doc_id
-                metadata["collection_name"] = self.supabase_config.collection_name
+            # 原始文件上传Storage与分块、向量化互不依赖，放到后台线程同时进行，
+            # 只有写入元数据时才需要等待上传得到的file_id
+            is_new_file = self.file_storage._check_file_exists_sync(file_hash) is None
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                upload_future = executor.submit(self._store_raw_file, file_content, filename, file_hash)
                 
-                langchain_doc = LangchainDocument(
-                    page_content=doc.content,
-                    metadata=metadata
-                )
-                langchain_docs.append(langchain_doc)
-            
-            # 分批添加到向量存储（避免批处理大小限制）
-            batch_size = 5  # 减少批次大小以减少prepared statement冲突
-            ids = []
-            
-            for i in range(0, len(langchain_docs), batch_size):
-                batch = langchain_docs[i:i + batch_size]
-                self.logger.info(f"处理批次 {i//batch_size + 1}/{(len(langchain_docs) + batch_size - 1)//batch_size}，文档数: {len(batch)}")
-                batch_ids = self.vector_store.add_documents(batch)
-                if batch_ids:
-                    ids.extend(batch_ids)
-            
-            # 存储文件元数据和原始文件到Supabase表
-            self._store_file_metadata(documents, split_documents, file_content, filename)
-            
-            # 分块统计通过document_metadata表维护
-            
-            # 更新知识库统计
-            kb_name = self.supabase_config.collection_name or "default"
-            self._update_knowledge_base_stats(kb_name)
-            
-            self.logger.info(f"上传文件处理完成: {filename}，总计 {len(langchain_docs)} 个文档块")
+                self.logger.info(f"开始处理上传文件: {filename}")
+                try:
+                    chunk_count = self._prepare_and_index(documents, filename, file_id_future=upload_future)
+                except Exception:
+                    # 入库失败时删除本次新建的文件记录，避免留下的孤立文件被后续上传的去重命中
+                    file_id = upload_future.result()
+                    if is_new_file and file_id:
+                        self._discard_raw_file(file_id)
+                    raise
+            
+            self.logger.info(f"上传文件处理完成: {filename}，总计 {chunk_count} 个文档块")
             return True
             
         except Exception as e:
             self.logger.error(f"从上传文件添加文档失败: {str(e)}")
             return False
     
-    def add_chunks_only(self, file_content: bytes, filename: str) -> bool:
+    def add_chunks_only(self, file_content: bytes, filename: str, file_hash: Optional[str] = None) -> bool:
         """
         从上传的文件只添加分块（不保存原始文件）
         
         Args:
             file_content: 文件二进制内容
             filename: 文件名
+            file_hash: 上传时已计算的SHA-256（可选，避免重复计算）
             
         Returns:
             bool: 是否成功
@@ -441,73 +928,147 @@ class SupabaseRAG:
             else:
                 self.logger.debug("使用已存在的向量存储实例")
             
+            # 相同内容的文件已分块过时直接复用，跳过解析、分块和向量化
+            file_hash = file_hash or hashlib.sha256(file_content).hexdigest()
+            if self._link_existing_file(file_hash, filename):
+                return True
+            
             # 处理文件内容
             documents = self.file_processor.process_uploaded_file(file_content, filename)
             
             if not documents:
                 return False
             
-            # 分割文档
             self.logger.info(f"开始处理上传文件: {filename}")
-            split_documents = self.text_splitter.split_documents(documents)
-            
-            # 转换为langchain格式并添加唯一ID
-            langchain_docs = []
-            for doc in split_documents:
-                # 为每个文档块生成唯一ID
-                doc_id = str(uuid.uuid4())
-                metadata = doc.metadata.copy()
-                metadata["doc_id"] = doc_id
-                metadata["chunk_id"] = doc_id
-                metadata["collection_name"] = self.supabase_config.collection_name
-                
-                langchain_doc = LangchainDocument(
-                    page_content=doc.content,
-                    metadata=metadata
-                )
-                langchain_docs.append(langchain_doc)
-            
-            # 分批添加到向量存储（避免批处理大小限制）
-            batch_size = 5  # 减少批次大小以减少prepared statement冲突
-            ids = []
-            
-            for i in range(0, len(langchain_docs), batch_size):
-                batch = langchain_docs[i:i + batch_size]
-                self.logger.info(f"处理批次 {i//batch_size + 1}/{(len(langchain_docs) + batch_size - 1)//batch_size}，文档数: {len(batch)}")
-                batch_ids = self.vector_store.add_documents(batch)
-                if batch_ids:
-                    ids.extend(batch_ids)
-            
-            # 只存储分块元数据（不包含原始文件）
-            self._store_chunk_metadata_only(documents, split_documents, filename)
-            
-            # 分块统计通过document_metadata表维护
+            chunk_count = self._prepare_and_index(documents, filename, chunks_only=True)
             
-            self.logger.info(f"上传文件处理完成: {filename}，总计 {len(langchain_docs)} 个文档块（仅分块）")
+            self.logger.info(f"上传文件处理完成: {filename}，总计 {chunk_count} 个文档块（仅分块）")
             return True
             
         except Exception as e:
             self.logger.error(f"从上传文件添加文档失败: {str(e)}")
+            return False
+    
+    def _link_existing_file(self, file_hash: str, filename: str) -> bool:
+        """
+        按内容哈希复用已入库文件的分块
+        
+        同名文件已在当前知识库分块过时直接返回；否则在同一事务中把已有向量（优先取当前知识库中的，
+        其次其他知识库）以本次的文件名复制到当前集合，并为其新建当前知识库自己的文件记录
+        （复用同一Storage对象或内容块）和元数据记录，全程不调用嵌入服务。
+        新文件名与独立上传的文件一样出现在列表中、可单独删除，删除或清空来源文件所在的知识库也不受影响
+        
+        Args:
+            file_hash: 文件内容的SHA-256
+            filename: 本次上传的文件名
             
-            # 如果是prepared statement错误，清理连接状态以避免后续冲突
-            if "DuplicatePreparedStatement" in str(e):
-                self.logger.warning("检测到prepared statement冲突，清理数据库连接...")
-                try:
-                    if hasattr(self, '_db_engine') and self._db_engine:
-                        self._db_engine.dispose()
-                        self.logger.info("已清理数据库连接以解决prepared statement冲突")
-                except Exception as cleanup_error:
-                    self.logger.warning(f"清理连接时出错: {str(cleanup_error)}")
+        Returns:
+            bool: 是否已复用（False表示需要走完整处理流程）
+        """
+        try:
+            existing = self.supabase.rpc("check_file_exists", {"file_hash_input": file_hash}).execute()
+            if not existing.data:
+                return False
             
+            file_ids = [row["file_id"] for row in existing.data]
+            response = self.supabase.table("document_metadata")\
+                .select("id, file_id, filename, collection_name")\
+                .in_("file_id", file_ids)\
+                .gt("chunk_count", 0)\
+                .execute()
+            records = response.data or []
+            if not records:
+                return False
+            
+            collection_name = self.supabase_config.collection_name or "default"
+            current_records = [record for record in records if record["collection_name"] == collection_name]
+            if any(record["filename"] == filename for record in current_records):
+                self.logger.info(f"文件内容已在当前知识库中分块，跳过重复处理: {filename}")
+                return True
+            
+            source_record = current_records[0] if current_records else records[0]
+            source_uuid = self._get_collection_uuid(source_record["collection_name"])
+            params = {
+                "source_uuid": source_uuid,
+                "source_name": source_record["filename"],
+                "source_file_id": source_record["file_id"],
+                "source_metadata_id": source_record["id"],
+                "target_collection": collection_name,
+                "target_uuid": self._collection_uuid,
+                "filename": filename,
+                "file_id": str(uuid.uuid4()),
+                "metadata_id": uuid.uuid4().hex
+            }
+            
+            with self._db_engine.begin() as conn:
+                # 复制分块向量：doc_id/chunk_id随新行ID重新生成（与其他入库路径一样使用无连字符的UUID），
+                # 来源文件名改为本次上传的文件名
+                copied = conn.execute(text("""
+                    INSERT INTO langchain_pg_embedding (id, collection_id, embedding, document, cmetadata)
+                    SELECT s.new_id, CAST(:target_uuid AS uuid), s.embedding, s.document,
+                           s.cmetadata || jsonb_build_object(
+                               'doc_id', s.new_id, 'chunk_id', s.new_id,
+                               'collection_name', CAST(:target_collection AS text),
+                               'source', CAST(:filename AS text),
+                               'filename', CAST(:filename AS text)
+                           )
+                    FROM (
+                        SELECT replace(gen_random_uuid()::text, '-', '') AS new_id,
+                               e.embedding, e.document, e.cmetadata
+                        FROM langchain_pg_embedding e
+                        WHERE e.collection_id = :source_uuid
+                          AND e.cmetadata->>'source' = :source_name
+                    ) s
+                """), params).rowcount
+                
+                if not copied:
+                    return False
+                
+                # 当前知识库自己的文件记录，与来源记录共用同一Storage对象或内容块
+                conn.execute(text("""
+                    INSERT INTO document_files (id, filename, original_filename, content_type, file_size,
+                                                file_hash, file_content, storage_path, collection_name, metadata)
+                    SELECT CAST(:file_id AS uuid), :filename, :filename, content_type, file_size,
+                           file_hash, file_content, storage_path, :target_collection, metadata
+                    FROM document_files
+                    WHERE id = CAST(:source_file_id AS uuid)
+                """), params)
+                
+                conn.execute(text("""
+                    INSERT INTO document_metadata (id, file_id, filename, content_type, size, chunk_count,
+                                                   processed_content, collection_name, metadata)
+                    SELECT CAST(:metadata_id AS uuid), CAST(:file_id AS uuid), :filename, content_type, size,
+                           chunk_count, processed_content, :target_collection,
+                           COALESCE(metadata, '{}'::jsonb) || jsonb_build_object(
+                               'source', CAST(:filename AS text),
+                               'filename', CAST(:filename AS text)
+                           )
+                    FROM document_metadata
+                    WHERE id = CAST(:source_metadata_id AS uuid)
+                """), params)
+            
+            # 知识库内容已变化，缓存的回答不再可靠
+            self._invalidate_caches()
+            self._update_knowledge_base_stats(collection_name)
+            
+            self.logger.info(
+                f"文件内容已作为 {source_record['filename']} 在知识库 {source_record['collection_name']} 中分块，"
+                f"复制 {copied} 个分块向量: {filename}"
+            )
+            return True
+            
+        except Exception as e:
+            self.logger.warning(f"复用已有文件分块失败，按新文件处理: {str(e)}")
             return False
     
-    def store_raw_file_only(self, file_content: bytes, filename: str) -> bool:
+    def store_raw_file_only(self, file_content: bytes, filename: str, file_hash: Optional[str] = None) -> bool:
         """
         只保存原始文件到Storage bucket（不分块处理）
         
         Args:
             file_content: 文件二进制内容
             filename: 文件名
+            file_hash: 上传时已计算的SHA-256（可选，避免重复计算）
             
         Returns:
             bool: 是否成功
@@ -517,7 +1078,8 @@ class SupabaseRAG:
             file_record = self.file_storage.store_file_sync(
                 file_content=file_content,
                 filename=filename,
-                collection_name=self.supabase_config.collection_name
+                collection_name=self.supabase_config.collection_name,
+                file_hash=file_hash
             )
             
             inserted_file_id = file_record["id"]
@@ -526,6 +1088,9 @@ class SupabaseRAG:
             # 检查是否已有对应的document_metadata记录需要更新file_id
             self._update_metadata_file_link(filename, inserted_file_id)
             
+            # 文件列表已变化
+            self._meta_cache.clear()
+            
             return True
             
         except Exception as e:
@@ -550,31 +1115,28 @@ class SupabaseRAG:
             except Exception as e:
                 self.logger.warning(f"查找原始文件失败: {str(e)}")
             
+            # 一次遍历统计每个来源的分块数量
+            source_chunk_counts = Counter(doc.metadata.get("source") for doc in split_docs)
+            
             # 为每个原始文档创建记录
-            for orig_doc in original_docs:
-                # 计算该文档的分块数量
-                chunk_count = sum(1 for doc in split_docs 
-                                if doc.metadata.get("source") == orig_doc.metadata.get("source", filename))
-                
-                # 创建文档元数据记录
-                doc_record = {
-                    "id": str(uuid.uuid4()),
+            doc_records = [
+                {
+                    "id": uuid.uuid4().hex,
                     "file_id": file_id,  # 关联到原始文件（如果存在）
                     "filename": orig_doc.metadata.get("source", filename or "unknown"),
                     "content_type": orig_doc.metadata.get("content_type", "text"),
                     "size": len(orig_doc.content),
-                    "chunk_count": chunk_count,
+                    "chunk_count": source_chunk_counts.get(orig_doc.metadata.get("source", filename), 0),
                     "processed_content": orig_doc.content,
                     "collection_name": self.supabase_config.collection_name,
                     "metadata": orig_doc.metadata
                 }
-                
-                # 插入到Supabase
-                self.supabase.table("document_metadata").insert(doc_record).execute()
-                
-                # 更新知识库统计
-                kb_name = self.supabase_config.collection_name or "default"
-                self._update_knowledge_base_stats(kb_name)
+                for orig_doc in original_docs
+            ]
+            
+            # 一次请求批量插入到Supabase
+            if doc_records:
+                self.supabase.table("document_metadata").insert(doc_records).execute()
                 
         except Exception as e:
             self.logger.warning(f"存储文档元数据失败: {str(e)}")
@@ -582,23 +1144,29 @@ class SupabaseRAG:
     def _update_knowledge_base_stats(self, kb_name: str = "default"):
         """更新知识库统计信息"""
         try:
-            # 统计文档数量
-            doc_response = self.supabase.table("document_metadata")\
-                .select("id", count="exact")\
-                .eq("collection_name", kb_name)\
-                .execute()
-            
-            document_count = doc_response.count or 0
-            
-            # 统计分块数量（直接从document_metadata表汇总）
-            chunk_response = self.supabase.table("document_metadata")\
-                .select("chunk_count")\
-                .eq("collection_name", kb_name)\
-                .execute()
-            
-            chunk_count = 0
-            if chunk_response.data:
-                chunk_count = sum(record["chunk_count"] or 0 for record in chunk_response.data)
+            # 文档数和分块数由数据库函数一次汇总，只返回一行结果
+            try:
+                stats_response = self.supabase.rpc("get_knowledge_base_stats", {"kb_name": kb_name}).execute()
+                stats = stats_response.data[0] if stats_response.data else {}
+                document_count = stats.get("document_count") or 0
+                chunk_count = stats.get("chunk_count") or 0
+            except Exception as rpc_error:
+                # 数据库未创建该函数时，回退到逐行拉取后在Python中汇总
+                self.logger.warning(f"RPC方法获取知识库统计失败: {str(rpc_error)}")
+                
+                doc_response = self.supabase.table("document_metadata")\
+                    .select("id", count="exact")\
+                    .eq("collection_name", kb_name)\
+                    .execute()
+                
+                document_count = doc_response.count or 0
+                
+                chunk_response = self.supabase.table("document_metadata")\
+                    .select("chunk_count")\
+                    .eq("collection_name", kb_name)\
+                    .execute()
+                
+                chunk_count = sum(record["chunk_count"] or 0 for record in chunk_response.data or [])
             
             # 更新或创建知识库记录
             kb_response = self.supabase.table("knowledge_bases")\
@@ -671,9 +1239,32 @@ class SupabaseRAG:
         Returns:
             RAGResponse: 查询响应
         """
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         try:
+            # 先查缓存，命中则跳过检索和LLM生成（相同问题连向量化也跳过）
+            query_embedding = None
+            query_vector = None
+            if self.semantic_cache.enabled:
+                cached = self.semantic_cache.lookup_exact(question)
+                if cached is not None:
+                    processing_time = time.perf_counter() - start_time
+                    self.logger.info(f"查询缓存精确命中，耗时: {processing_time:.2f}秒")
+                    return replace(cached, query=question, processing_time=processing_time)
+                
+                try:
+                    query_embedding = self.embedding_model.embed_query(question)
+                    query_vector = SemanticCache.normalize(query_embedding)
+                except Exception as e:
+                    self.logger.warning(f"问题向量化失败，跳过语义缓存: {str(e)}")
+                
+                if query_vector is not None:
+                    cached = self.semantic_cache.lookup(query_vector)
+                    if cached is not None:
+                        processing_time = time.perf_counter() - start_time
+                        self.logger.info(f"语义缓存命中，耗时: {processing_time:.2f}秒")
+                        return replace(cached, query=question, processing_time=processing_time)
+            
             # 检查向量存储是否存在文档
             doc_count = self.get_chunk_count()
             self.logger.info(f"当前文档数量: {doc_count}")
@@ -688,31 +1279,39 @@ class SupabaseRAG:
                     return RAGResponse(
                         answer="知识库为空，请先上传文档。",
                         query=question,
-                        processing_time=time.time() - start_time
+                        processing_time=time.perf_counter() - start_time
                     )
             
-            # 执行检索问答
-            result = self.retrieval_chain.invoke({"query": question})
-            
-            # 处理源文档
-            sources = []
-            if "source_documents" in result:
-                for doc in result["source_documents"]:
-                    source_info = {
-                        "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                        "metadata": doc.metadata
-                    }
-                    sources.append(source_info)
+            # 执行检索问答：复用语义缓存阶段已算好的问题向量检索，避免检索器再向量化一次
+            if query_embedding is None:
+                query_embedding = self.embedding_model.embed_query(question)
+            
+            source_documents = self.search_by_vector(query_embedding)
+            answer = self.qa_chain.invoke({
+                "input_documents": source_documents,
+                "question": question
+            })["output_text"]
+            
+            # 处理源文档（内容只保留前200字符作为预览）
+            sources = [
+                {
+                    "content": doc.page_content[:200] + ("..." if len(doc.page_content) > 200 else ""),
+                    "metadata": doc.metadata
+                }
+                for doc in source_documents
+            ]
             
-            processing_time = time.time() - start_time
+            processing_time = time.perf_counter() - start_time
             
             response = RAGResponse(
-                answer=result["result"],
+                answer=answer,
                 sources=sources,
                 query=question,
                 processing_time=processing_time
             )
             
+            self.semantic_cache.add(query_vector, response, question)
+            
             self.logger.info(f"查询完成，耗时: {processing_time:.2f}秒")
             return response
             
@@ -721,23 +1320,101 @@ class SupabaseRAG:
             return RAGResponse(
                 answer=f"查询过程中发生错误: {str(e)}",
                 query=question,
-                processing_time=time.time() - start_time
+                processing_time=time.perf_counter() - start_time
             )
     
+    def search_by_vector(self, embedding: List[float], k: Optional[int] = None) -> List[LangchainDocument]:
+        """
+        按向量检索当前知识库中最相似的分块
+        
+        一条SQL在数据库端完成近邻排序并只返回分块内容和元数据，
+        HNSW索引的ef_search随k在事务内设置，并启用迭代扫描保证按知识库过滤后仍有k个结果
+        
+        Args:
+            embedding: 查询向量
+            k: 返回的分块数，默认使用top_k
+            
+        Returns:
+            List[LangchainDocument]: 按相似度排序的分块
+        """
+        k = k or self.config.top_k
+        
+        # 距离运算符必须与索引的运算符类一致才能走索引
+        operator = "<#>" if self.config.distance_strategy == "inner" else "<=>"
+        
+        try:
+            with self._db_engine.begin() as conn:
+                # 事务级设置合并为一条语句发出（无参数时psycopg允许多条语句），只多一次往返
+                settings = [f"SET LOCAL statement_timeout = {int(self.DB_STATEMENT_TIMEOUT_MS)}"]
+                if (self.config.index_type or "").lower() == "hnsw":
+                    ef_search = max(k * self.HNSW_EF_SEARCH_FACTOR, self.HNSW_EF_SEARCH_MIN)
+                    settings.append(f"SET LOCAL hnsw.ef_search = {int(ef_search)}")
+                    # 索引为所有知识库共用，按collection_id过滤发生在索引扫描之后；
+                    # 迭代扫描在候选不足k个时继续扫描索引，否则小知识库改用精确扫描
+                    if self._hnsw_iterative_scan:
+                        settings.append("SET LOCAL hnsw.iterative_scan = relaxed_order")
+                    else:
+                        chunk_count = conn.execute(
+                            _SQL_COUNT_CHUNKS, {"collection_uuid": self._collection_uuid}
+                        ).scalar() or 0
+                        if chunk_count <= self.HNSW_EXACT_SCAN_MAX_CHUNKS:
+                            settings.append("SET LOCAL enable_indexscan = off")
+                conn.execute(text("; ".join(settings)))
+                
+                rows = conn.execute(_SQL_SEARCH_BY_VECTOR[operator], {
+                    "collection_uuid": self._collection_uuid,
+                    "embedding": "[" + ",".join(map(str, embedding)) + "]",
+                    "k": k
+                }).fetchall()
+            
+            return [
+                LangchainDocument(page_content=row[0], metadata=row[1] or {})
+                for row in rows
+            ]
+            
+        except Exception as e:
+            self.logger.warning(f"SQL向量检索失败，使用PGVector检索: {str(e)}")
+            return self.vector_store.similarity_search_by_vector(embedding, k=k)
+    
+    def stream_query(self, question: str) -> Iterator[str]:
+        """
+        流式查询知识库，逐段返回LLM生成的回答
+        
+        检索完成后即开始输出，首个token无需等待完整回答生成
+        
+        Args:
+            question: 用户问题
+            
+        Yields:
+            str: 回答片段
+        """
+        if not self.retrieval_chain:
+            yield "知识库为空，请先上传文档。"
+            return
+        
+        try:
+            docs = self.search_by_vector(self.embedding_model.embed_query(question))
+            
+            # 与stuff链一致：分块内容以空行拼接为上下文
+            context = "\n\n".join(doc.page_content for doc in docs)
+            messages = self.qa_prompt.format_messages(context=context, question=question)
+            
+            for chunk in self.chat_model.stream(messages):
+                if chunk.content:
+                    yield chunk.content
+                    
+        except Exception as e:
+            self.logger.error(f"流式查询失败: {str(e)}")
+            yield f"查询过程中发生错误: {str(e)}"
+    
     def get_chunk_count(self) -> int:
-        """获取分块数量（从langchain_pg_embedding表）"""
+        """获取当前知识库的分块数量（从langchain_pg_embedding表）"""
         try:
-            from sqlalchemy import create_engine, text
-            engine = create_engine(self.supabase_config.postgres_url)
-            
-            # 直接统计langchain_pg_embedding表中的分块数量
-            with engine.connect() as conn:
-                result = conn.execute(text("""
-                    SELECT COUNT(*) FROM langchain_pg_embedding
-                """))
+            # 复用向量存储的连接池，避免每次查询都重新建立连接
+            with self._db_engine.connect() as conn:
+                result = conn.execute(_SQL_COUNT_CHUNKS, {"collection_uuid": self._collection_uuid})
                 count = result.scalar()
             
-            engine.dispose()  # 释放连接池
             return count if count is not None else 0
             
         except Exception as e:
@@ -763,29 +1440,30 @@ class SupabaseRAG:
                 .eq("collection_name", self.supabase_config.collection_name)\
                 .execute()
             
+            # 一次取出该知识库全部document_metadata记录，按文件名建立索引（避免逐个文件查询）
+            metadata_response = self.supabase.table("document_metadata")\
+                .select("id, filename, chunk_count")\
+                .eq("collection_name", self.supabase_config.collection_name or "default")\
+                .execute()
+            
+            metadata_by_filename = {}
+            for record in metadata_response.data:
+                metadata_by_filename.setdefault(record.get("filename"), record)
+            
             # 通过document_metadata表获取分块统计
             files_with_chunks = []
             for file_data in response.data:
                 filename = file_data.get("original_filename", file_data.get("filename"))
                 
-                # 查询对应的document_metadata记录
-                metadata_response = self.supabase.table("document_metadata")\
-                    .select("id, chunk_count")\
-                    .eq("filename", filename)\
-                    .eq("collection_name", self.supabase_config.collection_name or "default")\
-                    .execute()
-                
-                # 获取分块数量和文档ID
-                chunk_count = 0
-                document_id = None
-                if metadata_response.data:
-                    chunk_count = metadata_response.data[0].get("chunk_count", 0)
-                    document_id = metadata_response.data[0].get("id")
-                
                 # 只有当有document_metadata记录时才返回（因为这是文档列表）
-                if document_id is None:
+                metadata_record = metadata_by_filename.get(filename)
+                if metadata_record is None:
                     continue  # 跳过没有文档元数据的文件
                 
+                # 获取分块数量和文档ID
+                chunk_count = metadata_record.get("chunk_count", 0)
+                document_id = metadata_record.get("id")
+                
                 # 构造返回数据
                 file_info = {
                     "id": document_id,  # 返回document_metadata.id，用于删除操作
@@ -807,12 +1485,18 @@ class SupabaseRAG:
     
     def get_files_info(self) -> List[Dict[str, Any]]:
         """获取原始文件信息列表"""
+        cache_key = ("get_files_info",)
+        cached = self._meta_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
             response = self.supabase.table("document_files")\
                 .select("*")\
                 .eq("collection_name", self.supabase_config.collection_name)\
                 .execute()
             
+            self._meta_cache.set(cache_key, response.data)
             return response.data
             
         except Exception as e:
@@ -821,6 +1505,11 @@ class SupabaseRAG:
     
     def get_single_file_info(self, file_id: str) -> Optional[Dict[str, Any]]:
         """获取单个文件信息"""
+        cache_key = ("get_single_file_info", file_id)
+        cached = self._meta_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
             response = self.supabase.table("document_files")\
                 .select("*")\
@@ -828,6 +1517,7 @@ class SupabaseRAG:
                 .execute()
             
             if response.data:
+                self._meta_cache.set(cache_key, response.data[0])
                 return response.data[0]
             return None
             
@@ -835,6 +1525,35 @@ class SupabaseRAG:
             self.logger.error(f"获取文件信息失败: {str(e)}")
             return None
     
+    def _load_file_chunks(self, filename: str) -> List[Dict[str, Any]]:
+        """
+        从向量存储中读取指定文件的全部分块
+
+        在数据库端用jsonb_agg把所有行聚合成一个JSON数组，一次往返取回，
+        驱动只解析一个值，避免在Python中逐行组装字典
+
+        Args:
+            filename: 文件名
+
+        Returns:
+            List[Dict[str, Any]]: 分块列表
+        """
+        with self._db_engine.connect() as conn:
+            # 按cmetadata中的文件名精确匹配（走表达式索引）；缺少chunk_id时才在库内生成随机ID
+            chunks = conn.execute(
+                _SQL_FILE_CHUNKS,
+                {"collection_uuid": self._collection_uuid, "filename": filename}
+            ).scalar()
+
+        if not chunks:
+            return []
+
+        # 查询时间对所有分块相同，只取一次
+        now = datetime.now()
+        for chunk in chunks:
+            chunk["created_at"] = now
+        return chunks
+
     def get_chunks_by_metadata_id(self, metadata_id: str) -> List[Dict[str, Any]]:
         """根据document_metadata.id获取分块"""
         try:
@@ -849,29 +1568,7 @@ class SupabaseRAG:
             
             filename = doc_info.data[0].get("filename")
             
-            # 从向量存储中查询相关分块
-            from sqlalchemy import create_engine, text
-            engine = create_engine(self.supabase_config.postgres_url)
-            
-            chunks = []
-            with engine.connect() as conn:
-                result = conn.execute(text("""
-                    SELECT document, cmetadata 
-                    FROM langchain_pg_embedding 
-                    WHERE document LIKE :filename_pattern
-                """), {"filename_pattern": f"%{filename}%"})
-                
-                for row in result:
-                    chunk = {
-                        "id": row.cmetadata.get("chunk_id", str(uuid.uuid4())),
-                        "content": row.document,
-                        "metadata": row.cmetadata,
-                        "created_at": datetime.now()
-                    }
-                    chunks.append(chunk)
-            
-            engine.dispose()
-            return chunks
+            return self._load_file_chunks(filename)
             
         except Exception as e:
             self.logger.error(f"根据元数据ID获取分块失败: {str(e)}")
@@ -891,29 +1588,7 @@ class SupabaseRAG:
             
             filename = file_info.data[0].get("filename")
             
-            # 从向量存储中查询相关分块
-            from sqlalchemy import create_engine, text
-            engine = create_engine(self.supabase_config.postgres_url)
-            
-            chunks = []
-            with engine.connect() as conn:
-                result = conn.execute(text("""
-                    SELECT document, cmetadata 
-                    FROM langchain_pg_embedding 
-                    WHERE document LIKE :filename_pattern
-                """), {"filename_pattern": f"%{filename}%"})
-                
-                for row in result:
-                    chunk = {
-                        "id": row.cmetadata.get("chunk_id", str(uuid.uuid4())),
-                        "content": row.document,
-                        "metadata": row.cmetadata,
-                        "created_at": datetime.now()
-                    }
-                    chunks.append(chunk)
-            
-            engine.dispose()
-            return chunks
+            return self._load_file_chunks(filename)
             
         except Exception as e:
             self.logger.error(f"获取文件分块失败: {str(e)}")
@@ -942,8 +1617,11 @@ class SupabaseRAG:
                 
                 if response.data:
                     file_info = response.data[0]
-                    import base64
-                    file_content = base64.b64decode(file_info["file_content"]) if isinstance(file_info["file_content"], str) else file_info["file_content"]
+                    file_content = file_info["file_content"]
+                    if isinstance(file_content, str):
+                        # 直接调用C实现的解码，跳过base64模块的额外校验；解码后立即释放base64字符串
+                        file_content = binascii.a2b_base64(file_content)
+                        file_info["file_content"] = None
                     return (
                         file_info["filename"],
                         file_info["content_type"],
@@ -968,21 +1646,43 @@ class SupabaseRAG:
         Returns:
             文件ID（如果存在）或 None
         """
-        import hashlib
-        
         try:
-            file_hash = hashlib.sha256(file_content).hexdigest()
-            response = self.supabase.rpc("check_file_exists", {"file_hash_input": file_hash}).execute()
-            
-            if response.data:
-                return response.data[0]["file_id"]
+            # 哈希仅用于去重，不涉及安全用途
+            file_hash = hashlib.sha256(file_content, usedforsecurity=False).hexdigest()
+            return self._find_file_id_by_hash(file_hash)
             
+        except Exception as e:
+            self.logger.error(f"检查文件是否存在失败: {str(e)}")
             return None
+    
+    def check_file_exists_by_path(self, file_path: str) -> Optional[str]:
+        """
+        检查本地文件是否已存在（基于哈希，按块流式计算，无需把整个文件读入内存）
+        
+        Args:
+            file_path: 文件路径
+            
+        Returns:
+            文件ID（如果存在）或 None
+        """
+        try:
+            with open(file_path, "rb") as f:
+                file_hash = hashlib.file_digest(f, "sha256").hexdigest()
+            return self._find_file_id_by_hash(file_hash)
             
         except Exception as e:
             self.logger.error(f"检查文件是否存在失败: {str(e)}")
             return None
     
+    def _find_file_id_by_hash(self, file_hash: str) -> Optional[str]:
+        """按文件哈希查找已存在的文件ID"""
+        response = self.supabase.rpc("check_file_exists", {"file_hash_input": file_hash}).execute()
+        
+        if response.data:
+            return response.data[0]["file_id"]
+        
+        return None
+    
     def delete_chunks_only(self, metadata_id: str) -> bool:
         """
         只删除分块数据（保留原始文件和元数据记录）
@@ -996,7 +1696,7 @@ class SupabaseRAG:
         try:
             # 1. 获取分块元数据信息
             metadata_info = self.supabase.table("document_metadata")\
-                .select("filename")\
+                .select("filename, chunk_count")\
                 .eq("id", metadata_id)\
                 .execute()
             
@@ -1005,41 +1705,24 @@ class SupabaseRAG:
                 return False
             
             filename = metadata_info.data[0].get("filename")
+            previous_chunk_count = metadata_info.data[0].get("chunk_count") or 0
             
-            # 2. 删除向量存储中的相关分块
-            try:
-                from sqlalchemy import create_engine, text
-                engine = create_engine(self.supabase_config.postgres_url)
-                
-                with engine.begin() as conn:  # 使用 begin() 确保自动提交事务
-                    # 使用cmetadata中的filename和collection_name精确删除
-                    collection_name = self.supabase_config.collection_name or "default"
-                    result = conn.execute(text("""
-                        DELETE FROM langchain_pg_embedding e
-                        USING langchain_pg_collection c
-                        WHERE e.collection_id = c.uuid 
-                        AND c.name = :collection_name
-                        AND e.cmetadata->>'filename' = :filename
-                    """), {
-                        "collection_name": collection_name,
-                        "filename": filename
-                    })
-                    
-                    self.logger.info(f"删除了 {result.rowcount} 个向量记录（文件: {filename}，知识库: {collection_name}）")
-                
-                
-            except Exception as e:
-                self.logger.warning(f"删除向量存储失败: {str(e)}")
+            # 2. 删除向量存储中的相关分块，同时将分块元数据的chunk_count设为0
+            #    （保留元数据记录和原始文件；两者互不依赖，并发执行）
+            deleted_vectors, _ = self._run_concurrently(
+                lambda: self._delete_file_vectors(filename),
+                lambda: self.supabase.table("document_metadata").update({"chunk_count": 0}).eq("id", metadata_id).execute()
+            )
             
-            # 3. 更新分块元数据，将chunk_count设为0（保留元数据记录和原始文件）
-            self.supabase.table("document_metadata")\
-                .update({"chunk_count": 0})\
-                .eq("id", metadata_id)\
-                .execute()
+            # 分块早已删除时统计和缓存都不会变化，跳过更新
+            if not deleted_vectors and not previous_chunk_count:
+                self.logger.info(f"分块已不存在，无需更新统计: {metadata_id}")
+                return True
             
-            # 4. 更新知识库统计
+            # 3. 更新知识库统计
             kb_name = self.supabase_config.collection_name or "default"
             self._update_knowledge_base_stats(kb_name)
+            self._invalidate_caches()
             
             self.logger.info(f"分块已删除（保留原始文件和元数据）: {metadata_id}")
             return True
@@ -1071,46 +1754,18 @@ class SupabaseRAG:
             
             filename = file_info.data[0].get("filename")
             
-            # 2. 删除向量存储中的相关分块
-            try:
-                from sqlalchemy import create_engine, text
-                engine = create_engine(self.supabase_config.postgres_url)
-                
-                with engine.begin() as conn:  # 使用 begin() 确保自动提交事务
-                    # 使用cmetadata中的filename和collection_name精确删除
-                    collection_name = self.supabase_config.collection_name or "default"
-                    result = conn.execute(text("""
-                        DELETE FROM langchain_pg_embedding e
-                        USING langchain_pg_collection c
-                        WHERE e.collection_id = c.uuid 
-                        AND c.name = :collection_name
-                        AND e.cmetadata->>'filename' = :filename
-                    """), {
-                        "collection_name": collection_name,
-                        "filename": filename
-                    })
-                    
-                    self.logger.info(f"删除了 {result.rowcount} 个向量记录（文件: {filename}，知识库: {collection_name}）")
-                
-                
-            except Exception as e:
-                self.logger.warning(f"删除向量存储失败: {str(e)}")
-            
-            # 3. 删除关联的文档元数据
-            self.supabase.table("document_metadata")\
-                .delete()\
-                .eq("file_id", file_id)\
-                .execute()
-            
-            # 4. 删除原始文件
-            self.supabase.table("document_files")\
-                .delete()\
-                .eq("id", file_id)\
-                .execute()
+            # 2. 并发删除向量存储中的相关分块、关联的文档元数据和原始文件记录（三者互不依赖）
+            deleted_vectors, metadata_response, _ = self._run_concurrently(
+                lambda: self._delete_file_vectors(filename),
+                lambda: self.supabase.table("document_metadata").delete().eq("file_id", file_id).execute(),
+                lambda: self.supabase.table("document_files").delete().eq("id", file_id).execute()
+            )
             
-            # 4. 更新知识库统计
-            kb_name = self.supabase_config.collection_name or "default"
-            self._update_knowledge_base_stats(kb_name)
+            # 3. 更新知识库统计（统计只来自分块元数据，没有删除分块和元数据时无需重算）
+            if deleted_vectors or metadata_response.data:
+                kb_name = self.supabase_config.collection_name or "default"
+                self._update_knowledge_base_stats(kb_name)
+            self._invalidate_caches()
             
             self.logger.info(f"文件及其关联分块删除完成: {file_id}")
             return True
@@ -1119,60 +1774,96 @@ class SupabaseRAG:
             self.logger.error(f"删除文件失败: {str(e)}")
             return False
     
+    def _delete_file_vectors(self, filename: str) -> int:
+        """
+        删除当前知识库中指定文件的全部分块向量（失败时只记录警告）
+        
+        Args:
+            filename: 文件名（对应cmetadata中的filename）
+            
+        Returns:
+            int: 删除的向量记录数
+        """
+        try:
+            with self._db_engine.begin() as conn:  # 使用 begin() 确保自动提交事务
+                # 使用cmetadata中的filename和缓存的集合UUID精确删除
+                result = conn.execute(_SQL_DELETE_FILE_VECTORS, {
+                    "collection_uuid": self._collection_uuid,
+                    "filename": filename
+                })
+            
+            collection_name = self.supabase_config.collection_name or "default"
+            self.logger.info(f"删除了 {result.rowcount} 个向量记录（文件: {filename}，知识库: {collection_name}）")
+            return result.rowcount
+            
+        except Exception as e:
+            self.logger.warning(f"删除向量存储失败: {str(e)}")
+            return 0
+    
+    def _invalidate_caches(self):
+        """知识库内容变更后清空语义缓存和文件列表缓存"""
+        self.semantic_cache.clear()
+        self._meta_cache.clear()
+    
+    @staticmethod
+    def _run_concurrently(*calls):
+        """在线程池中并发执行互不依赖的请求，全部完成后按顺序返回各自的结果；任一请求失败时抛出其异常"""
+        with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+            futures = [executor.submit(call) for call in calls]
+            return [future.result() for future in futures]
+    
     # 已删除 delete_document 方法，使用更明确的 delete_chunks_only 或 delete_file_and_chunks
     
     def clear_chunks(self) -> bool:
         """清空知识库的所有分块"""
         try:
+            deleted_vectors = 0
+            
             # 1. 清空向量存储表
             try:
                 # 直接删除documents表中指定collection的所有记录
-                from sqlalchemy import create_engine, text
-                engine = create_engine(self.supabase_config.postgres_url)
-                
-                with engine.connect() as conn:
+                with self._db_engine.connect() as conn:
                     # 开始事务
                     trans = conn.begin()
                     try:
                         # 删除向量存储中的文档
-                        result = conn.execute(text("""
-                            DELETE FROM langchain_pg_embedding 
-                            WHERE collection_id IN (
-                                SELECT uuid FROM langchain_pg_collection 
-                                WHERE name = :collection_name
-                            )
-                        """), {"collection_name": self.supabase_config.collection_name or "default"})  # 使用动态知识库名称
+                        result = conn.execute(
+                            _SQL_DELETE_COLLECTION_VECTORS,
+                            {"collection_uuid": self._collection_uuid}  # 当前知识库的集合
+                        )
                         
                         # 提交事务
                         trans.commit()
-                        self.logger.info(f"删除了 {result.rowcount} 个向量记录")
+                        deleted_vectors = result.rowcount
+                        self.logger.info(f"删除了 {deleted_vectors} 个向量记录")
                         
                     except Exception as e:
                         trans.rollback()
                         raise e
                 
-                engine.dispose()
                 
             except Exception as e:
                 self.logger.warning(f"清空向量存储失败: {str(e)}")
             
-            # 2. 清空元数据表
-            self.supabase.table("document_metadata")\
-                .delete()\
-                .eq("collection_name", self.supabase_config.collection_name)\
-                .execute()
+            # 2. 并发清空元数据表和文件表（两者互不依赖）
+            collection_name = self.supabase_config.collection_name
+            metadata_response, files_response = self._run_concurrently(
+                lambda: self.supabase.table("document_metadata").delete().eq("collection_name", collection_name).execute(),
+                lambda: self.supabase.table("document_files").delete().eq("collection_name", collection_name).execute()
+            )
             
-            # 3. 清空文件表
-            self.supabase.table("document_files")\
-                .delete()\
-                .eq("collection_name", self.supabase_config.collection_name)\
-                .execute()
+            kb_name = self.supabase_config.collection_name or "default"
+            
+            # 知识库本来就是空的：跳过检索链重建和统计更新
+            if not deleted_vectors and not metadata_response.data and not files_response.data:
+                self.logger.info(f"知识库 '{kb_name}' 已为空，无需清空")
+                return True
             
             # 4. 重新初始化向量存储和检索链以反映清空后的状态
             self._init_retrieval_chain()
+            self._invalidate_caches()
             
             # 5. 更新知识库统计
-            kb_name = self.supabase_config.collection_name or "default"
             self._update_knowledge_base_stats(kb_name)
             self.logger.info(f"知识库 '{kb_name}' 清空完成")
             return True
@@ -1201,6 +1892,7 @@ class SupabaseRAG:
             # 重新初始化模型
             self.chat_model = self._init_chat_model()
             self.embedding_model = self._init_embedding_model()
+            self.qa_chain = self._init_qa_chain()
             
             # 更新文本分割器
             self.text_splitter = SmartTextSplitter(
@@ -1211,6 +1903,12 @@ class SupabaseRAG:
             # 重新初始化向量存储和检索链
             self._init_vector_store()
             
+            # 模型或检索参数可能已变化，重建语义缓存
+            self.semantic_cache = SemanticCache(
+                threshold=new_config.semantic_cache_threshold,
+                max_size=new_config.semantic_cache_size
+            )
+            
             self.logger.info("配置更新完成")
             return True
             
@@ -1220,41 +1918,59 @@ class SupabaseRAG:
     
     # 知识库管理方法
     
-    def get_files_by_knowledge_base(self, kb_name: str) -> List[Dict[str, Any]]:
-        """获取指定知识库的文件列表"""
+    def get_files_by_knowledge_base(self, kb_name: str, page: int = 0, page_size: int = 0) -> List[Dict[str, Any]]:
+        """
+        获取指定知识库的文件列表（按创建时间倒序）
+        
+        Args:
+            kb_name: 知识库名称
+            page: 页码（从0开始）
+            page_size: 每页文件数，0表示不分页返回全部
+            
+        Returns:
+            List[Dict[str, Any]]: 文件信息列表
+        """
+        cache_key = ("get_files_by_knowledge_base", kb_name, page, page_size)
+        cached = self._meta_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            response = self.supabase.table("document_files")\
-                .select("*")\
+            query = self.supabase.table("document_files")\
+                .select(self.FILE_LIST_COLUMNS)\
                 .eq("collection_name", kb_name)\
-                .order("created_at", desc=True)\
-                .execute()
+                .order("created_at", desc=True)
+            if page_size > 0:
+                query = query.range(page * page_size, (page + 1) * page_size - 1)
+            response = query.execute()
             
-            files = []
-            for file_data in response.data:
-                # 动态计算chunk_count
-                chunk_count = 0
+            # 一次分组查询得到所有文件的分块数量，避免逐个文件查询
+            chunk_counts = {}
+            if response.data:
                 try:
-                    from sqlalchemy import create_engine, text
-                    engine = create_engine(self.supabase_config.postgres_url)
+                    # 使用业务层知识库名称作为collection名称
+                    collection_uuid = self._get_collection_uuid(kb_name)
                     
-                    with engine.connect() as conn:
-                        # 使用业务层知识库名称作为collection名称
+                    with self._db_engine.connect() as conn:
                         result = conn.execute(text("""
-                            SELECT COUNT(*)
-                            FROM langchain_pg_embedding e
-                            JOIN langchain_pg_collection c ON e.collection_id = c.uuid
-                            WHERE c.name = :collection_name
-                            AND e.cmetadata->>'filename' = :filename
+                            SELECT cmetadata->>'filename' AS filename, COUNT(*) AS chunk_count
+                            FROM langchain_pg_embedding
+                            WHERE collection_id = :collection_uuid
+                            AND cmetadata->>'filename' = ANY(:filenames)
+                            GROUP BY cmetadata->>'filename'
                         """), {
-                            "collection_name": kb_name,
-                            "filename": file_data['filename']
+                            "collection_uuid": collection_uuid,
+                            "filenames": [file_data["filename"] for file_data in response.data]
                         })
                         
-                        chunk_count = result.scalar() or 0
+                        chunk_counts = {row.filename: row.chunk_count for row in result}
                     
-                    engine.dispose()
                 except Exception as e:
                     self.logger.warning(f"计算分块数量失败: {str(e)}")
+            
+            files = []
+            for file_data in response.data:
+                chunk_count = chunk_counts.get(file_data["filename"], 0)
                 
                 file_info = {
                     "id": file_data["id"],
@@ -1270,6 +1986,7 @@ class SupabaseRAG:
                 }
                 files.append(file_info)
             
+            self._meta_cache.set(cache_key, files)
             return files
             
         except Exception as e:
@@ -1278,9 +1995,14 @@ class SupabaseRAG:
     
     def get_single_file_info_by_kb(self, file_id: str, kb_name: str) -> Optional[Dict[str, Any]]:
         """获取指定知识库中的单个文件信息"""
+        cache_key = ("get_single_file_info_by_kb", kb_name, file_id)
+        cached = self._meta_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
             response = self.supabase.table("document_files")\
-                .select("*")\
+                .select(self.FILE_LIST_COLUMNS)\
                 .eq("id", file_id)\
                 .eq("collection_name", kb_name)\
                 .execute()
@@ -1293,30 +2015,27 @@ class SupabaseRAG:
             # 动态计算chunk_count
             chunk_count = 0
             try:
-                from sqlalchemy import create_engine, text
-                engine = create_engine(self.supabase_config.postgres_url)
-                    
-                with engine.connect() as conn:
-                    # 使用业务层知识库名称作为collection名称
+                # 使用业务层知识库名称作为collection名称
+                collection_uuid = self._get_collection_uuid(kb_name)
+                
+                with self._db_engine.connect() as conn:
                     result = conn.execute(text("""
                         SELECT COUNT(*)
-                        FROM langchain_pg_embedding e
-                        JOIN langchain_pg_collection c ON e.collection_id = c.uuid
-                        WHERE c.name = :collection_name
-                        AND e.cmetadata->>'filename' = :filename
+                        FROM langchain_pg_embedding
+                        WHERE collection_id = :collection_uuid
+                        AND cmetadata->>'filename' = :filename
                     """), {
-                        "collection_name": kb_name,
+                        "collection_uuid": collection_uuid,
                         "filename": file_data['filename']
                     })
                     
                     chunk_count = result.scalar() or 0
                 
-                engine.dispose()
                 
             except Exception as e:
                 self.logger.warning(f"计算分块数量失败: {str(e)}")
             
-            return {
+            file_info = {
                 "id": file_data["id"],
                 "filename": file_data["filename"],
                 "original_filename": file_data["original_filename"],
@@ -1328,6 +2047,8 @@ class SupabaseRAG:
                 "created_at": file_data["created_at"],
                 "updated_at": file_data["updated_at"]
             }
+            self._meta_cache.set(cache_key, file_info)
+            return file_info
             
         except Exception as e:
             self.logger.error(f"获取文件信息失败: {str(e)}")
@@ -1338,46 +2059,41 @@ class SupabaseRAG:
         try:
             self.logger.info(f"开始清空知识库: {kb_name}")
             
-            from sqlalchemy import create_engine, text
-            engine = create_engine(self.supabase_config.postgres_url)
-            
-            with engine.connect() as conn:
-                trans = conn.begin()
-                try:
-                    # 1. 删除该知识库的所有向量数据
-                    # 直接删除整个collection的数据，实现真正的知识库隔离
-                    conn.execute(text("""
-                        DELETE FROM langchain_pg_embedding e
-                        USING langchain_pg_collection c
-                        WHERE e.collection_id = c.uuid 
-                        AND c.name = :collection_name
-                    """), {"collection_name": kb_name})
-                    
-                    # 2. 删除文档元数据
-                    self.supabase.table("document_metadata")\
-                        .delete()\
-                        .eq("collection_name", kb_name)\
-                        .execute()
-                    
-                    # 3. 删除原始文件
-                    self.supabase.table("document_files")\
-                        .delete()\
-                        .eq("collection_name", kb_name)\
-                        .execute()
-                    
-                    trans.commit()
-                    
-                except Exception as e:
-                    trans.rollback()
-                    raise e
+            # 1. 在同一条语句中删除该知识库的向量数据、文档元数据和原始文件记录：
+            # 一次往返，且在同一事务内完成，不会因部分失败留下孤立记录
+            # （知识库记录本身保留，因此不能通过删除knowledge_bases级联）
+            collection_uuid = self._get_collection_uuid(kb_name)
+            with self._db_engine.begin() as conn:
+                deleted = conn.execute(text("""
+                    WITH deleted_vectors AS (
+                        DELETE FROM langchain_pg_embedding
+                        WHERE collection_id = :collection_uuid
+                        RETURNING 1
+                    ), deleted_metadata AS (
+                        DELETE FROM document_metadata
+                        WHERE collection_name = :kb_name
+                        RETURNING 1
+                    ), deleted_files AS (
+                        DELETE FROM document_files
+                        WHERE collection_name = :kb_name
+                        RETURNING 1
+                    )
+                    SELECT (SELECT count(*) FROM deleted_vectors)
+                         + (SELECT count(*) FROM deleted_metadata)
+                         + (SELECT count(*) FROM deleted_files)
+                """), {"collection_uuid": collection_uuid, "kb_name": kb_name}).scalar()
             
-            engine.dispose()
+            # 知识库本来就是空的：跳过检索链重建和统计更新
+            if not deleted:
+                self.logger.info(f"知识库 {kb_name} 已为空，无需清空")
+                return True
             
-            # 4. 重新初始化检索链以反映清空后的状态
+            # 2. 重新初始化检索链以反映清空后的状态
             if hasattr(self, 'vector_store') and self.vector_store:
                 self._init_retrieval_chain()
+            self._invalidate_caches()
             
-            # 5. 更新知识库统计
+            # 3. 更新知识库统计
             self._update_knowledge_base_stats(kb_name)
             
             self.logger.info(f"知识库 {kb_name} 清空完成")
@@ -1,25 +1,44 @@
 """文件处理工具"""
 
+import io
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
-import tempfile
+from typing import Callable, Iterable, List, Dict, Any, Tuple
 
 from ..config.models import Document
 from .logger import rag_logger
 
 
+def file_extension(filename: str) -> str:
+    """
+    取文件扩展名（保留大小写），语义与Path.suffix相同：以点开头的文件名（如.bashrc）
+    和以点结尾的文件名没有扩展名；纯字符串操作，不构造Path对象，同时按/和\\分隔路径
+    """
+    name = filename[max(filename.rfind('/'), filename.rfind('\\')) + 1:]
+    index = name.rfind('.')
+    return name[index:] if 0 < index < len(name) - 1 else ''
+
+
 class FileProcessor:
     """文件处理器，支持多种文档格式"""
     
-    SUPPORTED_EXTENSIONS = {'.txt', '.pdf', '.docx', '.doc', '.md'}
+    SUPPORTED_EXTENSIONS = frozenset({'.txt', '.pdf', '.docx', '.doc', '.md'})
+    
+    # 批量处理的最大线程数
+    MAX_WORKERS = min(8, os.cpu_count() or 4)
     
     def __init__(self):
         self.logger = rag_logger
     
+    @staticmethod
+    def _extension(file_path: str) -> str:
+        """取小写扩展名"""
+        return file_extension(file_path).lower()
+    
     def is_supported(self, file_path: str) -> bool:
         """检查文件格式是否支持"""
-        return Path(file_path).suffix.lower() in self.SUPPORTED_EXTENSIONS
+        return self._extension(file_path) in self.SUPPORTED_EXTENSIONS
     
     def process_file(self, file_path: str, **kwargs) -> List[Document]:
         """
@@ -38,40 +57,13 @@ class FileProcessor:
             if not file_path.exists():
                 raise FileNotFoundError(f"文件不存在: {file_path}")
             
-            if not self.is_supported(str(file_path)):
+            extension = self._extension(str(file_path))
+            if extension not in self.SUPPORTED_EXTENSIONS:
                 raise ValueError(f"不支持的文件格式: {file_path.suffix}")
             
             self.logger.info(f"开始处理文件: {file_path}")
             
-            # 根据文件类型调用相应的处理方法
-            extension = file_path.suffix.lower()
-            
-            if extension == '.txt':
-                content = self._process_txt(file_path)
-            elif extension == '.pdf':
-                content = self._process_pdf(file_path)
-            elif extension in ['.docx', '.doc']:
-                content = self._process_docx(file_path)
-            elif extension == '.md':
-                content = self._process_markdown(file_path)
-            else:
-                raise ValueError(f"不支持的文件格式: {extension}")
-            
-            # 创建文档对象
-            metadata = {
-                "source": str(file_path),
-                "filename": file_path.name,
-                "file_type": extension,
-                "file_size": file_path.stat().st_size,
-            }
-            
-            document = Document(
-                content=content,
-                metadata=metadata
-            )
-            
-            self.logger.info(f"文件处理完成: {file_path}, 内容长度: {len(content)}")
-            return [document]
+            return self._build_documents(file_path.read_bytes(), str(file_path), file_path.name, extension)
             
         except Exception as e:
             self.logger.error(f"文件处理失败: {file_path}, 错误: {str(e)}")
@@ -79,7 +71,7 @@ class FileProcessor:
     
     def process_uploaded_file(self, file_content: bytes, filename: str) -> List[Document]:
         """
-        处理上传的文件内容
+        处理上传的文件内容（直接解析内存中的字节，不经过临时文件）
         
         Args:
             file_content: 文件二进制内容
@@ -89,65 +81,154 @@ class FileProcessor:
             List[Document]: 文档列表
         """
         try:
-            # 创建临时文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix=Path(filename).suffix) as temp_file:
-                temp_file.write(file_content)
-                temp_file_path = temp_file.name
+            extension = self._extension(filename)
+            if extension not in self.SUPPORTED_EXTENSIONS:
+                raise ValueError(f"不支持的文件格式: {extension or filename}")
             
-            try:
-                # 处理临时文件
-                documents = self.process_file(temp_file_path)
-                
-                # 更新元数据中的文件名
-                for doc in documents:
-                    doc.metadata["filename"] = filename
-                    doc.metadata["source"] = filename
-                
-                return documents
-                
-            finally:
-                # 清理临时文件
-                os.unlink(temp_file_path)
+            return self._build_documents(file_content, filename, filename, extension)
                 
         except Exception as e:
             self.logger.error(f"上传文件处理失败: {filename}, 错误: {str(e)}")
             raise
     
-    def _process_txt(self, file_path: Path) -> str:
+    def process_files(self, file_paths: Iterable[str]) -> List[Document]:
+        """
+        并发处理多个文件，单个文件失败只记录日志，不影响其余文件
+        
+        Args:
+            file_paths: 文件路径列表
+            
+        Returns:
+            List[Document]: 所有成功处理的文件的文档列表（按输入顺序）
+        """
+        return self._process_batch(lambda path: self.process_file(path), list(file_paths))
+    
+    def process_uploaded_files(self, files: Iterable[Tuple[bytes, str]]) -> List[Document]:
+        """
+        并发处理多个上传文件，单个文件失败只记录日志，不影响其余文件
+        
+        Args:
+            files: (文件二进制内容, 文件名) 列表
+            
+        Returns:
+            List[Document]: 所有成功处理的文件的文档列表（按输入顺序）
+        """
+        return self._process_batch(lambda item: self.process_uploaded_file(*item), list(files))
+    
+    def _process_batch(self, handler: Callable[[Any], List[Document]], items: List[Any]) -> List[Document]:
+        """用线程池并发执行解析（PDF/DOCX解析的C扩展和文件读取会释放GIL）"""
+        def safe_handler(item) -> List[Document]:
+            try:
+                return handler(item)
+            except Exception:
+                # 具体错误已在单文件处理方法中记录
+                return []
+        
+        if len(items) <= 1:
+            results = [safe_handler(item) for item in items]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.MAX_WORKERS, len(items))) as executor:
+                results = list(executor.map(safe_handler, items))
+        
+        return [document for documents in results for document in documents]
+    
+    def _build_documents(self, data: bytes, source: str, filename: str, extension: str) -> List[Document]:
+        """根据文件类型解析内容并创建文档对象（扩展名已由调用方校验）"""
+        # 根据文件类型调用相应的处理方法
+        content = self._HANDLERS[extension](self, data)
+        
+        # 创建文档对象
+        metadata = {
+            "source": source,
+            "filename": filename,
+            "file_type": extension,
+            "file_size": len(data),
+        }
+        
+        document = Document(
+            content=content,
+            metadata=metadata
+        )
+        
+        self.logger.info(f"文件处理完成: {source}, 内容长度: {len(content)}")
+        return [document]
+    
+    def _process_txt(self, data: bytes) -> str:
         """处理TXT文件"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
+            text = data.decode('utf-8')
         except UnicodeDecodeError:
             # 尝试其他编码
-            with open(file_path, 'r', encoding='gbk') as f:
-                return f.read()
+            text = data.decode('gbk')
+        # 与文本模式读取文件一致，统一换行符
+        return text.replace('\r\n', '\n').replace('\r', '\n')
     
-    def _process_pdf(self, file_path: Path) -> str:
-        """处理PDF文件"""
+    def _process_pdf(self, data: bytes) -> str:
+        """处理PDF文件（已安装PyMuPDF时优先使用，其文本提取在C层完成，比pypdf快数倍）"""
         try:
-            import pypdf
+            import fitz
             
-            content = []
-            with open(file_path, 'rb') as f:
-                reader = pypdf.PdfReader(f)
-                for page in reader.pages:
-                    content.append(page.extract_text())
+            with fitz.open(stream=data, filetype="pdf") as doc:
+                return '\n'.join(page.get_text() for page in doc)
             
-            return '\n'.join(content)
+        except ImportError:
+            pass
+        
+        try:
+            import pypdf
+            
+            reader = pypdf.PdfReader(io.BytesIO(data))
+            return '\n'.join(page.extract_text() for page in reader.pages)
             
         except ImportError:
             raise ImportError("处理PDF文件需要安装pypdf: uv add pypdf")
     
-    def _process_docx(self, file_path: Path) -> str:
-        """处理DOCX文件"""
+    def _process_docx(self, data: bytes) -> str:
+        """处理DOCX文件（已安装python-docx时优先使用，其基于lxml在C层解析XML，比docx2txt快数倍）"""
         try:
+            from docx import Document as Docx
+            from docx.oxml.ns import qn
+            from docx.text.paragraph import Paragraph
+            
+            document = Docx(io.BytesIO(data))
+            
+            # 与docx2txt提取的内容保持一致：页眉、正文、页脚中的全部段落，
+            # 按文档顺序遍历w:p元素，表格（含嵌套表格）单元格中的文字不会丢失
+            elements = []
+            for section in document.sections:
+                if not section.header.is_linked_to_previous:
+                    elements.append(section.header._element)
+            elements.append(document.element.body)
+            for section in document.sections:
+                if not section.footer.is_linked_to_previous:
+                    elements.append(section.footer._element)
+            
+            return '\n'.join(
+                Paragraph(p, None).text
+                for element in elements
+                for p in element.iter(qn('w:p'))
+            )
+            
+        except ImportError:
+            pass
+        
+        try:
+            # docx2txt通过zipfile读取，可直接传入内存文件对象
             import docx2txt
-            return docx2txt.process(str(file_path))
+            return docx2txt.process(io.BytesIO(data))
             
         except ImportError:
             raise ImportError("处理DOCX文件需要安装docx2txt: uv add docx2txt")
     
-    def _process_markdown(self, file_path: Path) -> str:
+    def _process_markdown(self, data: bytes) -> str:
         """处理Markdown文件"""
-        return self._process_txt(file_path)  # Markdown本质上是文本文件
\ No newline at end of file
+        return self._process_txt(data)  # Markdown本质上是文本文件
+    
+    # 扩展名 -> 解析方法（需定义在各处理方法之后）
+    _HANDLERS = {
+        '.txt': _process_txt,
+        '.md': _process_markdown,
+        '.pdf': _process_pdf,
+        '.docx': _process_docx,
+        '.doc': _process_docx,
+    }
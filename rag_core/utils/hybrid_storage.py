@@ -3,12 +3,58 @@
 小文件使用数据库存储，大文件使用Supabase Storage
 """
 
+import asyncio
+import base64
+import binascii
 import hashlib
-from pathlib import Path
-from typing import Optional, Tuple, Union
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import List, Optional, Tuple, Union
 from supabase import Client
 
+from ..utils.file_processor import file_extension
 from ..utils.logger import rag_logger
+from ..utils.ttl_cache import TTLCache
+
+try:
+    import zstandard
+    
+    # 压缩器/解压器在模块加载时创建一次，各次存取共用
+    _ZSTD_COMPRESSOR = zstandard.ZstdCompressor(level=3)
+    _ZSTD_DECOMPRESSOR = zstandard.ZstdDecompressor()
+except ImportError:
+    _ZSTD_COMPRESSOR = None
+    _ZSTD_DECOMPRESSOR = None
+
+
+# 扩展名 -> MIME类型
+_CONTENT_TYPES = {
+    '.pdf': 'application/pdf',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.doc': 'application/msword',
+    '.txt': 'text/plain',
+    '.md': 'text/markdown',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+}
+
+
+def _created_after(file_obj: dict, cutoff: datetime) -> bool:
+    """Storage列出的对象是否在cutoff之后创建（缺少或无法解析创建时间时视为较早创建）"""
+    try:
+        return datetime.fromisoformat(file_obj["created_at"]) > cutoff
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def _hash_blob(file_content: bytes) -> str:
+    """计算文件内容的SHA-256（十六进制）；OpenSSL实现在C层一次处理整个缓冲区并释放GIL"""
+    return hashlib.sha256(file_content, usedforsecurity=False).hexdigest()
 
 
 class HybridFileStorage:
@@ -17,17 +63,65 @@ class HybridFileStorage:
     # 文件大小阈值：所有文件都使用Storage存储（设为0表示全部使用Storage）
     SIZE_THRESHOLD = 0  
     
-    def __init__(self, supabase_client: Client, bucket_name: str = "documents"):
+    # 超过该大小的文件经S3协议分片并发上传（每片8MB，最多8片同时上传）
+    MULTIPART_THRESHOLD = 8 * 1024 * 1024
+    MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+    MULTIPART_CONCURRENCY = 8
+    
+    # 未配置S3时，超过该大小的文件走TUS断点续传（Supabase要求每片固定6MB）
+    RESUMABLE_THRESHOLD = 25 * 1024 * 1024
+    RESUMABLE_CHUNK_SIZE = 6 * 1024 * 1024
+    RESUMABLE_MAX_RETRIES = 3
+    
+    # 内容定义分块（FastCDC）参数：小于最大块的文件只会得到一个块，无跨文件去重收益，直接整体存储
+    CDC_MIN_SIZE = 256 * 1024
+    CDC_AVG_SIZE = 1024 * 1024
+    CDC_MAX_SIZE = 4 * 1024 * 1024
+    CDC_CONCURRENCY = 8
+    
+    # 清理孤立文件时每页列出的对象数、同时扫描的目录数，以及每批删除的对象数和同时删除的批数
+    CLEANUP_PAGE_SIZE = 1000
+    CLEANUP_CONCURRENCY = 16
+    CLEANUP_REMOVE_BATCH_SIZE = 1000
+    CLEANUP_REMOVE_CONCURRENCY = 8
+    # 清理时跳过创建不足此时长（秒）的对象和内容块：上传完成到写入文件记录之间它们还没有被引用
+    CLEANUP_MIN_AGE = 3600
+    
+    # 签名URL缓存：最多缓存的URL数，以及距过期多久前不再复用（秒）
+    SIGNED_URL_CACHE_SIZE = 1024
+    SIGNED_URL_SAFETY_MARGIN = 60
+    
+    # 去重检查返回的文件记录列（不含file_content，避免每次检查都拉取整个文件内容）
+    FILE_RECORD_COLUMNS = (
+        "id, filename, original_filename, content_type, file_size, file_hash, "
+        "storage_path, collection_name, created_at, updated_at, metadata"
+    )
+    
+    def __init__(self, supabase_client: Client, bucket_name: str = "documents",
+                 s3_config: Optional[dict] = None, resumable_config: Optional[dict] = None,
+                 chunk_dedup: bool = False):
         """
         初始化混合存储
         
         Args:
             supabase_client: Supabase客户端
             bucket_name: Storage bucket名称
+            s3_config: Storage S3协议的连接参数（endpoint_url、aws_access_key_id、
+                aws_secret_access_key、region_name），为空时只使用REST单次上传
+            resumable_config: TUS断点续传参数（endpoint、api_key），为空时不使用断点续传
+            chunk_dedup: 大文件是否按内容定义分块跨文件去重存储
         """
         self.supabase = supabase_client
         self.bucket_name = bucket_name
         self.logger = rag_logger
+        self.s3_config = s3_config
+        self.resumable_config = resumable_config
+        self.chunk_dedup = chunk_dedup
+        self._signed_url_cache = TTLCache(maxsize=self.SIGNED_URL_CACHE_SIZE, ttl=0)
+        # 数据库引擎（由SupabaseRAG在创建连接池后设置），用于直接读取bytea内容
+        self.db_engine = None
+        self._s3_client = None
+        self._s3_lock = threading.Lock()
         
         # 确保bucket存在
         self._ensure_bucket_exists()
@@ -53,7 +147,7 @@ class HybridFileStorage:
         return file_size > self.SIZE_THRESHOLD
     
     def store_file_sync(self, file_content: bytes, filename: str, 
-                       collection_name: str = "default") -> dict:
+                       collection_name: str = "default", file_hash: Optional[str] = None) -> dict:
         """
         存储文件（同步版本，所有文件使用Storage）
         
@@ -61,6 +155,7 @@ class HybridFileStorage:
             file_content: 文件内容
             filename: 文件名
             collection_name: 集合名称
+            file_hash: 调用方已计算好的SHA-256（十六进制），为空时在此计算
             
         Returns:
             文件信息字典
@@ -68,7 +163,7 @@ class HybridFileStorage:
         import uuid
         
         file_size = len(file_content)
-        file_hash = hashlib.sha256(file_content).hexdigest()
+        file_hash = file_hash or _hash_blob(file_content)
         
         # 检查文件是否已存在
         existing = self._check_file_exists_sync(file_hash)
@@ -87,20 +182,49 @@ class HybridFileStorage:
             "metadata": {"upload_source": "storage_bucket", "chunks_processed": False}
         }
         
-        # 所有文件都使用Storage存储
-        storage_path = self._store_in_storage_sync(file_content, filename, file_hash)
-        file_info.update({
-            "storage_path": storage_path,
-            "file_content": None  # 不存储在数据库中
-        })
-        self.logger.info(f"文件存储到Storage: {filename} ({file_size} bytes)")
+        # 大文件按内容块去重存储，其余文件整体存储到Storage
+        chunk_recipe = self._store_chunked_sync(file_content, file_info["content_type"])
+        if chunk_recipe is not None:
+            file_info["metadata"]["chunk_recipe"] = chunk_recipe
+            file_info.update({
+                "storage_path": None,
+                "file_content": None
+            })
+            self.logger.info(f"文件按内容块存储到Storage: {filename} ({file_size} bytes, {len(chunk_recipe)} 个块)")
+        else:
+            storage_path = self._store_in_storage_sync(file_content, filename, file_hash, file_info["content_type"])
+            file_info.update({
+                "storage_path": storage_path,
+                "file_content": None  # 不存储在数据库中
+            })
+            self.logger.info(f"文件存储到Storage: {filename} ({file_size} bytes)")
         
         # 插入文件记录
         result = self.supabase.table("document_files").insert(file_info).execute()
         return result.data[0]
     
+    def delete_file_sync(self, file_id: str):
+        """
+        删除文件记录及其Storage对象（按内容块存储的块由cleanup_orphaned_files回收；
+        同一内容的其他文件记录仍引用的Storage对象保留）
+        
+        Args:
+            file_id: 文件ID
+        """
+        response = self.supabase.table("document_files")\
+            .delete()\
+            .eq("id", file_id)\
+            .execute()
+        storage_paths = [row["storage_path"] for row in response.data or [] if row.get("storage_path")]
+        if storage_paths:
+            orphaned = self.supabase.rpc("orphaned_storage_paths", {"paths": storage_paths}).execute()
+            storage_paths = [row["storage_path"] for row in orphaned.data or []]
+        if storage_paths:
+            self.supabase.storage.from_(self.bucket_name).remove(storage_paths)
+        self._signed_url_cache.clear()
+    
     async def store_file(self, file_content: bytes, filename: str, 
-                        collection_name: str = "default") -> dict:
+                        collection_name: str = "default", file_hash: Optional[str] = None) -> dict:
         """
         存储文件（异步版本，自动选择存储方式）
         
@@ -108,12 +232,14 @@ class HybridFileStorage:
             file_content: 文件内容
             filename: 文件名
             collection_name: 集合名称
+            file_hash: 调用方已计算好的SHA-256（十六进制），为空时在此计算
             
         Returns:
             文件信息字典
         """
         file_size = len(file_content)
-        file_hash = hashlib.sha256(file_content).hexdigest()
+        # 大文件哈希耗时明显，放到线程中计算，避免阻塞事件循环
+        file_hash = file_hash or await asyncio.to_thread(_hash_blob, file_content)
         
         # 检查文件是否已存在
         existing = await self._check_file_exists(file_hash)
@@ -131,40 +257,70 @@ class HybridFileStorage:
             "metadata": {"upload_source": "hybrid_storage"}
         }
         
-        if self.should_use_storage(file_size):
+        # 存储方式只判断一次
+        use_storage = file_size > self.SIZE_THRESHOLD
+        chunk_recipe = None
+        if use_storage:
+            chunk_recipe = await asyncio.to_thread(self._store_chunked_sync, file_content, file_info["content_type"])
+        
+        if chunk_recipe is not None:
+            # 大文件：按内容块去重存储到Storage
+            file_info["metadata"]["chunk_recipe"] = chunk_recipe
+            file_info.update({
+                "storage_path": None,
+                "file_content": None
+            })
+            self.logger.info(f"大文件按内容块存储到Storage: {filename} ({file_size} bytes, {len(chunk_recipe)} 个块)")
+        elif use_storage:
             # 大文件：使用Storage
-            storage_path = await self._store_in_storage(file_content, filename, file_hash)
+            storage_path = await self._store_in_storage(file_content, filename, file_hash, file_info["content_type"])
             file_info.update({
                 "storage_path": storage_path,
                 "file_content": None  # 不存储在数据库中
             })
             self.logger.info(f"大文件存储到Storage: {filename} ({file_size} bytes)")
         else:
-            # 小文件：使用数据库
+            # 小文件：使用数据库；文本类文件先用zstd压缩，减小行大小和读取时的TOAST I/O
+            # （PDF、DOCX、图片本身已压缩，再压缩收益很小）
+            if _ZSTD_COMPRESSOR is not None and file_info["content_type"].startswith("text/"):
+                file_content = _ZSTD_COMPRESSOR.compress(file_content)
+                file_info["metadata"]["compression"] = "zstd"
             file_info.update({
                 "storage_path": None,
                 "file_content": file_content
             })
-            self.logger.info(f"小文件存储到数据库: {filename} ({file_size} bytes)")
+            self.logger.info(f"小文件存储到数据库: {filename} ({file_size} bytes，存储 {len(file_content)} bytes)")
         
-        # 插入文件记录
-        result = self.supabase.table("document_files").insert(file_info).execute()
+        # 插入文件记录（同步请求放到线程中执行，多个store_file可被asyncio.gather真正并发）
+        result = await asyncio.to_thread(self.supabase.table("document_files").insert(file_info).execute)
         return result.data[0]
     
     def _store_in_storage_sync(self, file_content: bytes, filename: str, 
-                              file_hash: str) -> str:
-        """将文件存储到Supabase Storage（同步版本）"""
+                              file_hash: str, content_type: Optional[str] = None) -> str:
+        """将文件存储到Supabase Storage（同步版本；content_type为空时按文件名推断）"""
         # 使用哈希作为文件路径，避免重复和冲突
-        file_extension = Path(filename).suffix
-        storage_path = f"{file_hash[:2]}/{file_hash}{file_extension}"
+        storage_path = f"{file_hash[:2]}/{file_hash}{file_extension(filename)}"
+        content_type = content_type or self._guess_content_type(filename)
         
         try:
+            # 大文件优先经S3协议分片并发上传
+            if len(file_content) > self.MULTIPART_THRESHOLD:
+                s3_client = self._get_s3_client()
+                if s3_client is not None:
+                    self._upload_multipart(s3_client, file_content, storage_path, content_type)
+                    return storage_path
+            
+            # 未配置S3时，更大的文件走断点续传，网络中断只需重传当前分片
+            if len(file_content) > self.RESUMABLE_THRESHOLD and self.resumable_config:
+                self._upload_resumable(file_content, storage_path, content_type)
+                return storage_path
+            
             # 上传到Storage
             self.supabase.storage.from_(self.bucket_name).upload(
                 path=storage_path,
                 file=file_content,
                 file_options={
-                    "content-type": self._guess_content_type(filename),
+                    "content-type": content_type,
                     "cache-control": "3600"  # 1小时缓存
                 }
             )
@@ -174,26 +330,198 @@ class HybridFileStorage:
             raise
     
     async def _store_in_storage(self, file_content: bytes, filename: str, 
-                              file_hash: str) -> str:
-        """将文件存储到Supabase Storage"""
-        # 使用哈希作为文件路径，避免重复和冲突
-        file_extension = Path(filename).suffix
-        storage_path = f"{file_hash[:2]}/{file_hash}{file_extension}"
+                              file_hash: str, content_type: Optional[str] = None) -> str:
+        """将文件存储到Supabase Storage（在线程中执行上传，不阻塞事件循环）"""
+        return await asyncio.to_thread(self._store_in_storage_sync, file_content, filename, file_hash, content_type)
+    
+    def _store_chunked_sync(self, file_content: bytes, content_type: str) -> Optional[List[str]]:
+        """
+        按内容定义分块（FastCDC）存储文件：每个块以SHA-256指纹为键，
+        只上传document_file_chunks中尚不存在的块
+        
+        Args:
+            file_content: 文件内容
+            content_type: 文件MIME类型
+            
+        Returns:
+            Optional[List[str]]: 按顺序排列的内容块指纹；未启用、文件过小或分块存储失败时返回None（改为整体存储）
+        """
+        if not self.chunk_dedup or len(file_content) <= self.CDC_MAX_SIZE:
+            return None
         
         try:
-            # 上传到Storage
-            self.supabase.storage.from_(self.bucket_name).upload(
-                path=storage_path,
-                file=file_content,
-                file_options={
-                    "content-type": self._guess_content_type(filename),
-                    "cache-control": "3600"  # 1小时缓存
-                }
-            )
-            return storage_path
+            from fastcdc import fastcdc
+        except ImportError:
+            self.logger.warning("未安装fastcdc，大文件整体存储: uv add fastcdc")
+            self.chunk_dedup = False
+            return None
+        
+        try:
+            data = memoryview(file_content)
+            blocks = {}
+            recipe = []
+            for chunk in fastcdc(file_content, min_size=self.CDC_MIN_SIZE, avg_size=self.CDC_AVG_SIZE,
+                                 max_size=self.CDC_MAX_SIZE, fat=False):
+                block = data[chunk.offset:chunk.offset + chunk.length]
+                fp = _hash_blob(block)
+                blocks.setdefault(fp, block)
+                recipe.append(fp)
+            
+            # 一次请求刷新已存在内容块的最近使用时间，并据返回的记录得知哪些块已存在，只上传新块；
+            # 刷新后的块在清理的宽限期内不会被当作无引用的块回收
+            existing = self.supabase.table("document_file_chunks")\
+                .update({"last_used_at": datetime.now(timezone.utc).isoformat()})\
+                .in_("fp", list(blocks))\
+                .execute()
+            existing_fps = {row["fp"] for row in existing.data or []}
+            new_fps = [fp for fp in blocks if fp not in existing_fps]
+            
+            def upload(fp: str) -> dict:
+                storage_path = f"chunks/{fp[:2]}/{fp}"
+                self.supabase.storage.from_(self.bucket_name).upload(
+                    path=storage_path,
+                    file=blocks[fp].tobytes(),
+                    file_options={"content-type": "application/octet-stream", "upsert": "true"}
+                )
+                return {"fp": fp, "size": len(blocks[fp]), "storage_path": storage_path}
+            
+            if new_fps:
+                with ThreadPoolExecutor(max_workers=min(self.CDC_CONCURRENCY, len(new_fps))) as executor:
+                    rows = list(executor.map(upload, new_fps))
+                # 并发上传相同内容块时忽略主键冲突
+                self.supabase.table("document_file_chunks")\
+                    .upsert(rows, on_conflict="fp", ignore_duplicates=True)\
+                    .execute()
+            
+            self.logger.info(f"内容块去重: 共 {len(recipe)} 个块，新上传 {len(new_fps)} 个（{content_type}）")
+            return recipe
+            
         except Exception as e:
-            self.logger.error(f"Storage上传失败: {e}")
-            raise
+            self.logger.warning(f"内容块存储失败，改为整体存储: {e}")
+            return None
+    
+    def _load_chunked_sync(self, chunk_recipe: List[str]) -> bytes:
+        """按内容块指纹顺序下载并拼接文件内容（相同的块只下载一次）"""
+        unique_fps = list(dict.fromkeys(chunk_recipe))
+        
+        def download(fp: str) -> bytes:
+            return self._download_from_storage_sync(f"chunks/{fp[:2]}/{fp}")
+        
+        with ThreadPoolExecutor(max_workers=min(self.CDC_CONCURRENCY, len(unique_fps))) as executor:
+            blocks = dict(zip(unique_fps, executor.map(download, unique_fps)))
+        
+        return b"".join(blocks[fp] for fp in chunk_recipe)
+    
+    def _get_s3_client(self):
+        """
+        获取Storage的S3客户端（首次使用时创建）
+        
+        Returns:
+            boto3 S3客户端；未配置S3密钥或未安装boto3时返回None
+        """
+        if not self.s3_config:
+            return None
+        
+        with self._s3_lock:
+            if self._s3_client is None:
+                try:
+                    import boto3
+                    from botocore.config import Config
+                except ImportError:
+                    self.logger.warning("未安装boto3，大文件使用单次上传: uv add boto3")
+                    self.s3_config = None
+                    return None
+                
+                self._s3_client = boto3.client(
+                    "s3",
+                    config=Config(
+                        s3={"addressing_style": "path"},  # Supabase S3端点只支持路径风格
+                        retries={"max_attempts": 5, "mode": "standard"},  # 每个分片独立重试
+                        max_pool_connections=self.MULTIPART_CONCURRENCY
+                    ),
+                    **self.s3_config
+                )
+            return self._s3_client
+    
+    def _upload_multipart(self, s3_client, file_content: bytes, storage_path: str, content_type: str):
+        """经S3协议分片上传，多个分片在线程池中并发发送"""
+        from boto3.s3.transfer import TransferConfig
+        
+        s3_client.upload_fileobj(
+            io.BytesIO(file_content),
+            self.bucket_name,
+            storage_path,
+            ExtraArgs={"ContentType": content_type, "CacheControl": "max-age=3600"},
+            Config=TransferConfig(
+                multipart_threshold=self.MULTIPART_THRESHOLD,
+                multipart_chunksize=self.MULTIPART_CHUNK_SIZE,
+                max_concurrency=self.MULTIPART_CONCURRENCY
+            )
+        )
+        self.logger.info(f"分片上传到Storage完成: {storage_path} ({len(file_content)} bytes)")
+    
+    def _upload_resumable(self, file_content: bytes, storage_path: str, content_type: str):
+        """经TUS协议断点续传：先创建上传会话，再按固定大小分片依次PATCH，失败时从服务端记录的偏移处续传"""
+        import requests
+        
+        def encode(value: str) -> str:
+            return base64.b64encode(value.encode("utf-8")).decode("ascii")
+        
+        total = len(file_content)
+        data = memoryview(file_content)
+        
+        with requests.Session() as session:
+            session.headers.update({
+                "authorization": f"Bearer {self.resumable_config['api_key']}",
+                "apikey": self.resumable_config["api_key"],
+                "tus-resumable": "1.0.0",
+            })
+            
+            # 创建上传会话
+            response = session.post(
+                self.resumable_config["endpoint"],
+                headers={
+                    "upload-length": str(total),
+                    "x-upsert": "true",
+                    "upload-metadata": ",".join([
+                        f"bucketName {encode(self.bucket_name)}",
+                        f"objectName {encode(storage_path)}",
+                        f"contentType {encode(content_type)}",
+                        f"cacheControl {encode('3600')}",
+                    ]),
+                },
+                timeout=30
+            )
+            response.raise_for_status()
+            upload_url = response.headers["location"]
+            
+            offset = 0
+            retries = 0
+            while offset < total:
+                try:
+                    response = session.patch(
+                        upload_url,
+                        data=data[offset:offset + self.RESUMABLE_CHUNK_SIZE].tobytes(),
+                        headers={
+                            "upload-offset": str(offset),
+                            "content-type": "application/offset+octet-stream",
+                        },
+                        timeout=120
+                    )
+                    response.raise_for_status()
+                    offset = int(response.headers["upload-offset"])
+                    retries = 0
+                except Exception as e:
+                    retries += 1
+                    if retries > self.RESUMABLE_MAX_RETRIES:
+                        raise
+                    # 向服务端查询已接收的偏移，从该处继续上传
+                    self.logger.warning(f"分片上传失败，第{retries}次重试: {e}")
+                    head = session.head(upload_url, timeout=30)
+                    head.raise_for_status()
+                    offset = int(head.headers["upload-offset"])
+        
+        self.logger.info(f"断点续传上传到Storage完成: {storage_path} ({total} bytes)")
     
     def get_file_content_sync(self, file_id: str) -> Optional[Tuple[str, str, bytes]]:
         """
@@ -206,9 +534,9 @@ class HybridFileStorage:
             (filename, content_type, file_content) 或 None
         """
         try:
-            # 获取文件信息
+            # 获取文件信息（不含file_content，数据库中的内容按需单独读取）
             response = self.supabase.table("document_files")\
-                .select("*")\
+                .select(self.FILE_RECORD_COLUMNS)\
                 .eq("id", file_id)\
                 .execute()
             
@@ -216,14 +544,17 @@ class HybridFileStorage:
                 return None
             
             file_info = response.data[0]
+            chunk_recipe = (file_info.get("metadata") or {}).get("chunk_recipe")
             
-            if file_info.get("storage_path"):
+            if chunk_recipe:
+                # 按内容块从Storage下载后拼接
+                content = self._load_chunked_sync(chunk_recipe)
+            elif file_info.get("storage_path"):
                 # 从Storage下载
                 content = self._download_from_storage_sync(file_info["storage_path"])
             else:
                 # 从数据库获取
-                import base64
-                content = base64.b64decode(file_info["file_content"]) if file_info.get("file_content") else b""
+                content = self._decompress_db_content(file_info, self._fetch_db_content_sync(file_id))
             
             return (
                 file_info["filename"],
@@ -237,7 +568,7 @@ class HybridFileStorage:
     
     async def get_file_content(self, file_id: str) -> Optional[Tuple[str, str, bytes]]:
         """
-        获取文件内容
+        获取文件内容（Supabase客户端为同步实现，在线程中执行，不阻塞事件循环）
         
         Args:
             file_id: 文件ID
@@ -245,38 +576,28 @@ class HybridFileStorage:
         Returns:
             (filename, content_type, file_content) 或 None
         """
-        try:
-            # 获取文件信息
-            response = self.supabase.table("document_files")\
-                .select("*")\
-                .eq("id", file_id)\
-                .execute()
-            
-            if not response.data:
-                return None
-            
-            file_info = response.data[0]
-            
-            if file_info.get("storage_path"):
-                # 从Storage下载
-                content = await self._download_from_storage(file_info["storage_path"])
-            else:
-                # 从数据库获取
-                content = file_info["file_content"]
-            
-            return (
-                file_info["filename"],
-                file_info["content_type"],
-                content
-            )
-            
-        except Exception as e:
-            self.logger.error(f"获取文件内容失败: {e}")
-            return None
+        return await asyncio.to_thread(self.get_file_content_sync, file_id)
     
     async def get_download_url(self, file_id: str, expires_in: int = 3600) -> Optional[str]:
         """
-        获取文件下载URL（优化版本）
+        获取文件下载URL（在线程中执行，不阻塞事件循环）
+        
+        Args:
+            file_id: 文件ID
+            expires_in: URL过期时间（秒）
+            
+        Returns:
+            下载URL或None
+        """
+        # 缓存命中时直接返回，无需切换线程
+        cached = self._signed_url_cache.get((file_id, expires_in))
+        if cached is not None:
+            return cached
+        return await asyncio.to_thread(self.get_download_url_sync, file_id, expires_in)
+    
+    def get_download_url_sync(self, file_id: str, expires_in: int = 3600) -> Optional[str]:
+        """
+        获取文件下载URL（同步版本）
         
         Args:
             file_id: 文件ID
@@ -285,6 +606,12 @@ class HybridFileStorage:
         Returns:
             下载URL或None
         """
+        # 签名URL在有效期内可重复使用，命中时省去数据库查询和签名请求
+        cache_key = (file_id, expires_in)
+        cached = self._signed_url_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
             # 获取文件信息
             response = self.supabase.table("document_files")\
@@ -301,15 +628,53 @@ class HybridFileStorage:
                 # 大文件：返回Storage的签名URL
                 signed_url = self.supabase.storage.from_(self.bucket_name)\
                     .create_signed_url(file_info["storage_path"], expires_in)
+                ttl = expires_in - self.SIGNED_URL_SAFETY_MARGIN
+                if ttl > 0:
+                    self._signed_url_cache.set(cache_key, signed_url["signedURL"], ttl=ttl)
                 return signed_url["signedURL"]
             else:
-                # 小文件：返回API端点URL（需要通过应用服务器）
-                return f"/api/v1/documents/{file_id}/download"
+                # 存储在数据库中或按内容块存储的文件没有单一的Storage对象，由应用服务器读取后返回
+                return f"/api/v1/files/{file_id}/download"
                 
         except Exception as e:
             self.logger.error(f"获取下载URL失败: {e}")
             return None
     
+    def _fetch_db_content_sync(self, file_id: str) -> bytes:
+        """
+        读取存储在数据库中的文件内容
+        
+        有数据库引擎时直接查询bytea列，驱动返回原始bytes；否则经REST接口读取后解码
+        """
+        if self.db_engine is not None:
+            from sqlalchemy import text
+            
+            with self.db_engine.connect() as conn:
+                content = conn.execute(
+                    text("SELECT file_content FROM document_files WHERE id = :file_id"),
+                    {"file_id": file_id}
+                ).scalar()
+            return bytes(content) if content else b""
+        
+        response = self.supabase.table("document_files")\
+            .select("file_content")\
+            .eq("id", file_id)\
+            .execute()
+        content = response.data[0].get("file_content") if response.data else None
+        if not content:
+            return b""
+        # 直接调用C实现的解码，跳过base64模块的额外校验
+        return binascii.a2b_base64(content) if isinstance(content, str) else content
+    
+    def _decompress_db_content(self, file_info: dict, content: bytes) -> bytes:
+        """按文件记录的metadata解压数据库中存储的文件内容（未压缩时原样返回）"""
+        if not content or (file_info.get("metadata") or {}).get("compression") != "zstd":
+            return content
+        
+        if _ZSTD_DECOMPRESSOR is None:
+            raise ImportError("读取zstd压缩的文件需要安装zstandard: uv add zstandard")
+        return _ZSTD_DECOMPRESSOR.decompress(content)
+    
     def _download_from_storage_sync(self, storage_path: str) -> bytes:
         """从Storage下载文件（同步版本）"""
         try:
@@ -321,20 +686,14 @@ class HybridFileStorage:
             raise
     
     async def _download_from_storage(self, storage_path: str) -> bytes:
-        """从Storage下载文件"""
-        try:
-            response = self.supabase.storage.from_(self.bucket_name)\
-                .download(storage_path)
-            return response
-        except Exception as e:
-            self.logger.error(f"Storage下载失败: {e}")
-            raise
+        """从Storage下载文件（在线程中执行，不阻塞事件循环）"""
+        return await asyncio.to_thread(self._download_from_storage_sync, storage_path)
     
     def _check_file_exists_sync(self, file_hash: str) -> Optional[dict]:
         """检查文件是否已存在（同步版本）"""
         try:
             response = self.supabase.table("document_files")\
-                .select("*")\
+                .select(self.FILE_RECORD_COLUMNS)\
                 .eq("file_hash", file_hash)\
                 .execute()
             
@@ -343,52 +702,56 @@ class HybridFileStorage:
             return None
     
     async def _check_file_exists(self, file_hash: str) -> Optional[dict]:
-        """检查文件是否已存在"""
-        try:
-            response = self.supabase.table("document_files")\
-                .select("*")\
-                .eq("file_hash", file_hash)\
-                .execute()
-            
-            return response.data[0] if response.data else None
-        except Exception:
-            return None
+        """检查文件是否已存在（在线程中执行，不阻塞事件循环）"""
+        return await asyncio.to_thread(self._check_file_exists_sync, file_hash)
     
-    def _guess_content_type(self, filename: str) -> str:
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _guess_content_type(filename: str) -> str:
         """根据文件扩展名猜测MIME类型"""
-        extension = Path(filename).suffix.lower()
-        content_types = {
-            '.pdf': 'application/pdf',
-            '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            '.doc': 'application/msword',
-            '.txt': 'text/plain',
-            '.md': 'text/markdown',
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.png': 'image/png',
-            '.gif': 'image/gif',
-        }
-        return content_types.get(extension, 'application/octet-stream')
+        return _CONTENT_TYPES.get(file_extension(filename).lower(), 'application/octet-stream')
     
     async def cleanup_orphaned_files(self) -> int:
-        """清理孤立文件"""
+        """
+        清理孤立文件：Storage中没有文件记录引用的对象，
+        以及没有任何文件的chunk_recipe引用的内容块（连同其document_file_chunks记录）
+        """
         try:
-            # 获取Storage中的孤立文件
-            storage_files = self.supabase.storage.from_(self.bucket_name).list()
-            db_paths = self.supabase.table("document_files")\
-                .select("storage_path")\
-                .not_.is_("storage_path", None)\
-                .execute()
+            # 不再被引用的内容块：数据库端删除记录并返回其Storage路径
+            released = await asyncio.to_thread(
+                lambda: self.supabase.rpc(
+                    "release_unreferenced_file_chunks", {"min_age_seconds": self.CLEANUP_MIN_AGE}
+                ).execute()
+            )
+            orphaned = {row["storage_path"] for row in released.data or []}
+            
+            # 文件和内容块都按哈希前两位分目录存放（见_store_in_storage_sync、_store_chunked_sync），
+            # 共512个目录并发扫描，找出没有记录引用的对象（如上传后写入记录失败留下的对象）
+            semaphore = asyncio.Semaphore(self.CLEANUP_CONCURRENCY)
+            
+            async def find_in_prefix(prefix: str) -> List[str]:
+                async with semaphore:
+                    return await asyncio.to_thread(self._find_orphaned_paths_sync, prefix)
+            
+            prefixes = [f"{i:02x}" for i in range(256)]
+            prefixes += [f"chunks/{prefix}" for prefix in prefixes]
+            results = await asyncio.gather(*(find_in_prefix(prefix) for prefix in prefixes))
+            orphaned.update(path for paths in results for path in paths)
+            orphaned_paths = list(orphaned)
+            
+            # 汇总后按批删除（remove接受路径列表，单次最多1000个），多批并发
+            bucket = self.supabase.storage.from_(self.bucket_name)
+            remove_semaphore = asyncio.Semaphore(self.CLEANUP_REMOVE_CONCURRENCY)
             
-            db_paths_set = {item["storage_path"] for item in db_paths.data}
-            orphaned_count = 0
+            async def remove_batch(batch: List[str]):
+                async with remove_semaphore:
+                    await asyncio.to_thread(bucket.remove, batch)
             
-            for file_obj in storage_files:
-                if file_obj["name"] not in db_paths_set:
-                    # 删除孤立文件
-                    self.supabase.storage.from_(self.bucket_name)\
-                        .remove([file_obj["name"]])
-                    orphaned_count += 1
+            await asyncio.gather(*(
+                remove_batch(orphaned_paths[i:i + self.CLEANUP_REMOVE_BATCH_SIZE])
+                for i in range(0, len(orphaned_paths), self.CLEANUP_REMOVE_BATCH_SIZE)
+            ))
+            orphaned_count = len(orphaned_paths)
             
             self.logger.info(f"清理了 {orphaned_count} 个孤立文件")
             return orphaned_count
@@ -396,3 +759,26 @@ class HybridFileStorage:
         except Exception as e:
             self.logger.error(f"清理孤立文件失败: {e}")
             return 0
+    
+    def _find_orphaned_paths_sync(self, prefix: str) -> List[str]:
+        """分页列出一个哈希前缀目录下的对象，由数据库筛出没有文件记录或内容块记录引用的路径"""
+        bucket = self.supabase.storage.from_(self.bucket_name)
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.CLEANUP_MIN_AGE)
+        
+        paths = []
+        offset = 0
+        while True:
+            page = bucket.list(prefix, {"limit": self.CLEANUP_PAGE_SIZE, "offset": offset})
+            paths.extend(
+                f"{prefix}/{file_obj['name']}" for file_obj in page
+                if not _created_after(file_obj, cutoff)
+            )
+            if len(page) < self.CLEANUP_PAGE_SIZE:
+                break
+            offset += self.CLEANUP_PAGE_SIZE
+        
+        if not paths:
+            return []
+        
+        response = self.supabase.rpc("orphaned_storage_paths", {"paths": paths}).execute()
+        return [row["storage_path"] for row in response.data or []]
@@ -1,10 +1,29 @@
 """日志配置工具"""
 
+import os
 import sys
 from pathlib import Path
 from loguru import logger
 
 
+def _zstd_compress_file(path: str):
+    """将轮转出的日志文件流式压缩为.zst并删除原文件"""
+    import zstandard
+    
+    with open(path, "rb") as src, open(f"{path}.zst", "wb") as dst:
+        zstandard.ZstdCompressor(level=3).copy_stream(src, dst)
+    os.remove(path)
+
+
+def _rotation_compression():
+    """轮转日志的压缩方式：已安装zstandard时使用zstd，否则使用gzip"""
+    try:
+        import zstandard  # noqa: F401
+        return _zstd_compress_file
+    except ImportError:
+        return "gz"
+
+
 def setup_logger(
     log_level: str = "INFO",
     log_file: str = None,
@@ -23,16 +42,27 @@ def setup_logger(
     # 移除默认handler
     logger.remove()
     
-    # 添加控制台handler
-    logger.add(
-        sys.stdout,
-        level=log_level,
-        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | "
-               "<level>{level: <8}</level> | "
-               "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | "
-               "<level>{message}</level>",
-        colorize=True
-    )
+    # 添加控制台handler：只有终端才输出彩色格式，重定向到文件或日志采集时使用不解析颜色标签的纯文本格式；
+    # enqueue=True时格式化和写入在后台线程完成，调用方只需把记录放入队列
+    if sys.stdout.isatty():
+        logger.add(
+            sys.stdout,
+            level=log_level,
+            format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | "
+                   "<level>{level: <8}</level> | "
+                   "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> | "
+                   "<level>{message}</level>",
+            colorize=True,
+            enqueue=True
+        )
+    else:
+        logger.add(
+            sys.stdout,
+            level=log_level,
+            format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} | {message}",
+            colorize=False,
+            enqueue=True
+        )
     
     # 如果指定了日志文件，添加文件handler
     if log_file:
@@ -45,7 +75,9 @@ def setup_logger(
             format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} | {message}",
             rotation=rotation,
             retention=retention,
-            encoding="utf-8"
+            compression=_rotation_compression(),  # 轮转时压缩旧文件，不影响正常写日志
+            encoding="utf-8",
+            enqueue=True
         )
     
     return logger
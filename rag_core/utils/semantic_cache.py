@@ -0,0 +1,146 @@
+"""
+语义查询缓存
+按问题向量的余弦相似度命中缓存，相似问题直接返回已有回答，跳过检索和LLM生成；
+完全相同的问题先走精确匹配，连问题向量化也可以跳过
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from ..config.models import RAGResponse
+
+
+class SemanticCache:
+    """基于余弦相似度的LRU问答缓存"""
+
+    def __init__(self, threshold: float = 0.95, max_size: int = 256):
+        """
+        初始化语义缓存
+
+        Args:
+            threshold: 命中所需的最小余弦相似度
+            max_size: 最大缓存条目数（0表示禁用）
+        """
+        self.threshold = threshold
+        self.max_size = max_size
+        # 键 -> (向量在矩阵中的行号, 响应)，按最近使用排序
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._exact: "OrderedDict[bytes, RAGResponse]" = OrderedDict()
+        # 预分配的连续float32矩阵，前 len(_entries) 行有效；淘汰条目的行直接被新条目复用，
+        # 写入只拷贝一行，查找时无需重新堆叠矩阵
+        self._matrix: Optional[np.ndarray] = None
+        self._row_keys: List[int] = []
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """缓存是否启用"""
+        return self.max_size > 0
+
+    @staticmethod
+    def normalize(vector: List[float]) -> Optional[np.ndarray]:
+        """将向量转换为float32并做L2归一化，零向量返回None"""
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if norm == 0:
+            return None
+        return vec / norm
+
+    @staticmethod
+    def _question_key(question: str) -> bytes:
+        """精确匹配的键：忽略首尾空白和大小写"""
+        return hashlib.sha256(question.strip().lower().encode("utf-8")).digest()
+
+    def lookup_exact(self, question: str) -> Optional[RAGResponse]:
+        """
+        按问题原文精确查找缓存回答（无需向量化）
+
+        Args:
+            question: 用户问题
+
+        Returns:
+            Optional[RAGResponse]: 命中时返回缓存的响应，否则返回None
+        """
+        key = self._question_key(question)
+        with self._lock:
+            response = self._exact.get(key)
+            if response is not None:
+                self._exact.move_to_end(key)
+            return response
+
+    def lookup(self, vector: np.ndarray) -> Optional[RAGResponse]:
+        """
+        查找与给定（已归一化）向量最相似的缓存回答
+
+        Args:
+            vector: 归一化后的问题向量
+
+        Returns:
+            Optional[RAGResponse]: 命中时返回缓存的响应，否则返回None
+        """
+        with self._lock:
+            if not self._entries or self._matrix.shape[1] != vector.shape[0]:
+                return None
+
+            # 向量均已归一化，一次矩阵乘法即得到全部余弦相似度
+            scores = self._matrix[:len(self._entries)] @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+
+            best_key = self._row_keys[best]
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key][1]
+
+    def add(self, vector: Optional[np.ndarray], response: RAGResponse, question: Optional[str] = None):
+        """
+        写入缓存，超出容量时淘汰最久未使用的条目
+
+        Args:
+            vector: 归一化后的问题向量（向量化失败时为None，只写入精确匹配）
+            response: 查询响应
+            question: 用户问题原文，用于精确匹配
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            if question is not None:
+                key = self._question_key(question)
+                self._exact[key] = response
+                self._exact.move_to_end(key)
+                while len(self._exact) > self.max_size:
+                    self._exact.popitem(last=False)
+
+            if vector is not None:
+                # 向量维度变化（如更换嵌入模型）时重新分配矩阵
+                if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                    self._matrix = np.empty((self.max_size, vector.shape[0]), dtype=np.float32)
+                    self._row_keys = [0] * self.max_size
+                    self._entries.clear()
+
+                if len(self._entries) < self.max_size:
+                    row = len(self._entries)
+                else:
+                    # 已满时淘汰最久未使用的条目，复用其所在行
+                    _, (row, _) = self._entries.popitem(last=False)
+
+                key = self._next_key
+                self._next_key += 1
+                self._matrix[row] = vector
+                self._row_keys[row] = key
+                self._entries[key] = (row, response)
+
+    def clear(self):
+        """清空缓存（知识库内容变更时调用）"""
+        with self._lock:
+            self._entries.clear()
+            self._exact.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -9,6 +9,10 @@ from .logger import rag_logger
 class SmartTextSplitter:
     """智能文本分割器，支持按段落、句子和字符数分割"""
     
+    # 段落分隔（双换行符）和中英文句子分隔正则，类加载时编译一次
+    _PARA_RE = re.compile(r'\n\s*\n')
+    _SENT_RE = re.compile(r'[.!?。！？；;]\s+')
+    
     def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
         """
         初始化文本分割器
@@ -72,43 +76,48 @@ class SmartTextSplitter:
         Returns:
             List[str]: 分割后的文本块列表
         """
-        if not text or len(text) <= self.chunk_size:
+        # 循环中频繁使用，绑定为局部变量
+        chunk_size = self.chunk_size
+        
+        if not text or len(text) <= chunk_size:
             return [text] if text else []
         
         # 首先尝试按段落分割
         paragraphs = self._split_by_paragraphs(text)
         
         chunks = []
-        current_chunk = ""
+        # 当前chunk以段落列表+累计长度维护，满了再一次性拼接，避免反复拼接长字符串
+        current_parts = []
+        current_len = 0
         
         for paragraph in paragraphs:
             # 如果单个段落就超过chunk_size，需要进一步分割
-            if len(paragraph) > self.chunk_size:
+            if len(paragraph) > chunk_size:
                 # 先保存当前chunk（如果有内容）
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                    current_chunk = ""
+                if current_parts:
+                    chunks.append("\n\n".join(current_parts).strip())
+                    current_parts, current_len = [], 0
                 
                 # 分割大段落
                 sub_chunks = self._split_large_paragraph(paragraph)
                 chunks.extend(sub_chunks)
                 
-            elif len(current_chunk) + len(paragraph) + 1 <= self.chunk_size:
-                # 段落可以加入当前chunk
-                if current_chunk:
-                    current_chunk += "\n\n" + paragraph
-                else:
-                    current_chunk = paragraph
+            elif current_len + len(paragraph) + 1 <= chunk_size:
+                # 段落可以加入当前chunk（段落间以两个换行分隔）
+                if current_parts:
+                    current_len += 2
+                current_parts.append(paragraph)
+                current_len += len(paragraph)
                     
             else:
                 # 当前chunk已满，开始新chunk
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = paragraph
+                if current_parts:
+                    chunks.append("\n\n".join(current_parts).strip())
+                current_parts, current_len = [paragraph], len(paragraph)
         
         # 添加最后一个chunk
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+        if current_parts:
+            chunks.append("\n\n".join(current_parts).strip())
         
         # 处理重叠
         if self.chunk_overlap > 0:
@@ -119,7 +128,7 @@ class SmartTextSplitter:
     def _split_by_paragraphs(self, text: str) -> List[str]:
         """按段落分割文本"""
         # 按双换行符分割段落
-        paragraphs = re.split(r'\n\s*\n', text)
+        paragraphs = self._PARA_RE.split(text)
         return [p.strip() for p in paragraphs if p.strip()]
     
     def _split_large_paragraph(self, paragraph: str) -> List[str]:
@@ -127,82 +136,72 @@ class SmartTextSplitter:
         # 首先尝试按句子分割
         sentences = self._split_by_sentences(paragraph)
         
+        chunk_size = self.chunk_size
         chunks = []
-        current_chunk = ""
+        current_parts = []
+        current_len = 0
         
         for sentence in sentences:
-            if len(sentence) > self.chunk_size:
+            if len(sentence) > chunk_size:
                 # 单个句子就超过限制，按字符强制分割
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                    current_chunk = ""
+                if current_parts:
+                    chunks.append(" ".join(current_parts).strip())
+                    current_parts, current_len = [], 0
                 
-                # 强制按字符分割
-                for i in range(0, len(sentence), self.chunk_size):
-                    chunk = sentence[i:i + self.chunk_size]
-                    chunks.append(chunk)
+                # 强制按字符分割（每个片段只切片一次；chunk_size按字符计，直接在str上切片，
+                # 无需先编码为UTF-8字节再逐块解码）
+                chunks.extend(sentence[i:i + chunk_size] for i in range(0, len(sentence), chunk_size))
                     
-            elif len(current_chunk) + len(sentence) + 1 <= self.chunk_size:
-                if current_chunk:
-                    current_chunk += " " + sentence
-                else:
-                    current_chunk = sentence
+            elif current_len + len(sentence) + 1 <= chunk_size:
+                if current_parts:
+                    current_len += 1
+                current_parts.append(sentence)
+                current_len += len(sentence)
             else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = sentence
+                if current_parts:
+                    chunks.append(" ".join(current_parts).strip())
+                current_parts, current_len = [sentence], len(sentence)
         
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+        if current_parts:
+            chunks.append(" ".join(current_parts).strip())
         
         return chunks
     
     def _split_by_sentences(self, text: str) -> List[str]:
-        """按句子分割文本"""
-        # 中英文句子分割正则
-        sentence_pattern = r'[.!?。！？；;]\s+'
-        sentences = re.split(sentence_pattern, text)
-        
-        # 处理分割后的句子
+        """按句子分割文本（单次遍历，句末标点直接取自匹配到的分隔符）"""
         result = []
-        for i, sentence in enumerate(sentences):
-            sentence = sentence.strip()
+        pos = 0
+        for match in self._SENT_RE.finditer(text):
+            sentence = text[pos:match.start()].strip()
             if sentence:
-                # 为句子添加标点符号（除了最后一个）
-                if i < len(sentences) - 1:
-                    # 尝试从原文本中找到对应的标点
-                    next_start = text.find(sentence) + len(sentence)
-                    if next_start < len(text):
-                        punct = text[next_start:next_start + 1]
-                        if punct in '.!?。！？；;':
-                            sentence += punct
-                
-                result.append(sentence)
+                result.append(sentence + match.group()[0])
+            pos = match.end()
+        
+        # 最后一句之后没有分隔符
+        sentence = text[pos:].strip()
+        if sentence:
+            result.append(sentence)
         
         return result
     
     def _add_overlap(self, chunks: List[str]) -> List[str]:
-        """为文本块添加重叠内容"""
+        """为文本块添加重叠内容（每个块只拼接一次，前后重叠片段预先各切一次）"""
         if len(chunks) <= 1:
             return chunks
         
-        overlapped_chunks = []
+        last = len(chunks) - 1
+        # tails[i]为第i个块的结尾部分，heads[i]为第i+1个块的开始部分
+        tails = [chunk[-self.chunk_overlap:] for chunk in chunks[:-1]]
+        heads = [chunk[:self.chunk_overlap] for chunk in chunks[1:]]
         
+        overlapped_chunks = []
         for i, chunk in enumerate(chunks):
-            new_chunk = chunk
-            
-            # 添加前一个chunk的结尾部分
-            if i > 0:
-                prev_chunk = chunks[i - 1]
-                overlap_text = prev_chunk[-self.chunk_overlap:]
-                new_chunk = overlap_text + "\n\n" + new_chunk
-            
-            # 添加下一个chunk的开始部分
-            if i < len(chunks) - 1:
-                next_chunk = chunks[i + 1]
-                overlap_text = next_chunk[:self.chunk_overlap]
-                new_chunk = new_chunk + "\n\n" + overlap_text
-            
-            overlapped_chunks.append(new_chunk)
+            if i == 0:
+                parts = (chunk, heads[0])
+            elif i == last:
+                parts = (tails[i - 1], chunk)
+            else:
+                parts = (tails[i - 1], chunk, heads[i])
+            overlapped_chunks.append("\n\n".join(parts))
         
-        return overlapped_chunks
\ No newline at end of file
+        return overlapped_chunks
@@ -0,0 +1,72 @@
+"""
+带过期时间的进程内缓存
+用于文件列表等读多写少的元数据查询，短时间内的重复请求直接返回缓存结果
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """按写入时间过期的LRU缓存（线程安全）"""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 15.0):
+        """
+        初始化缓存
+
+        Args:
+            maxsize: 最大缓存条目数
+            ttl: 条目存活时间（秒）
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        读取缓存
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Optional[Any]: 未过期时返回缓存值，否则返回None
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        写入缓存，超出容量时淘汰最久未使用的条目
+        
+        Args:
+            key: 缓存键
+            value: 缓存值
+            ttl: 该条目的存活时间（秒），为空时使用默认值
+        """
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """清空缓存（数据变更时调用）"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
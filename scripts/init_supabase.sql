@@ -36,11 +36,27 @@ CREATE TABLE IF NOT EXISTS document_metadata (
     metadata JSONB DEFAULT '{}'::jsonb
 );
 
+-- 创建文件内容块表（按内容定义分块去重：相同内容块在Storage中只存一份，
+-- 文件记录的metadata.chunk_recipe按顺序保存其内容块指纹）
+CREATE TABLE IF NOT EXISTS document_file_chunks (
+    fp VARCHAR(64) PRIMARY KEY, -- 内容块SHA-256指纹
+    size BIGINT NOT NULL,
+    storage_path TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    last_used_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() -- 最近一次被上传的文件引用的时间，清理时据此留出宽限期
+);
+
 -- 创建文件存储表索引
 CREATE INDEX IF NOT EXISTS idx_document_files_filename ON document_files(filename);
-CREATE INDEX IF NOT EXISTS idx_document_files_hash ON document_files(file_hash);
+-- 按哈希去重检查时可走仅索引扫描（覆盖id和storage_path）
+DROP INDEX IF EXISTS idx_document_files_hash;
+CREATE INDEX IF NOT EXISTS idx_document_files_hash_covering ON document_files(file_hash) INCLUDE (id, storage_path);
 CREATE INDEX IF NOT EXISTS idx_document_files_collection ON document_files(collection_name);
+CREATE INDEX IF NOT EXISTS idx_document_files_storage_path ON document_files(storage_path) WHERE storage_path IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_document_files_created_at ON document_files(created_at);
+-- 清理内容块时按指纹查找引用它的文件（chunk_recipe为指纹数组，?运算符可走GIN索引）
+CREATE INDEX IF NOT EXISTS idx_document_files_chunk_recipe ON document_files USING gin ((metadata->'chunk_recipe'));
+CREATE INDEX IF NOT EXISTS idx_document_file_chunks_storage_path ON document_file_chunks(storage_path);
 CREATE INDEX IF NOT EXISTS idx_document_files_content_type ON document_files(content_type);
 
 -- 创建文档元数据表索引
@@ -235,6 +251,37 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- 找出Storage中没有文件记录引用的对象路径（在数据库端做反连接，客户端无需拉取全部storage_path）
+CREATE OR REPLACE FUNCTION orphaned_storage_paths(paths TEXT[])
+RETURNS TABLE(storage_path TEXT) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT p.path
+    FROM unnest(paths) AS p(path)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM document_files df
+        WHERE df.storage_path = p.path
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM document_file_chunks c
+        WHERE c.storage_path = p.path
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- 删除没有任何文件的chunk_recipe引用的内容块记录，返回其Storage路径供删除对象；
+-- 最近min_age_seconds秒内被使用过的块跳过（上传中的文件尚未写入文件记录）
+CREATE OR REPLACE FUNCTION release_unreferenced_file_chunks(min_age_seconds INTEGER DEFAULT 3600)
+RETURNS TABLE(storage_path TEXT) AS $$
+    DELETE FROM document_file_chunks c
+    WHERE c.last_used_at < NOW() - make_interval(secs => min_age_seconds)
+      AND NOT EXISTS (
+          SELECT 1 FROM document_files df
+          WHERE df.metadata->'chunk_recipe' ? c.fp
+      )
+    RETURNING c.storage_path;
+$$ LANGUAGE sql;
+
 -- 清理过期任务的函数
 CREATE OR REPLACE FUNCTION cleanup_old_tasks(days_old INTEGER DEFAULT 7)
 RETURNS INTEGER AS $$
@@ -253,6 +300,7 @@ $$ LANGUAGE plpgsql;
 -- SELECT cron.schedule('cleanup-old-tasks', '0 2 * * *', 'SELECT cleanup_old_tasks(7);');
 
 COMMENT ON TABLE document_files IS '原始文件存储表，存储上传文件的二进制内容和元信息';
+COMMENT ON TABLE document_file_chunks IS '文件内容块表，按内容定义分块去重后的唯一内容块';
 COMMENT ON TABLE document_metadata IS '文档元数据表，存储文档处理后的信息和分块统计';
 COMMENT ON TABLE knowledge_bases IS '知识库表，支持多个知识库管理';
 COMMENT ON TABLE task_status IS '任务状态表，跟踪异步任务的执行状态';
@@ -262,6 +310,8 @@ COMMENT ON FUNCTION get_knowledge_base_stats IS '获取指定知识库的统计
 COMMENT ON FUNCTION check_file_exists IS '检查文件是否已存在（基于哈希去重）';
 COMMENT ON FUNCTION get_file_content IS '获取指定文件的原始内容';
 COMMENT ON FUNCTION cleanup_orphaned_files IS '清理没有关联文档元数据的孤立文件';
+COMMENT ON FUNCTION orphaned_storage_paths IS '返回给定Storage路径中没有文件记录或内容块记录引用的路径';
+COMMENT ON FUNCTION release_unreferenced_file_chunks IS '删除不再被任何文件引用的内容块记录并返回其Storage路径';
 COMMENT ON FUNCTION cleanup_old_tasks IS '清理指定天数之前的旧任务记录';
 
 -- =====================================
@@ -339,6 +389,54 @@ BEGIN
     END;
 END $$;
 
+-- =====================================
+-- langchain_pg_embedding 向量索引（PGVector检索表）
+-- =====================================
+
+-- HNSW索引要求embedding列声明维度；旧版本创建的表为无维度的vector类型。
+-- 维度必须与嵌入模型（EMBEDDING_DIMENSION）一致，这里不写死：只在列尚未声明维度、
+-- 且已有数据的维度唯一时按数据的维度声明；表为空时保持原样，失败时跳过
+DO $$
+DECLARE
+    dims INTEGER[];
+BEGIN
+    IF to_regclass('public.langchain_pg_embedding') IS NOT NULL THEN
+        BEGIN
+            IF (SELECT atttypmod FROM pg_attribute
+                WHERE attrelid = 'public.langchain_pg_embedding'::regclass
+                  AND attname = 'embedding') = -1 THEN
+                SELECT array_agg(DISTINCT vector_dims(embedding)) INTO dims
+                FROM langchain_pg_embedding
+                WHERE embedding IS NOT NULL;
+                
+                IF array_length(dims, 1) = 1 THEN
+                    EXECUTE format('ALTER TABLE langchain_pg_embedding ALTER COLUMN embedding TYPE vector(%s)', dims[1]);
+                ELSE
+                    RAISE NOTICE '⚠️ embedding列未声明维度且无法从数据确定（表为空或维度不一致），跳过HNSW索引';
+                    RETURN;
+                END IF;
+            END IF;
+            
+            CREATE INDEX IF NOT EXISTS idx_langchain_pg_embedding_hnsw
+            ON langchain_pg_embedding USING hnsw (embedding vector_cosine_ops)
+            WITH (m = 16, ef_construction = 64);
+            
+            RAISE NOTICE '✅ langchain_pg_embedding HNSW索引创建成功';
+        EXCEPTION WHEN OTHERS THEN
+            RAISE NOTICE '⚠️ langchain_pg_embedding HNSW索引创建跳过: %', SQLERRM;
+        END;
+    END IF;
+END $$;
+
+-- 按集合和文件名查找分块（分块列表、按文件删除）的表达式索引
+DO $$
+BEGIN
+    IF to_regclass('public.langchain_pg_embedding') IS NOT NULL THEN
+        CREATE INDEX IF NOT EXISTS idx_langchain_pg_embedding_filename
+        ON langchain_pg_embedding (collection_id, (cmetadata->>'filename'));
+    END IF;
+END $$;
+
 -- 向量表注释
 COMMENT ON TABLE documents IS '向量文档表，存储文档分块内容和向量嵌入（基于Supabase官方推荐结构）';
 COMMENT ON FUNCTION match_documents IS '文档相似度搜索函数，基于向量嵌入查找相似文档';
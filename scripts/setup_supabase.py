@@ -5,11 +5,16 @@ Supabase设置脚本
 """
 
 import os
+import re
 import sys
 import subprocess
 from pathlib import Path
 
 
+# 美元符号引用的开始标记（$$ 或 $tag$），函数体和DO块中的分号不是语句结束
+_DOLLAR_QUOTE_RE = re.compile(r'\$([A-Za-z_][A-Za-z0-9_]*)?\$')
+
+
 def run_command(cmd, check=True):
     """运行命令"""
     print(f"执行命令: {cmd}")
@@ -106,13 +111,16 @@ def init_supabase_database(env_vars):
         print("错误: 找不到init_supabase.sql文件")
         sys.exit(1)
     
+    # SQL脚本只读取一次，各种执行方式共用
+    sql_content = sql_file.read_text(encoding='utf-8')
+    
     # 尝试多种方法执行SQL
     success = False
     
     # 方法1: 尝试使用psycopg直接连接
     try:
         import psycopg
-        success = init_with_psycopg(env_vars, sql_file)
+        success = init_with_psycopg(env_vars, sql_content)
         if success:
             print("✅ 数据库初始化完成（使用psycopg）")
             return
@@ -123,7 +131,7 @@ def init_supabase_database(env_vars):
     
     # 方法2: 尝试使用Supabase Python客户端
     try:
-        success = init_with_supabase_client(env_vars, sql_file)
+        success = init_with_supabase_client(env_vars, sql_content)
         if success:
             print("✅ 数据库初始化完成（使用Supabase客户端）")
             return
@@ -143,8 +151,8 @@ def init_supabase_database(env_vars):
     print_manual_setup_guide(sql_file)
 
 
-def init_with_psycopg(env_vars, sql_file):
-    """使用psycopg直接执行SQL"""
+def init_with_psycopg(env_vars, sql_content):
+    """使用psycopg直接执行SQL（整个脚本在一个事务中执行，失败时整体回滚）"""
     import psycopg
     
     connection_params = {
@@ -157,15 +165,75 @@ def init_with_psycopg(env_vars, sql_file):
     }
     
     with psycopg.connect(**connection_params) as conn:
-        with conn.cursor() as cur:
-            sql_content = sql_file.read_text(encoding='utf-8')
-            cur.execute(sql_content)
-            conn.commit()
+        with conn.transaction():
+            # 初始化脚本是可重复执行的DDL，无需等待WAL刷盘
+            conn.execute("SET LOCAL synchronous_commit = off")
+            conn.execute(sql_content)
     
     return True
 
 
-def init_with_supabase_client(env_vars, sql_file):
+def split_sql_statements(sql_content):
+    """
+    按分号拆分SQL脚本，跳过注释、字符串和美元符号引用（函数体、DO块）中的分号
+    
+    Args:
+        sql_content: SQL脚本内容
+        
+    Returns:
+        语句列表（不含只有注释的片段）
+    """
+    statements = []
+    start = 0
+    i = 0
+    length = len(sql_content)
+    
+    while i < length:
+        char = sql_content[i]
+        
+        if sql_content.startswith('--', i):
+            # 行注释：跳到行尾
+            end = sql_content.find('\n', i)
+            i = length if end < 0 else end + 1
+            continue
+        
+        if char == "'":
+            # 字符串常量（两个连续单引号表示转义）
+            i += 1
+            while i < length:
+                if sql_content[i] == "'":
+                    if sql_content.startswith("''", i):
+                        i += 2
+                        continue
+                    break
+                i += 1
+            i += 1
+            continue
+        
+        if char == '$':
+            match = _DOLLAR_QUOTE_RE.match(sql_content, i)
+            if match:
+                tag = match.group()
+                end = sql_content.find(tag, match.end())
+                i = length if end < 0 else end + len(tag)
+                continue
+        
+        if char == ';':
+            statements.append(sql_content[start:i])
+            start = i + 1
+        
+        i += 1
+    
+    statements.append(sql_content[start:])
+    
+    # 去掉空白和只有注释的片段
+    return [
+        stmt.strip() for stmt in statements
+        if re.sub(r'--[^\n]*', '', stmt).strip()
+    ]
+
+
+def init_with_supabase_client(env_vars, sql_content):
     """使用Supabase客户端执行SQL"""
     from supabase import create_client
     
@@ -174,18 +242,13 @@ def init_with_supabase_client(env_vars, sql_file):
         env_vars.get('SUPABASE_SERVICE_KEY', env_vars['SUPABASE_KEY'])
     )
     
-    sql_content = sql_file.read_text(encoding='utf-8')
-    
-    # 分割SQL语句（简单分割，可能需要改进）
-    statements = [stmt.strip() for stmt in sql_content.split(';') if stmt.strip()]
-    
-    for statement in statements:
-        if statement and not statement.startswith('--'):
-            try:
-                supabase.rpc('exec_sql', {'sql': statement})
-            except Exception as e:
-                # 某些语句可能失败（如表已存在），继续执行
-                print(f"执行语句时警告: {str(e)[:100]}...")
+    # 语句之间存在依赖（先建表再建索引、函数），按顺序执行
+    for statement in split_sql_statements(sql_content):
+        try:
+            supabase.rpc('exec_sql', {'sql': statement}).execute()
+        except Exception as e:
+            # 某些语句可能失败（如表已存在），继续执行
+            print(f"执行语句时警告: {str(e)[:100]}...")
     
     return True
 